@@ -1,6 +1,5 @@
 import platform
 import subprocess
-import time
 
 import pyttsx4
 import logging
@@ -8,14 +7,18 @@ from queue import Queue
 from threading import Thread
 
 from lemon_pi.car.event_defs import ButtonPressEvent, CompleteLapEvent, AudioAlarmEvent, RacePositionEvent, \
-    DriverMessageEvent
-from lemon_pi.shared.events import EventHandler
+    DriverMessageEvent, LapLossesEvent
+from lemon_pi.shared.clock import Clock
+from lemon_pi.shared.events import EventHandler, Dispatch
 
 from python_settings import settings
 
 
 logger = logging.getLogger(__name__)
 
+# losing less time than this against the optimal lap isn't worth mentioning
+ANNOUNCE_LOSS_SECONDS = 0.5
+
 
 def get_speech_driver():
     os_type = platform.system()
@@ -29,6 +32,9 @@ def get_speech_driver():
 
 class Audio(Thread, EventHandler):
 
+    # the click is played in a subprocess, which we don't wait for on the gps thread
+    dispatch = Dispatch.SERIAL
+
     number_to_text = {
         '0': "O.",
         '1': "one",
@@ -42,8 +48,9 @@ class Audio(Thread, EventHandler):
         '9': "nine"
     }
 
-    def __init__(self):
+    def __init__(self, clock: Clock = None):
         Thread.__init__(self, daemon=True)
+        self.clock = clock or Clock.get_instance()
         self.engine = pyttsx4.init(get_speech_driver())
         self.engine.setProperty('volume', 1.0)
         # set 150 words per minute as the rate
@@ -53,33 +60,26 @@ class Audio(Thread, EventHandler):
         self.queue = Queue()
         self.click_sound = 'resources/sounds/click.wav'
         self.last_race_announcement_time = 0
-        ButtonPressEvent.register_handler(self)
-        CompleteLapEvent.register_handler(self)
-        AudioAlarmEvent.register_handler(self)
-        RacePositionEvent.register_handler(self)
-        DriverMessageEvent.register_handler(self)
-
-    def handle_event(self, event, **kwargs):
-        if event == ButtonPressEvent:
-            self.play_click()
-            return
-        if event == CompleteLapEvent:
-            self.announce_lap_time(**kwargs)
-            return
-        if event == AudioAlarmEvent:
-            self.announce_alarm(**kwargs)
-            return
-        if event == RacePositionEvent:
-            # upon reconnect we can get a slew of these, we'll avoid the annoyance
-            if time.time() - self.last_race_announcement_time < 60:
-                return
-            self.announce_race_position(**kwargs)
-            self.last_race_announcement_time = time.time()
-            return
-        if event == DriverMessageEvent:
-            if 'audio' in kwargs.keys() and kwargs['audio']:
-                self.announce(kwargs["text"])
+        ButtonPressEvent.register_handler(self, self.on_button_press)
+        CompleteLapEvent.register_handler(self, self.announce_lap_time)
+        AudioAlarmEvent.register_handler(self, self.announce_alarm)
+        RacePositionEvent.register_handler(self, self.on_race_position)
+        DriverMessageEvent.register_handler(self, self.on_driver_message)
+        LapLossesEvent.register_handler(self, self.announce_lap_losses)
+
+    def on_button_press(self, button=0):
+        self.play_click()
+
+    def on_race_position(self, **kwargs):
+        # upon reconnect we can get a slew of these, we'll avoid the annoyance
+        if self.clock.time() - self.last_race_announcement_time < 60:
             return
+        self.announce_race_position(**kwargs)
+        self.last_race_announcement_time = self.clock.time()
+
+    def on_driver_message(self, text="", audio=False, **kwargs):
+        if audio:
+            self.announce(text)
 
     def run(self) -> None:
         while True:
@@ -120,6 +120,12 @@ class Audio(Thread, EventHandler):
         else:
             self.announce(f"{seconds} seconds")
 
+    # just the place that lost the most, there's only so much a driver can take in
+    def announce_lap_losses(self, optimal_lap_time=None, losses=()):
+        if losses and losses[0][1] >= ANNOUNCE_LOSS_SECONDS:
+            name, loss = losses[0]
+            self.announce(f"lost {loss:.1f} at {name.replace('-', ' ')}")
+
     def announce_alarm(self, message=""):
         # todo : play an alert tone
         # todo : play it now ... if poss
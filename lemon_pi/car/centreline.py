@@ -0,0 +1,117 @@
+import logging
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# breadcrumb positions closer together than this are skipped when building the centreline
+CENTRELINE_SPACING_METRES = 5.0
+
+# how many segments either side of the last known position to look at for the next one
+SEARCH_BEHIND = 2
+SEARCH_AHEAD = 12
+
+# if the car is further than this from the centreline we've lost track of
+# where it is, and search the whole lap again
+LOST_METRES = 40.0
+
+
+class Centreline:
+    # A polyline around the track, built from the positions recorded on the
+    # breadcrumb lap, in projected x/y metres. It starts and finishes at the
+    # start/finish line, and each point knows its distance from the start of
+    # the lap (its station).
+    #
+    # Locating a position means finding the nearest point on the polyline. A
+    # full search looks at every segment, but normally a car is only a segment
+    # or two further on from where it was, so locate() takes a hint and only
+    # searches a small window around it.
+
+    def __init__(self, points):
+        points = np.asarray(points, dtype=float)
+        self.xs = points[:, 0]
+        self.ys = points[:, 1]
+        self.dxs = np.diff(self.xs)
+        self.dys = np.diff(self.ys)
+        self.lengths = np.hypot(self.dxs, self.dys)
+        self.stations = np.concatenate([[0.0], np.cumsum(self.lengths)])
+        self.length = float(self.stations[-1])
+        # plain lists are quicker than numpy for the handful of segments in a window
+        self._segments = list(zip(self.xs[:-1].tolist(), self.ys[:-1].tolist(),
+                                  self.dxs.tolist(), self.dys.tolist(),
+                                  (self.lengths ** 2).tolist(), self.stations[:-1].tolist(),
+                                  self.lengths.tolist()))
+
+    @classmethod
+    def from_breadcrumbs(cls, start_finish_xy, trace, spacing=CENTRELINE_SPACING_METRES) -> Optional["Centreline"]:
+        # the lap starts and ends at the start/finish line
+        points = [start_finish_xy]
+        for xy in trace:
+            last = points[-1]
+            if (xy[0] - last[0]) ** 2 + (xy[1] - last[1]) ** 2 >= spacing ** 2:
+                points.append(xy)
+        points.append(start_finish_xy)
+        if len(points) < 4:
+            logger.warning("not enough breadcrumbs to build a centreline")
+            return None
+        centreline = Centreline(points)
+        logger.info(f"centreline built with {len(points)} points, {centreline.length:.0f}m long")
+        return centreline
+
+    def segment_count(self) -> int:
+        return len(self._segments)
+
+    # returns the station (metres into the lap), the segment it's on and the distance from the
+    # centreline. If a hint segment is given only the segments around it are searched
+    def locate(self, xy, hint: int = None) -> (float, int, float):
+        if hint is not None:
+            station, segment, distance = self._search_window(xy, hint)
+            if distance <= LOST_METRES:
+                return station, segment, distance
+        return self._search_all(xy)
+
+    def _search_window(self, xy, hint: int) -> (float, int, float):
+        x, y = xy
+        best = None
+        # this doesn't wrap around the end of the lap, the start of each lap puts the car back at the start
+        for segment in range(max(hint - SEARCH_BEHIND, 0), min(hint + SEARCH_AHEAD + 1, len(self._segments))):
+            sx, sy, dx, dy, length_sq, station, length = self._segments[segment]
+            t = 0.0
+            if length_sq > 0:
+                t = min(max(((x - sx) * dx + (y - sy) * dy) / length_sq, 0.0), 1.0)
+            dist_sq = (sx + t * dx - x) ** 2 + (sy + t * dy - y) ** 2
+            if best is None or dist_sq < best[2]:
+                best = (station + t * length, segment, dist_sq)
+        return best[0], best[1], best[2] ** 0.5
+
+    def _search_all(self, xy) -> (float, int, float):
+        x, y = xy
+        length_sq = self.lengths ** 2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = ((x - self.xs[:-1]) * self.dxs + (y - self.ys[:-1]) * self.dys) / length_sq
+        t = np.clip(np.nan_to_num(t), 0.0, 1.0)
+        dist_sq = (self.xs[:-1] + t * self.dxs - x) ** 2 + (self.ys[:-1] + t * self.dys - y) ** 2
+        segment = int(np.argmin(dist_sq))
+        return float(self.stations[segment] + t[segment] * self.lengths[segment]), segment, \
+            float(dist_sq[segment]) ** 0.5
+
+
+class CentrelineTracker:
+    # Follows the car around a centreline, one fix at a time, remembering
+    # which segment it was on so each fix only needs a small search.
+
+    def __init__(self, centreline: Centreline):
+        self.centreline = centreline
+        self.segment: Optional[int] = None
+        self.station: Optional[float] = None
+        self.offset: Optional[float] = None
+
+    def update(self, xy) -> float:
+        self.station, self.segment, self.offset = self.centreline.locate(xy, self.segment)
+        return self.station
+
+    # a new lap has started, so the car is back at the start of the centreline
+    def start_lap(self):
+        self.segment = 0
+        self.station = 0.0
@@ -0,0 +1,88 @@
+import logging
+from typing import Optional
+
+from lemon_pi.car.gps_geometry import crossed_line
+from lemon_pi.car.target import Target
+from lemon_pi.car.track import TrackLocation, TargetMetaData
+from lemon_pi.shared.data_provider_interface import GpsPos
+
+logger = logging.getLogger(__name__)
+
+
+class Crossing:
+    # The car went over one of the track's targets between two gps fixes
+
+    def __init__(self, key: TargetMetaData, target: Target, cross_time: float, backwards: bool):
+        self.key = key
+        self.target = target
+        # the estimated time the car was on the line
+        self.cross_time = cross_time
+        # true if the car went over the line the wrong way
+        self.backwards = backwards
+
+    def __repr__(self):
+        direction = "backwards" if self.backwards else "forwards"
+        return f"crossed {self.target.name} {direction} at {self.cross_time:.3f}"
+
+
+class CrossingListener:
+
+    def on_crossing(self, crossing: Crossing):
+        pass
+
+
+class CrossingDetector:
+    # Works out which of the track's targets the car has crossed, once per gps
+    # fix. Everything that cares about the start/finish or pit lines reads the
+    # result from here, so they all agree on whether and when the car crossed.
+    #
+    # The track's spatial index narrows each fix down to the targets close
+    # enough to have been crossed. Listeners can subscribe to crossings of a
+    # particular target, or of any target.
+
+    def __init__(self, track: TrackLocation):
+        self.track = track
+        self.last_pos: Optional[GpsPos] = None
+        # the crossings for the most recent fix, in the order the targets were added to the track
+        self.crossings: [Crossing] = []
+        self.listeners: [(Optional[TargetMetaData], CrossingListener)] = []
+
+    def subscribe(self, listener: CrossingListener, key: TargetMetaData = None):
+        self.listeners.append((key, listener))
+
+    def update(self, this_pos: GpsPos) -> [Crossing]:
+        # throw out identical data, which some devices provide
+        if self.last_pos is not None and (this_pos.lat, this_pos.long) == (self.last_pos.lat, self.last_pos.long):
+            self.crossings = []
+            return self.crossings
+        try:
+            self.crossings = self._detect(self.last_pos, this_pos)
+        finally:
+            self.last_pos = this_pos
+        for crossing in self.crossings:
+            for key, listener in self.listeners:
+                if key is None or key == crossing.key:
+                    try:
+                        listener.on_crossing(crossing)
+                    except Exception:
+                        logger.exception("problem handling crossing")
+        return self.crossings
+
+    # the crossing of the given target on the most recent fix, if there was one
+    def get_crossing(self, key: TargetMetaData) -> Optional[Crossing]:
+        for crossing in self.crossings:
+            if crossing.key == key:
+                return crossing
+        return None
+
+    def _detect(self, last_pos: Optional[GpsPos], this_pos: GpsPos) -> [Crossing]:
+        if last_pos is None:
+            return []
+        projection = self.track.projection
+        result = []
+        for key in self.track.get_target_index().candidates(last_pos.xy(projection), this_pos.xy(projection)):
+            target = self.track.targets[key]
+            crossed, cross_time, backwards = crossed_line(last_pos, this_pos, target)
+            if crossed:
+                result.append(Crossing(key, target, cross_time, backwards))
+        return result
@@ -58,6 +58,16 @@ class LapProvider:
     def get_best_lap_time(self) -> Optional[float]:
         pass
 
+    # return seconds behind (+) or ahead (-) of the best lap, or the target
+    # lap if one is set, at this point of the lap. None if there's nothing to compare with
+    def get_live_delta(self) -> Optional[float]:
+        pass
+
+    # return the sum of the best time in each sector, or None if the track has no
+    # sectors or they haven't all been timed
+    def get_theoretical_best_lap_time(self) -> Optional[float]:
+        pass
+
 
 class FuelProvider:
 
@@ -9,13 +9,13 @@ import time
 from typing import Optional
 
 import serial
-from haversine import haversine, Unit
 
 from lemon_pi.car.display_providers import DRSProvider
 from lemon_pi.car.event_defs import DRSApproachEvent, CompleteLapEvent, LeaveTrackEvent
 from lemon_pi.car.geometry import heading_between_lat_long, get_point_on_heading
-from lemon_pi.car.gps_geometry import will_cross_line
+from lemon_pi.car.gps_geometry import will_cross_line, distance_to_target_feet
 from lemon_pi.car.gps_reader import GpsReader
+from lemon_pi.car.projection import LocalProjection
 from lemon_pi.car.target import Target
 from lemon_pi.car.updaters import PositionUpdater
 from lemon_pi.shared.data_provider_interface import GpsPos
@@ -146,9 +146,14 @@ class DrsDataLoader:
 
 class DrsPositionTracker(PositionUpdater, EventHandler):
 
-    def __init__(self, gates: [DrsGate]):
+    def __init__(self, gates: [DrsGate], projection: LocalProjection = None):
         self.gates = gates
         self.gate_index = 0
+        # put all the gates on one projection so each fix is only projected once
+        if projection is None:
+            projection = LocalProjection(*gates[0].target.midpoint)
+        for gate in gates:
+            gate.target.set_projection(projection)
         CompleteLapEvent.register_handler(self)
 
     def handle_event(self, event, **kwargs):
@@ -171,8 +176,8 @@ class DrsPositionTracker(PositionUpdater, EventHandler):
                                   gate=gate)
         else:
             # if we're closer to the next gate then we're in trouble .. we missed one
-            gate_dist = haversine((lat, long), target.midpoint, Unit.FEET)
-            next_gate_dist = haversine((lat, long), self.gates[next_gate].target.midpoint, Unit.FEET)
+            gate_dist = distance_to_target_feet(here, target)
+            next_gate_dist = distance_to_target_feet(here, self.gates[next_gate].target)
             if next_gate_dist < 200 and next_gate_dist <= gate_dist:
                 logger.info(
                     f"missed gate {target.name} !!! distance to it is {gate_dist} ft "
@@ -1,11 +1,27 @@
 # a simple event framework so we can connect together decoupled logic
-from lemon_pi.shared.events import Event
+#
+# events that report how things are now coalesce, so a handler that has fallen
+# behind only handles the latest of them
+from lemon_pi.shared.events import Event, Overflow, Payload
+
+
+# what the car was doing when it started or stopped moving
+class Movement(Payload):
+    __slots__ = ("speed", "lat_long")
+
+    def __init__(self, speed: int, lat_long: (float, float)):
+        # mph
+        self.speed = speed
+        self.lat_long = lat_long
 
-# the car is moving
-MovingEvent = Event("Moving", suppress_logs=True, debounce_time=1)
 
-# the car is not moving
-NotMovingEvent = Event("NotMoving", suppress_logs=True, debounce_time=1)
+# the car has started moving
+# Movement
+MovingEvent = Event("Moving", payload=Movement)
+
+# the car has stopped moving
+# Movement
+NotMovingEvent = Event("NotMoving", payload=Movement)
 
 # the car is exiting the race track and entering the pits
 LeaveTrackEvent = Event("LeaveTrack", debounce_time=30)
@@ -18,6 +34,19 @@ EnterTrackEvent = Event("EnterTrack", debounce_time=30)
 # lap_time=  float
 CompleteLapEvent = Event("CompleteLap")
 
+# a sector of the lap has been completed
+# sector=    int, the sector number, starting at 1
+# name=      str
+# time=      float
+# delta=     float, compared with the best time for the sector before this one, or None
+# is_best=   bool
+SectorCompleteEvent = Event("SectorComplete")
+
+# where the lap just completed lost the most time against the optimal lap from the virtual gates
+# optimal_lap_time=  float, or None until every part of the lap has been timed
+# losses=            [(str, float)], the gate and the seconds lost there, worst first
+LapLossesEvent = Event("LapLosses")
+
 # a request to exit the application
 ExitApplicationEvent = Event("ExitApplication")
 
@@ -61,7 +90,7 @@ DriverMessageEvent = Event("driver-message")
 
 # emit() will contain
 #   flag=(GREEN|YELLOW|RED|BLACK|UNKNOWN)
-RaceFlagStatusEvent = Event("flag-status")
+RaceFlagStatusEvent = Event("flag-status", overflow=Overflow.COALESCE)
 
 # emit() will contain
 #   lap_count=
@@ -69,7 +98,7 @@ RaceFlagStatusEvent = Event("flag-status")
 LapInfoEvent = Event("lap-info")
 
 #
-RadioReceiveEvent = Event("car-radio-rx")
+RadioReceiveEvent = Event("car-radio-rx", overflow=Overflow.COALESCE)
 
 # A button has been pushed
 # button=0   the id of the button that was pushed
@@ -87,12 +116,12 @@ AudioAlarmEvent = Event("alrm", debounce_time=60)
 # gap_to_front=
 # gap_to_front_delta=
 # lap_count=
-RacePositionEvent = Event("rpos")
+RacePositionEvent = Event("rpos", overflow=Overflow.COALESCE)
 
 # an event indicating who the car behind us is
 # car_behind=
 # gap=
-RacePersuerEvent = Event("persuer")
+RacePersuerEvent = Event("persuer", overflow=Overflow.COALESCE)
 
 # a target lap time has been received from the pits
 # target=
@@ -1,30 +1,41 @@
-import time
 from typing import Optional
 
 from haversine import haversine, Unit
 
 from lemon_pi.car import geometry
-from lemon_pi.car.gps_geometry import crossed_line
+from lemon_pi.car.gps_geometry import crossed_line, distance_to_target_feet
+from lemon_pi.car.projection import LocalProjection
 from lemon_pi.car.target import Target
 from statistics import mean
-import bisect
 import logging
 
+import numpy as np
+
+from lemon_pi.car.gate_stats import GateStats, FROM_START, FROM_PREV, TO_FINISH
+
+from lemon_pi.shared.clock import Clock
 from lemon_pi.shared.data_provider_interface import GpsPos
 
 logger = logging.getLogger(__name__)
 
 # why 18? after running the predictive lap timer test on lots of different
-# values between 12 and 100, 18 turned out to be a pretty good result
+# values between 12 and 100, 18 turned out to be a pretty good result. This is
+# now the number of centroids in each gate's quantile sketch
 ELEMENTS = 18
 
+# how much the existing samples at a gate count for each time a new one is
+# added. 1.0 treats every lap the same, lower values favour the recent laps
+SAMPLE_DECAY = 0.9
+
 
 class Gates:
 
     def __init__(self, start_finish: Target):
         self.start_finish = start_finish
         self.gates: [Gate] = []
-        self.timestamp = time.time()
+        self.timestamp = Clock.get_instance().time()
+        # the timing samples for all the gates live together
+        self.stats = GateStats(ELEMENTS, decay=SAMPLE_DECAY)
 
     def __iter__(self):
         return self.gates.__iter__()
@@ -35,8 +46,17 @@ class Gates:
     def __getitem__(self, item):
         return self.gates.__getitem__(item)
 
-    def append(self, thing):
-        return self.gates.append(thing)
+    def append(self, gate):
+        # move the gate's samples in with everyone else's
+        if isinstance(gate, Gate) and gate.stats is not self.stats:
+            gate.row = self.stats.copy_row(gate.stats, gate.row)
+            gate.stats = self.stats
+        return self.gates.append(gate)
+
+    # put all the gates onto the given projection, typically the track's
+    def set_projection(self, projection: LocalProjection):
+        for gate in self.gates:
+            gate.target.set_projection(projection)
 
     def get_distance_feet(self) -> int:
         last_lat_long = self.start_finish.midpoint
@@ -50,7 +70,55 @@ class Gates:
     def lap_count(self):
         if len(self.gates) == 0:
             return 0
-        return len(self.gates[0].times_from_start)
+        return self.gates[0].stats.sample_count(FROM_START, self.gates[0].row)
+
+    # at the end of a lap, record how long it took to finish from every gate in one go
+    def record_lap_time(self, lap_time):
+        if lap_time < 0:
+            raise Exception()
+        size = len(self.stats)
+        completion_times = lap_time - self.stats.last_time_from_start[:size]
+        rows = np.flatnonzero(~self.stats.missed[:size] & (completion_times > 0))
+        self.stats.insert_rows(TO_FINISH, rows, completion_times[rows])
+
+    # Gates are saved as a few arrays rather than an object per gate, which is
+    # a lot smaller and quicker to load
+    def __getstate__(self):
+        return {
+            "start_finish": self.start_finish,
+            "timestamp": self.timestamp,
+            "names": [g.target.name for g in self.gates],
+            "positions": np.array([(g.lat, g.long, g.heading) for g in self.gates]).reshape(-1, 3),
+            "target_points": np.array([g.target.lat_long1 + g.target.lat_long2 for g in self.gates]).reshape(-1, 4),
+            "target_headings": np.array([g.target.target_heading for g in self.gates]),
+            "has_previous": np.array([g.previous is not None for g in self.gates], dtype=bool),
+            "stats": self.stats.compact(),
+        }
+
+    def __setstate__(self, state):
+        if "gates" in state:
+            # saved as a list of Gate objects, before the samples were moved into GateStats
+            gates = state.pop("gates")
+            self.__dict__.update(state)
+            self.stats = GateStats(ELEMENTS, decay=SAMPLE_DECAY)
+            self.gates = []
+            for gate in gates:
+                self.append(gate)
+            return
+        self.start_finish = state["start_finish"]
+        self.timestamp = state["timestamp"]
+        self.stats = GateStats.from_compact(state["stats"])
+        self.gates = []
+        previous = None
+        for row, name in enumerate(state["names"]):
+            lat, long, heading = state["positions"][row].tolist()
+            lat1, long1, lat2, long2 = state["target_points"][row].tolist()
+            target = Target(name, (lat1, long1), (lat2, long2), target_heading=float(state["target_headings"][row]))
+            gate = Gate(lat, long, heading, name,
+                        previous=previous if state["has_previous"][row] else None,
+                        target=target, stats=self.stats, row=row)
+            self.gates.append(gate)
+            previous = gate
 
 
 class Gate:
@@ -70,43 +138,77 @@ class Gate:
     #
     # Prediction is based on looking at the ranking of how fast the car has
     # traversed the last few gates, and then using that ranking to select the
-    # similarly ranked time to the end of the lap.
+    # similarly ranked time to the end of the lap. Rankings are quantiles, 0 for
+    # the fastest time seen at the gate and 1 for the slowest.
+    #
+    # The times themselves are held in a row of a GateStats, which is shared by
+    # all of the gates once they are added to a Gates.
 
-    def __init__(self, lat, long, heading, name, previous=None):
+    def __init__(self, lat, long, heading, name, previous=None, projection: LocalProjection = None,
+                 target: Target = None, stats: GateStats = None, row: int = None):
         # static fields : these are fixed
         self.lat = lat
         self.long = long
         self.heading = heading
-        self.target = self._create_target(name)
+        self.target = target or self._create_target(name)
+        if projection:
+            self.target.set_projection(projection)
         # back pointer to the previous gate
         self.previous: Gate = previous
 
         # dynamic fields .. these change as more lap data is added
-        self.missed = False
-        self.times_from_start: [float] = []
-        self.times_from_prev: [float] = []
-        self.times_to_finish: [float] = []
-        self.last_time_from_start: float = 0
-        # the most recent index into the sorted lap times
+        if stats is None:
+            stats = GateStats(ELEMENTS, 1, SAMPLE_DECAY)
+            row = stats.add_row()
+        self.stats = stats
+        self.row = row
+        # the quantile of the most recent time from the previous gate, or -1 before there is one
         self.last_mini_rank = -1
 
+    @property
+    def times_from_start(self) -> np.ndarray:
+        return self.stats.values(FROM_START, self.row)
+
+    @property
+    def times_from_prev(self) -> np.ndarray:
+        return self.stats.values(FROM_PREV, self.row)
+
+    @property
+    def times_to_finish(self) -> np.ndarray:
+        return self.stats.values(TO_FINISH, self.row)
+
+    @property
+    def missed(self) -> bool:
+        return bool(self.stats.missed[self.row])
+
+    @missed.setter
+    def missed(self, missed: bool):
+        self.stats.missed[self.row] = missed
+
+    @property
+    def last_time_from_start(self) -> float:
+        return float(self.stats.last_time_from_start[self.row])
+
+    @last_time_from_start.setter
+    def last_time_from_start(self, t: float):
+        self.stats.last_time_from_start[self.row] = t
+
     def record_time_from_start(self, t):
         if t < 0:
             raise Exception()
         self.last_time_from_start = t
-        bisect.insort(self.times_from_start, t)
-        self._trim_data(self.times_from_start, ELEMENTS, t)
+        self.stats.insert(FROM_START, self.row, t)
         if self.previous and not self.previous.missed:
             mini_split = t - self.previous.last_time_from_start
-            if len(self.times_from_prev):
-                mini_split_improvement = (self.times_from_prev[0] - mini_split) / self.times_from_prev[0] * 100
-                if len(self.times_from_prev) > 3 and mini_split_improvement > 35:
+            times_from_prev = self.times_from_prev
+            if len(times_from_prev):
+                mini_split_improvement = (times_from_prev[0] - mini_split) / times_from_prev[0] * 100
+                if self.stats.sample_count(FROM_PREV, self.row) > 3 and mini_split_improvement > 35:
                     logger.debug(f"{self.target.name} disregarding {mini_split_improvement:0.2f}%")
                     self.missed = True
                     return
             if mini_split > 0:
-                bisect.insort(self.times_from_prev, mini_split)
-                self._trim_data(self.times_from_prev, ELEMENTS, mini_split)
+                self.stats.insert(FROM_PREV, self.row, mini_split)
 
     def coords(self):
         return self.lat, self.long
@@ -116,7 +218,7 @@ class Gate:
         # will take to complete the lap from here.
         if elapsed_time < 0:
             raise Exception()
-        ranking = bisect.bisect_left(self.times_from_start, elapsed_time)
+        ranking = self.stats.quantile_of(FROM_START, self.row, elapsed_time)
         logger.debug(f"searching for {elapsed_time} returns {ranking}")
         best_est_rank = ranking
         if self.previous:
@@ -124,15 +226,13 @@ class Gate:
             # them to here
             if not self.previous.missed:
                 mini_split = elapsed_time - self.previous.last_time_from_start
-                self.last_mini_rank = bisect.bisect_left(self.times_from_prev, mini_split)
+                self.last_mini_rank = self.stats.quantile_of(FROM_PREV, self.row, mini_split)
             else:
                 self.last_mini_rank = best_est_rank
             recent_ranks = self._gather_recent_mini_splits()
             if len(recent_ranks):
-                best_est_rank = round((mean(recent_ranks) + best_est_rank) / 2)
-        if best_est_rank >= len(self.times_to_finish):
-            best_est_rank = -1
-        return elapsed_time + self.times_to_finish[best_est_rank]
+                best_est_rank = (mean(recent_ranks) + best_est_rank) / 2
+        return elapsed_time + self.stats.time_at(TO_FINISH, self.row, best_est_rank)
 
     def record_lap_time(self, lap_time):
         if self.missed:
@@ -141,8 +241,7 @@ class Gate:
             raise Exception()
         actual_completion_time = lap_time - self.last_time_from_start
         if actual_completion_time > 0:
-            bisect.insort(self.times_to_finish, actual_completion_time)
-            self._trim_data(self.times_to_finish, ELEMENTS, actual_completion_time)
+            self.stats.insert(TO_FINISH, self.row, actual_completion_time)
 
     def _create_target(self, gate_name):
         heading_left = (self.heading + 270) % 360
@@ -152,26 +251,29 @@ class Gate:
         gate_lat_long2 = geometry.get_point_on_heading((self.lat, self.long), heading_right, 0.02)
         return Target(gate_name, gate_lat_long1, gate_lat_long2, target_heading=self.heading)
 
-    @staticmethod
-    def _trim_data(sorted_list, max_size, new_data):
-        if len(sorted_list) > max_size:
-            if sorted_list[-1] == new_data and new_data / sorted_list[-2] < 1.3:
-                # if we just added this as the slowest, and it's not more than
-                # 1.3 times off from a reasonable time
-                # then remove a middle element
-                sorted_list.pop(round(ELEMENTS / 2))
-            else:
-                sorted_list.pop(-1)
-
-    def _gather_recent_mini_splits(self) -> [int]:
-        results: [int] = []
+    def _gather_recent_mini_splits(self) -> [float]:
+        results: [float] = []
         scanner = self
         while scanner.previous and len(results) < 5:
-            if not scanner.missed:
+            if not scanner.missed and scanner.last_mini_rank >= 0:
                 results.append(scanner.last_mini_rank)
             scanner = scanner.previous
         return results
 
+    def __setstate__(self, state):
+        if "times_from_start" in state:
+            # saved before the samples were moved into GateStats
+            stats = GateStats(ELEMENTS, 1, SAMPLE_DECAY)
+            row = stats.add_row()
+            stats.set_values(FROM_START, row, state.pop("times_from_start"))
+            stats.set_values(FROM_PREV, row, state.pop("times_from_prev"))
+            stats.set_values(TO_FINISH, row, state.pop("times_to_finish"))
+            stats.last_time_from_start[row] = state.pop("last_time_from_start")
+            stats.missed[row] = state.pop("missed")
+            state["stats"] = stats
+            state["row"] = row
+        self.__dict__.update(state)
+
 
 class GateVerifier:
 
@@ -200,8 +302,7 @@ class GateVerifier:
         else:
             # did we miss a gate?
             if self.index < len(self.gates) - 1:
-                gate_dist = haversine((this_gps.lat, this_gps.long), self.gates[self.index].target.midpoint, Unit.FEET)
-                next_gate_dist = haversine((this_gps.lat, this_gps.long), self.gates[self.index + 1].target.midpoint,
-                                           Unit.FEET)
+                gate_dist = distance_to_target_feet(this_gps, self.gates[self.index].target)
+                next_gate_dist = distance_to_target_feet(this_gps, self.gates[self.index + 1].target)
                 if gate_dist > next_gate_dist:
                     self.index += 1
@@ -0,0 +1,85 @@
+import logging
+
+import numpy as np
+
+from lemon_pi.car.projection import FEET_PER_METRE
+
+logger = logging.getLogger(__name__)
+
+# How the gates are shared out around the lap. Most go by time, so the slow
+# twisty parts of the lap, where most of the time is spent and most of it is
+# won or lost, get more gates than the straights. Some go by how much the car
+# turns, so every corner gets gates however quick it is, and the rest go by
+# distance so a long straight isn't left with none at all
+TIME_SHARE = 0.5
+TURN_SHARE = 0.25
+
+# gates closer together than this many fixes would be crossed between the same pair of fixes,
+# and the predictor only looks for one gate at a time
+MIN_FIXES_APART = 1.5
+
+
+# Places the virtual gates around the lap from the positions seen on the
+# breadcrumb lap, in x/y metres, and the times they were seen, starting and
+# finishing at the start/finish line. Up to count gates are placed, as the
+# x/y and heading of each.
+def place_gates(start_finish_xy, trace, times, start_time: float, finish_time: float, count: int) \
+        -> [(float, float, float)]:
+    points = np.array([start_finish_xy] + list(trace) + [start_finish_xy], dtype=float).reshape(-1, 2)
+    times = np.array([start_time] + list(times) + [finish_time], dtype=float)
+    dx, dy = np.diff(points[:, 0]), np.diff(points[:, 1])
+    distances = np.hypot(dx, dy)
+    # repeated fixes don't take us anywhere
+    moved = np.flatnonzero(distances > 0)
+    if count <= 0 or len(moved) < 2:
+        return []
+    starts = points[moved]
+    dx, dy, distances = dx[moved], dy[moved], distances[moved]
+    durations = np.maximum(np.diff(times)[moved], 0.0)
+    start_times = times[moved]
+    directions = np.degrees(np.arctan2(dx, dy)) % 360
+
+    # how far the car turned at each end of a segment, half of each turn going to either side of it
+    turns = np.abs((np.diff(directions) + 180) % 360 - 180)
+    turning = np.zeros(len(moved))
+    turning[:-1] += turns / 2
+    turning[1:] += turns / 2
+
+    weights = (1 - TIME_SHARE - TURN_SHARE) * distances / distances.sum()
+    if durations.sum() > 0:
+        weights += TIME_SHARE * durations / durations.sum()
+    if turning.sum() > 0:
+        weights += TURN_SHARE * turning / turning.sum()
+    cumulative = np.concatenate([[0.0], np.cumsum(weights)])
+
+    # each gate in the middle of its share of the lap
+    wanted = (np.arange(count) + 0.5) / count * cumulative[-1]
+    segments = np.clip(np.searchsorted(cumulative, wanted, side="right") - 1, 0, len(weights) - 1)
+    along = (wanted - cumulative[segments]) / weights[segments]
+    xs = starts[segments, 0] + dx[segments] * along
+    ys = starts[segments, 1] + dy[segments] * along
+    gate_times = start_times[segments] + durations[segments] * along
+
+    min_gap = MIN_FIXES_APART * float(np.median(durations))
+    result = []
+    last_time = start_time
+    for x, y, t, segment in zip(xs.tolist(), ys.tolist(), gate_times.tolist(), segments.tolist()):
+        if t - last_time < min_gap or finish_time - t < min_gap:
+            continue
+        result.append((x, y, float(directions[segment])))
+        last_time = t
+    logger.info(f"placed {len(result)} gates from a budget of {count}")
+    return result
+
+
+# how many gates the lap gets: as many as would be laid by dropping one whenever the car
+# was the given distance from the last, which is how they used to be placed
+def gate_budget(trace, start_finish_xy, separation_feet: float) -> int:
+    separation = separation_feet / FEET_PER_METRE
+    count = 0
+    last_x, last_y = start_finish_xy
+    for x, y in trace:
+        if (x - last_x) ** 2 + (y - last_y) ** 2 >= separation ** 2:
+            count += 1
+            last_x, last_y = x, y
+    return count
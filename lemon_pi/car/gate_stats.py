@@ -0,0 +1,236 @@
+import numpy as np
+
+# the three sets of times every gate keeps
+FROM_START = 0
+FROM_PREV = 1
+TO_FINISH = 2
+
+INITIAL_CAPACITY = 64
+
+
+class GateStats:
+    # The timing samples for all of the gates at a track, held in a handful of
+    # numpy arrays rather than python lists per gate. Each gate owns a row.
+    #
+    # Rather than keeping the raw samples, each row is a small quantile sketch:
+    # up to `elements` centroids, each a mean time and a weight, in time order.
+    # Every sample adds a centroid of weight 1. When there are too many, the
+    # two neighbours that are cheapest to combine (least weight over the
+    # shortest gap) are merged. Memory stays fixed however many laps are
+    # driven, and no lap is thrown away outright, so the order laps were
+    # driven in doesn't change the answers much.
+    #
+    # Optionally every existing weight is multiplied by `decay` when a sample
+    # is added, so recent laps count for more than old ones.
+    #
+    # Times are looked up by quantile (0 is the fastest seen, 1 the slowest),
+    # interpolating between the centroids.
+    #
+    # Single samples are added as each gate is crossed. At the end of a lap the
+    # time to the finish is added to every gate at once.
+
+    def __init__(self, elements: int, capacity: int = INITIAL_CAPACITY, decay: float = 1.0):
+        self.elements = elements
+        self.decay = decay
+        self.size = 0
+        # one spare slot on each row, so a sample can go in before the row is merged back down
+        self.means = np.zeros((3, capacity, elements + 1))
+        self.weights = np.zeros((3, capacity, elements + 1))
+        self.counts = np.zeros((3, capacity), dtype=np.int32)
+        # how many samples have ever been added
+        self.samples = np.zeros((3, capacity), dtype=np.int32)
+        self.last_time_from_start = np.zeros(capacity)
+        self.missed = np.zeros(capacity, dtype=bool)
+
+    def __len__(self):
+        return self.size
+
+    def add_row(self) -> int:
+        if self.size == len(self.missed):
+            self._grow(self.size * 2)
+        self.size += 1
+        return self.size - 1
+
+    def copy_row(self, other: "GateStats", other_row: int) -> int:
+        row = self.add_row()
+        self.means[:, row] = other.means[:, other_row]
+        self.weights[:, row] = other.weights[:, other_row]
+        self.counts[:, row] = other.counts[:, other_row]
+        self.samples[:, row] = other.samples[:, other_row]
+        self.last_time_from_start[row] = other.last_time_from_start[other_row]
+        self.missed[row] = other.missed[other_row]
+        return row
+
+    # the centroid times for a row, fastest first. This is a view, so it changes as samples are added
+    def values(self, column: int, row: int) -> np.ndarray:
+        return self.means[column, row, :self.counts[column, row]]
+
+    def set_values(self, column: int, row: int, values):
+        for value in values:
+            self.insert(column, row, value)
+
+    def sample_count(self, column: int, row: int) -> int:
+        return int(self.samples[column, row])
+
+    # the fraction of samples in a row that are faster than the given time
+    def quantile_of(self, column: int, row: int, value: float) -> float:
+        count = self.counts[column, row]
+        if count == 0:
+            return 0.0
+        weights = self.weights[column, row, :count]
+        cumulative = np.cumsum(weights)
+        total = cumulative[-1]
+        return float(np.interp(value, self.means[column, row, :count], cumulative - weights / 2,
+                               left=0.0, right=total) / total)
+
+    # the time at the given quantile of a row. Raises IndexError if the row is empty
+    def time_at(self, column: int, row: int, quantile: float) -> float:
+        count = self.counts[column, row]
+        if count == 0:
+            raise IndexError(f"no samples for row {row}")
+        weights = self.weights[column, row, :count]
+        cumulative = np.cumsum(weights)
+        return float(np.interp(quantile * cumulative[-1], cumulative - weights / 2, self.means[column, row, :count]))
+
+    def insert(self, column: int, row: int, value: float):
+        count = int(self.counts[column, row])
+        means = self.means[column, row]
+        weights = self.weights[column, row]
+        if self.decay != 1.0:
+            weights[:count] *= self.decay
+        pos = int(np.searchsorted(means[:count], value, side="right"))
+        means[pos + 1:count + 1] = means[pos:count]
+        weights[pos + 1:count + 1] = weights[pos:count]
+        means[pos] = value
+        weights[pos] = 1.0
+        count += 1
+        if count > self.elements:
+            costs = (weights[:count - 1] + weights[1:count]) * (means[1:count] - means[:count - 1])
+            i = int(np.argmin(costs))
+            merged_weight = weights[i] + weights[i + 1]
+            means[i] = (means[i] * weights[i] + means[i + 1] * weights[i + 1]) / merged_weight
+            weights[i] = merged_weight
+            means[i + 1:count - 1] = means[i + 2:count]
+            weights[i + 1:count - 1] = weights[i + 2:count]
+            count -= 1
+        self.counts[column, row] = count
+        self.samples[column, row] += 1
+
+    # add one value to each of the given rows, giving the same result as insert() on each row
+    def insert_rows(self, column: int, rows: np.ndarray, values: np.ndarray):
+        if len(rows) == 0:
+            return
+        means = self.means[column, rows]
+        weights = self.weights[column, rows]
+        counts = self.counts[column, rows]
+        cols = np.arange(self.elements + 1)
+        in_use = cols < counts[:, None]
+        if self.decay != 1.0:
+            weights = np.where(in_use, weights * self.decay, weights)
+
+        # after any centroids with the same time, like insert()
+        pos = np.sum((means <= values[:, None]) & in_use, axis=1)[:, None]
+        means = np.where(cols < pos, means, np.where(cols == pos, values[:, None], self._shift_right(means)))
+        weights = np.where(cols < pos, weights, np.where(cols == pos, 1.0, self._shift_right(weights)))
+        counts = counts + 1
+
+        # merge the cheapest pair on the rows that are now over full
+        full = counts > self.elements
+        pairs = cols[:-1] < (counts - 1)[:, None]
+        costs = (weights[:, :-1] + weights[:, 1:]) * (means[:, 1:] - means[:, :-1])
+        merge = np.argmin(np.where(pairs, costs, np.inf), axis=1)
+        which = np.arange(len(rows))
+        merged_weight = weights[which, merge] + weights[which, merge + 1]
+        merged_mean = (means[which, merge] * weights[which, merge] +
+                       means[which, merge + 1] * weights[which, merge + 1]) / merged_weight
+        merge = np.where(full, merge, self.elements + 1)[:, None]
+        means = np.where(cols < merge, means, np.where(cols == merge, merged_mean[:, None], self._shift_left(means)))
+        weights = np.where(cols < merge, weights,
+                           np.where(cols == merge, merged_weight[:, None], self._shift_left(weights)))
+
+        self.means[column, rows] = means
+        self.weights[column, rows] = weights
+        self.counts[column, rows] = np.where(full, counts - 1, counts)
+        self.samples[column, rows] += 1
+
+    # add a set of centroids, e.g. from another session's sketch, to a row. The row is merged back
+    # down to `elements` centroids the same way insert() does it, a pair at a time
+    def merge_centroids(self, column: int, row: int, means: np.ndarray, weights: np.ndarray, samples: int):
+        count = int(self.counts[column, row])
+        all_means = np.concatenate([self.means[column, row, :count], means])
+        all_weights = np.concatenate([self.weights[column, row, :count], weights])
+        order = np.argsort(all_means, kind="stable")
+        all_means = all_means[order]
+        all_weights = all_weights[order]
+        while len(all_means) > self.elements:
+            costs = (all_weights[:-1] + all_weights[1:]) * (all_means[1:] - all_means[:-1])
+            i = int(np.argmin(costs))
+            merged_weight = all_weights[i] + all_weights[i + 1]
+            all_means[i] = (all_means[i] * all_weights[i] + all_means[i + 1] * all_weights[i + 1]) / merged_weight
+            all_weights[i] = merged_weight
+            all_means = np.delete(all_means, i + 1)
+            all_weights = np.delete(all_weights, i + 1)
+        count = len(all_means)
+        self.means[column, row, :count] = all_means
+        self.weights[column, row, :count] = all_weights
+        self.counts[column, row] = count
+        self.samples[column, row] += samples
+
+    # the total weight of the centroids in a row
+    def total_weight(self, column: int, row: int) -> float:
+        return float(self.weights[column, row, :self.counts[column, row]].sum())
+
+    # the arrays cut down to the centroids in use, for saving
+    def compact(self) -> dict:
+        counts = self.counts[:, :self.size]
+        in_use = np.arange(self.elements + 1) < counts[:, :, None]
+        return {
+            "elements": self.elements,
+            "decay": self.decay,
+            "times": self.means[:, :self.size][in_use],
+            "weights": self.weights[:, :self.size][in_use],
+            "counts": counts.copy(),
+            "samples": self.samples[:, :self.size].copy(),
+            "last_time_from_start": self.last_time_from_start[:self.size].copy(),
+            "missed": self.missed[:self.size].copy(),
+        }
+
+    @classmethod
+    def from_compact(cls, data: dict) -> "GateStats":
+        size = len(data["missed"])
+        counts = data["counts"]
+        stats = GateStats(data["elements"], max(size, 1), data["decay"])
+        in_use = np.arange(stats.elements + 1) < counts[:, :, None]
+        # views, so these fill in the stats arrays
+        means = stats.means[:, :size]
+        means[in_use] = data["times"]
+        weights = stats.weights[:, :size]
+        weights[in_use] = data["weights"]
+        stats.counts[:, :size] = counts
+        stats.samples[:, :size] = data["samples"]
+        stats.last_time_from_start[:size] = data["last_time_from_start"]
+        stats.missed[:size] = data["missed"]
+        stats.size = size
+        return stats
+
+    @staticmethod
+    def _shift_right(a: np.ndarray) -> np.ndarray:
+        shifted = np.zeros_like(a)
+        shifted[:, 1:] = a[:, :-1]
+        return shifted
+
+    @staticmethod
+    def _shift_left(a: np.ndarray) -> np.ndarray:
+        shifted = np.zeros_like(a)
+        shifted[:, :-1] = a[:, 1:]
+        return shifted
+
+    def _grow(self, capacity: int):
+        capacity = max(capacity, 1)
+        extra = capacity - len(self.missed)
+        self.means = np.concatenate([self.means, np.zeros((3, extra, self.elements + 1))], axis=1)
+        self.weights = np.concatenate([self.weights, np.zeros((3, extra, self.elements + 1))], axis=1)
+        self.counts = np.concatenate([self.counts, np.zeros((3, extra), dtype=np.int32)], axis=1)
+        self.samples = np.concatenate([self.samples, np.zeros((3, extra), dtype=np.int32)], axis=1)
+        self.last_time_from_start = np.concatenate([self.last_time_from_start, np.zeros(extra)])
+        self.missed = np.concatenate([self.missed, np.zeros(extra, dtype=bool)])
@@ -0,0 +1,138 @@
+import logging
+
+import numpy as np
+
+from lemon_pi.car.gate import GateVerifier
+from lemon_pi.car.gps_geometry import CROSSING_RANGE_METRES
+
+logger = logging.getLogger(__name__)
+
+# how many fixes of a trace are looked at in one go for the next gate
+TRACE_CHUNK = 64
+
+
+class GateVerifierSet:
+    # Matches the breadcrumb lap against every saved session at once. It gives
+    # the same answers as calling GateVerifier.verify() on each of them, but
+    # the gate that each session is waiting for is looked up in a set of
+    # stacked arrays, so a fix is tested against all of them in one pass.
+    #
+    # A session that misses a gate can never match, so it is dropped from
+    # the pass straight away. Once none are left each fix costs nothing.
+    #
+    # Fixes can be handed over one at a time with verify(), or a whole lap's
+    # trace can be matched in one go with verify_trace(). Either runs on the
+    # caller's thread; the predictor matches the breadcrumb lap on the session
+    # store's writer thread. update_verifiers() copies the results back onto
+    # the GateVerifiers.
+    #
+    # All of the gates must be on the same projection as the positions.
+
+    def __init__(self, verifiers: [GateVerifier]):
+        self.verifiers = verifiers
+        targets = [gate.target for verifier in verifiers for gate in verifier.gates]
+        self.gate_counts = np.array([len(verifier.gates) for verifier in verifiers], dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(self.gate_counts)[:-1]]).astype(np.int64)
+        self.index = np.array([verifier.index for verifier in verifiers], dtype=np.int64)
+        self.matched = np.array([verifier.matched for verifier in verifiers], dtype=np.int64)
+        self.active = self.index < self.gate_counts
+
+        self.x1 = np.array([t.xy1[0] for t in targets])
+        self.y1 = np.array([t.xy1[1] for t in targets])
+        self.normal_x = np.array([t.normal[0] for t in targets])
+        self.normal_y = np.array([t.normal[1] for t in targets])
+        self.direction_x = np.array([t.direction[0] for t in targets])
+        self.direction_y = np.array([t.direction[1] for t in targets])
+        self.length_sq = np.array([t.length_sq for t in targets])
+        self.mid_x = np.array([t.mid_xy[0] for t in targets])
+        self.mid_y = np.array([t.mid_xy[1] for t in targets])
+        self.min_x = np.array([t.min_x for t in targets])
+        self.max_x = np.array([t.max_x for t in targets])
+        self.min_y = np.array([t.min_y for t in targets])
+        self.max_y = np.array([t.max_y for t in targets])
+        self.headings = np.array([t.target_heading for t in targets], dtype=float)
+
+    def active_count(self) -> int:
+        return int(np.count_nonzero(self.active))
+
+    # copy what has been matched so far back onto the GateVerifiers
+    def update_verifiers(self):
+        for verifier, index, matched in zip(self.verifiers, self.index.tolist(), self.matched.tolist()):
+            verifier.index = index
+            verifier.matched = matched
+
+    # look for a session's gates again from the given one, forgetting what it has matched so far
+    def restart(self, row: int, index: int):
+        self.index[row] = index
+        self.matched[row] = 0
+        self.active[row] = index < self.gate_counts[row]
+
+    # called with the last and current fixes on the gates' projection
+    def verify(self, last_xy, this_xy, heading: float):
+        rows = np.flatnonzero(self.active)
+        if len(rows) == 0:
+            return
+        index = self.index[rows]
+        t = self.offsets[rows] + index
+        has_next = index < self.gate_counts[rows] - 1
+        crossed, missed = self._events(t, has_next, last_xy[0], last_xy[1], this_xy[0], this_xy[1], heading)
+        self.index[rows] = index + (crossed | missed)
+        self.matched[rows] += crossed
+        # a session that has missed a gate can't match, and one that's seen all of its gates is done
+        self.active[rows] = ~missed & (self.index[rows] < self.gate_counts[rows])
+
+    # the same as calling verify() with each consecutive pair of a whole trace of positions,
+    # given as an (n, 2) array of x/y and the heading at each. Rather than stepping through the
+    # fixes for every session, this looks along the trace for the next time each gate is
+    # crossed or missed, a few dozen fixes at a time
+    def verify_trace(self, trace: np.ndarray, headings: np.ndarray):
+        last_x, last_y = trace[:-1, 0], trace[:-1, 1]
+        x, y = trace[1:, 0], trace[1:, 1]
+        headings = headings[1:]
+        for row in np.flatnonzero(self.active):
+            step = 0
+            while self.active[row] and step < len(x):
+                end = min(step + TRACE_CHUNK, len(x))
+                t = self.offsets[row] + self.index[row]
+                has_next = self.index[row] < self.gate_counts[row] - 1
+                crossed, missed = self._events(t, has_next, last_x[step:end], last_y[step:end],
+                                               x[step:end], y[step:end], headings[step:end])
+                events = np.flatnonzero(crossed | missed)
+                if len(events) == 0:
+                    step = end
+                    continue
+                first = events[0]
+                self.index[row] += 1
+                self.matched[row] += crossed[first]
+                self.active[row] = not missed[first] and self.index[row] < self.gate_counts[row]
+                step += first + 1
+        self.update_verifiers()
+
+    # Has the car crossed or missed gate t? Either the gates or the positions can be arrays
+    def _events(self, t, has_next, last_x, last_y, x, y, heading) -> (np.ndarray, np.ndarray):
+        # the same tests as _crossed_line_xy
+        outside = ((last_x < self.min_x[t]) & (x < self.min_x[t])) | \
+                  ((last_x > self.max_x[t]) & (x > self.max_x[t])) | \
+                  ((last_y < self.min_y[t]) & (y < self.min_y[t])) | \
+                  ((last_y > self.max_y[t]) & (y > self.max_y[t]))
+        in_range = (x - self.mid_x[t]) ** 2 + (y - self.mid_y[t]) ** 2 < CROSSING_RANGE_METRES ** 2
+        last_side = (last_x - self.x1[t]) * self.normal_x[t] + (last_y - self.y1[t]) * self.normal_y[t]
+        this_side = (x - self.x1[t]) * self.normal_x[t] + (y - self.y1[t]) * self.normal_y[t]
+        crossed = ~outside & in_range & (last_side != 0.0) & (last_side * this_side <= 0.0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            along_car = last_side / (last_side - this_side)
+        cross_x = last_x + (x - last_x) * along_car
+        cross_y = last_y + (y - last_y) * along_car
+        along_target = ((cross_x - self.x1[t]) * self.direction_x[t] +
+                        (cross_y - self.y1[t]) * self.direction_y[t]) / self.length_sq[t]
+        crossed &= (along_target >= 0.0) & (along_target <= 1.0)
+        heading_difference = np.abs(heading - self.headings[t])
+        heading_difference = np.where(heading_difference > 180, np.abs(360 - heading_difference), heading_difference)
+        crossed &= heading_difference <= 150
+
+        # did we miss a gate? if we're nearer the one after it then we did
+        after = np.where(has_next, t + 1, t)
+        missed = ~crossed & has_next & \
+            ((x - self.mid_x[t]) ** 2 + (y - self.mid_y[t]) ** 2 >
+             (x - self.mid_x[after]) ** 2 + (y - self.mid_y[after]) ** 2)
+        return crossed, missed
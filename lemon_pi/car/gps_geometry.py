@@ -1,65 +1,77 @@
-
-
 # returns a boolean indicating if the car has crossed the target. If it has, it also returns the
 # estimated time that the car crossed the line, and a flag indicating if the car is going in the
 # wrong direction
+#
+# All of the work is done on the target's local projection (x/y in metres) with plain float
+# arithmetic. Positions are projected once per fix and shared by every target on the track.
 import logging
 from typing import Optional
 
-from haversine import haversine, Unit
-
-from lemon_pi.car.geometry import seg_intersect_lat_long, is_between, heading_between_lat_long, angular_difference, \
-    get_point_on_heading
+from lemon_pi.car.geometry import angular_difference
+from lemon_pi.car.projection import FEET_PER_METRE, point_on_heading_xy
 from lemon_pi.car.target import Target
 from lemon_pi.shared.data_provider_interface import GpsPos
+from lemon_pi.shared.trace import Trace
 
 logger = logging.getLogger(__name__)
 
+# the car's heading, the target's heading and how far back the crossing time was put, for every line crossed
+TRACE_CROSSED = Trace.point("crossed line")
+
+# the car needs to be 200 feet or less from the target. At 100mph a car covers 150 feet per
+# second, and some gps devices are only providing updates once per second
+CROSSING_RANGE_METRES = 200 / FEET_PER_METRE
+
 
 def crossed_line(last_pos: Optional[GpsPos], this_pos: GpsPos, target: Target) -> (bool, float, bool):
     if last_pos is None:
         return False, 0, False
+    projection = target.get_projection()
+    return _crossed_line_xy(last_pos.xy(projection), last_pos.timestamp,
+                            this_pos.xy(projection), this_pos.timestamp,
+                            this_pos.heading, target)
 
-    dist = int(haversine(target.midpoint, (this_pos.lat, this_pos.long), unit=Unit.FEET))
-
-    logger.debug(f"distance to {target.name} target = {dist} feet")
-    # needs to be 200 feet or less. At 100mph a car covers 150 feet per second, and
-    # some gps devices are only providing updates once per second
-    if dist < 200:
-        # work out the intersect from car to line
-        intersect = seg_intersect_lat_long(
-            target.lat_long1,
-            target.lat_long2,
-            (last_pos.lat, last_pos.long),
-            (this_pos.lat, this_pos.long))
-
-        # is this intersect point on the target line?
-        if is_between(target.lat_long1, target.lat_long2, intersect) and \
-           is_between((last_pos.lat, last_pos.long), (this_pos.lat, this_pos.long), intersect):
-            logger.debug("pretty sure line crossed")
-
-            # lets get the heading from our current position to the intersect
-            target_heading = heading_between_lat_long((this_pos.lat, this_pos.long), intersect)
-            last_target_heading = heading_between_lat_long((last_pos.lat, last_pos.long), intersect)
-            if abs(last_target_heading - target_heading) > 150:
-
-                crossed_backwards = angular_difference(this_pos.heading, target.target_heading) > 150
-                logger.debug(f"angular difference = {angular_difference(this_pos.heading, target.target_heading)}")
-
-                logger.debug("GONE PASSED {} line!!!!".format(target.name))
-                logger.debug("my heading = {}, target heading = {}".format(this_pos.heading, target.target_heading))
-
-                # work out the precise time we crossed the line
-                if dist == 0.0:
-                    est_cross_time = this_pos.timestamp
-                else:
-                    time_gap = this_pos.timestamp - last_pos.timestamp
-                    last_dist = int(haversine(target.midpoint, (last_pos.lat, last_pos.long), unit=Unit.FEET))
-                    distance_ratio = (last_dist + dist) / dist
-                    logger.debug("adjusting line cross time back by {:.3f}".format(time_gap / distance_ratio))
-                    est_cross_time = this_pos.timestamp - (time_gap / distance_ratio)
-                # set ourselves up so that we were on the line
-                return True, est_cross_time, crossed_backwards
+
+def _crossed_line_xy(last_xy, last_timestamp, this_xy, this_timestamp, heading, target: Target) -> (bool, float, bool):
+    # most fixes are nowhere near the target, so rule those out first
+    if not target.may_cross(last_xy, this_xy):
+        return False, 0, False
+    x, y = this_xy
+    mid_x, mid_y = target.mid_xy
+    if (x - mid_x) ** 2 + (y - mid_y) ** 2 >= CROSSING_RANGE_METRES ** 2:
+        return False, 0, False
+
+    # the car has to have gone from one side of the line to the other (if it was
+    # exactly on the line last time then we counted it last time)
+    last_side = target.side_of(last_xy)
+    this_side = target.side_of(this_xy)
+    if last_side == 0.0 or last_side * this_side > 0.0:
+        return False, 0, False
+
+    # work out where the line from the last position to this one meets the target
+    # line, as a fraction along the target line
+    last_x, last_y = last_xy
+    along_car = last_side / (last_side - this_side)
+    cross_x = last_x + (x - last_x) * along_car
+    cross_y = last_y + (y - last_y) * along_car
+    target_dx, target_dy = target.direction
+    along_target = ((cross_x - target.xy1[0]) * target_dx + (cross_y - target.xy1[1]) * target_dy) / target.length_sq
+
+    # is this intersect point on the target line?
+    if 0.0 <= along_target <= 1.0:
+        crossed_backwards = angular_difference(heading, target.target_heading) > 150
+
+        # work out the precise time we crossed the line
+        dist = int(((x - mid_x) ** 2 + (y - mid_y) ** 2) ** 0.5 * FEET_PER_METRE)
+        if dist == 0.0:
+            est_cross_time = this_timestamp
+        else:
+            time_gap = this_timestamp - last_timestamp
+            last_dist = int(((last_x - mid_x) ** 2 + (last_y - mid_y) ** 2) ** 0.5 * FEET_PER_METRE)
+            distance_ratio = (last_dist + dist) / dist
+            est_cross_time = this_timestamp - (time_gap / distance_ratio)
+        Trace.record(TRACE_CROSSED, heading, target.target_heading, this_timestamp - est_cross_time, this_timestamp)
+        return True, est_cross_time, crossed_backwards
 
     return False, 0, False
 
@@ -71,19 +83,23 @@ def will_cross_line(this_pos: GpsPos, target: Target) -> (bool, float, bool):
     # distance than we'd expect in a second creating gaps that cause us to miss gates
     miles_per_sec = this_pos.speed / 3600
     miles_per_nearly2s = miles_per_sec * 1.8
-    next_lat_long = get_point_on_heading((this_pos.lat, this_pos.long), this_pos.heading, miles_per_nearly2s)
-    next_gps_point = GpsPos(next_lat_long[0], next_lat_long[1],
-                            this_pos.heading, this_pos.speed, this_pos.timestamp + 1.8)
-
-    # once useful for debugging
-    # if this_pos.speed > 10:
-    #     logger.debug(f"this gps point = {this_pos.lat},{this_pos.long} travelling at {miles_per_sec} mps")
-    #     logger.debug(f"next gps point = {next_lat_long[0]},{next_lat_long[1]}")
-    #     dist1 = haversine((this_pos.lat, this_pos.long), target.midpoint, Unit.FEET)
-    #     dist2 = haversine(next_lat_long, target.midpoint, Unit.FEET)
-    #     logger.debug(f"dist to this = {dist1}    dist to next = {dist2}")
-
-    (crossed, cross_time, backwards) = crossed_line(this_pos, next_gps_point, target)
+    # this distance always used to be handed to get_point_on_heading(), which works in
+    # kilometres, so the miles were taken as kilometres. The DRS time adjustments have been
+    # tuned against the resulting look ahead, so it keeps that scale rather than being metres
+    legacy_look_ahead = miles_per_nearly2s * 1000
+    this_xy = this_pos.xy(target.get_projection())
+    next_xy = point_on_heading_xy(this_xy, this_pos.heading, legacy_look_ahead)
+
+    (crossed, cross_time, backwards) = _crossed_line_xy(this_xy, this_pos.timestamp,
+                                                        next_xy, this_pos.timestamp + 1.8,
+                                                        this_pos.heading, target)
     if target.target_heading < 0:
         target.target_heading = this_pos.heading
     return crossed, cross_time, False
+
+
+# the distance in feet from the position to the middle of the target
+def distance_to_target_feet(pos: GpsPos, target: Target) -> float:
+    x, y = pos.xy(target.get_projection())
+    mid_x, mid_y = target.mid_xy
+    return ((x - mid_x) ** 2 + (y - mid_y) ** 2) ** 0.5 * FEET_PER_METRE
@@ -8,28 +8,33 @@ from lemon_pi.car.updaters import PositionUpdater
 from threading import Thread
 from lemon_pi.car.event_defs import (
     ExitApplicationEvent,
-    NotMovingEvent,
-    MovingEvent,
     GPSConnectedEvent,
     GPSDisconnectedEvent
 )
+from lemon_pi.car.movement_detector import MovementDetector
 import logging
 import time
 import os
 import subprocess
 from python_settings import settings
 
+from lemon_pi.shared.clock import Clock
 from lemon_pi.shared.data_provider_interface import GpsProvider, GpsPos
 from lemon_pi.shared.events import EventHandler
+from lemon_pi.shared.trace import Trace
 from lemon_pi.shared.usb_detector import UsbDetector, UsbDevice
 
 logger = logging.getLogger(__name__)
 
+# lat and long of every timestamped report from gpsd
+TRACE_REPORT = Trace.point("gps report")
+
 
 class GpsReader(Thread, SpeedProvider, PositionProvider, EventHandler, GpsProvider):
 
-    def __init__(self, log_to_file=False):
+    def __init__(self, log_to_file=False, clock: Clock = None):
         Thread.__init__(self, daemon=True)
+        self.clock = clock or Clock.get_instance()
         self.fix_timestamp = 0
         self.speed_mph = 999
         self.heading = 0
@@ -40,6 +45,7 @@ class GpsReader(Thread, SpeedProvider, PositionProvider, EventHandler, GpsProvid
         self.log = log_to_file
         self.finished = False
         self.time_synced = False
+        self.movement_detector = MovementDetector()
         ExitApplicationEvent.register_handler(self)
 
     def handle_event(self, event, **kwargs):
@@ -59,18 +65,15 @@ class GpsReader(Thread, SpeedProvider, PositionProvider, EventHandler, GpsProvid
                         data = session.next()
 
                         if session.fix.time and str(session.fix.time) != "nan":
-                            logger.debug("{} {} {} {}".
-                                         format(session.fix.time,
-                                                data['class'],
-                                                session.fix.latitude,
-                                                session.fix.longitude))
+                            Trace.record(TRACE_REPORT, session.fix.latitude, session.fix.longitude)
                             gps_datetime = parser.isoparse(session.fix.time).astimezone()
                             if gps_datetime.year < 2021:
                                 logger.debug("time wonky, ignoring")
                                 continue
                             gps_tstamp = gps_datetime.timestamp()
+                            self.clock.sync(gps_tstamp)
                         else:
-                            gps_tstamp = time.time()
+                            gps_tstamp = self.clock.time()
 
                         if session.fix.status == STATUS_NO_FIX:
                             # losing a gps fix doesn't emit a GPSDisconnected event ..
@@ -88,22 +91,18 @@ class GpsReader(Thread, SpeedProvider, PositionProvider, EventHandler, GpsProvid
                             # assuming its coming in m/s
                             if not math.isnan(session.fix.speed):
                                 self.speed_mph = int(session.fix.speed * 2.237)
-                                if self.speed_mph < 3:
-                                    NotMovingEvent.emit(speed=self.speed_mph,
-                                                        lat_long=(session.fix.latitude, session.fix.longitude))
-                                else:
-                                    MovingEvent.emit(speed=self.speed_mph,
-                                                     lat_long=(session.fix.latitude, session.fix.longitude))
                             if not math.isnan(session.fix.track):
                                 self.heading = int(session.fix.track)
                             if not math.isnan(session.fix.latitude):
                                 self.lat = session.fix.latitude
                                 self.long = session.fix.longitude
-                                self.fix_timestamp = time.time()
+                                self.fix_timestamp = self.clock.time()
+                                if not math.isnan(session.fix.speed):
+                                    self.movement_detector.update(self.lat, self.long, self.speed_mph, gps_tstamp)
                                 # generally we should try to move away from position listeners, and instead
                                 # have them pull from this class when they need it
                                 if self.position_listener:
-                                    start_time = time.time()
+                                    start_time = time.monotonic()
                                     try:
                                         self.position_listener.update_position(self.lat, self.long,
                                                                                self.heading, gps_tstamp,
@@ -111,7 +110,7 @@ class GpsReader(Thread, SpeedProvider, PositionProvider, EventHandler, GpsProvid
                                     except Exception:
                                         logger.exception("issue with GPS listener.")
                                     finally:
-                                        elapsed_ms = int(time.time() - start_time * 1000)
+                                        elapsed_ms = int((time.monotonic() - start_time) * 1000)
                                         if elapsed_ms > 50:
                                             logger.warning(f"position handling took {elapsed_ms} ms")
                                 if not self.working:
@@ -127,25 +126,25 @@ class GpsReader(Thread, SpeedProvider, PositionProvider, EventHandler, GpsProvid
                 time.sleep(10)
 
     def get_speed(self) -> int:
-        if self.time_synced and time.time() - self.fix_timestamp < 5:
+        if self.time_synced and self.clock.time() - self.fix_timestamp < 5:
             return self.speed_mph
         else:
             return 999
 
     def get_heading(self) -> int:
-        if self.time_synced and time.time() - self.fix_timestamp < 5:
+        if self.time_synced and self.clock.time() - self.fix_timestamp < 5:
             return int(self.heading)
         else:
             return 0
 
     def get_lat_long(self) -> (float, float):
-        if self.time_synced and time.time() - self.fix_timestamp < 5:
+        if self.time_synced and self.clock.time() - self.fix_timestamp < 5:
             return self.lat, self.long
         else:
             return 0.0, 0.0
 
     def get_gps_position(self) -> Optional[GpsPos]:
-        if self.time_synced and time.time() - self.fix_timestamp < 5:
+        if self.time_synced and self.clock.time() - self.fix_timestamp < 5:
             return GpsPos(self.lat, self.long, int(self.heading), self.speed_mph, self.fix_timestamp)
         else:
             return None
@@ -6,7 +6,8 @@ from lemon_pi.car.event_defs import (
     LeaveTrackEvent, StateChangePittedEvent, StateChangeSettingOffEvent, CompleteLapEvent, OBDConnectedEvent,
     OBDDisconnectedEvent, GPSConnectedEvent, GPSDisconnectedEvent, RaceFlagStatusEvent, DriverMessageEvent,
     ExitApplicationEvent, EnterTrackEvent, RadioReceiveEvent, ButtonPressEvent,
-    AudioAlarmEvent, SetTargetTimeEvent, RacePositionEvent, RacePersuerEvent, WifiDisconnectedEvent, WifiConnectedEvent)
+    AudioAlarmEvent, SetTargetTimeEvent, RacePositionEvent, RacePersuerEvent, WifiDisconnectedEvent, WifiConnectedEvent,
+    SectorCompleteEvent)
 
 import logging
 import platform
@@ -15,7 +16,7 @@ import time
 from python_settings import settings
 
 from lemon_pi.car.state_machine import StateMachine
-from lemon_pi.shared.events import EventHandler
+from lemon_pi.shared.events import EventHandler, Dispatch
 from lemon_pi.shared.gui_components import AlertBox, FadingBox
 from lemon_pi.shared.time_provider import TimeProvider
 
@@ -79,6 +80,9 @@ class Gui(EventHandler):
     TEXT_LARGE = 48
     TEXT_XL = 64
 
+    # the display is updated on a thread of its own, so redrawing never holds up the gps
+    dispatch = Dispatch.SERIAL
+
     def __init__(self, width, height):
         Gui.WIDTH = width
         Gui.HEIGHT = height
@@ -166,23 +170,25 @@ class Gui(EventHandler):
         self.predictive_lap_timer = self.create_lap_timer(self.col6)
         self.race_position_display = self.create_race_position_display(self.col7)
 
-        LeaveTrackEvent.register_handler(self)
-        EnterTrackEvent.register_handler(self)
-        StateChangePittedEvent.register_handler(self)
-        StateChangeSettingOffEvent.register_handler(self)
-        CompleteLapEvent.register_handler(self)
-        OBDConnectedEvent.register_handler(self)
-        OBDDisconnectedEvent.register_handler(self)
-        GPSConnectedEvent.register_handler(self)
-        GPSDisconnectedEvent.register_handler(self)
-        WifiConnectedEvent.register_handler(self)
-        WifiDisconnectedEvent.register_handler(self)
-        RaceFlagStatusEvent.register_handler(self)
-        DriverMessageEvent.register_handler(self)
-        RadioReceiveEvent.register_handler(self)
-        SetTargetTimeEvent.register_handler(self)
-        RacePositionEvent.register_handler(self)
-        RacePersuerEvent.register_handler(self)
+        LeaveTrackEvent.register_handler(self, self.__show_stint_ending)
+        StateChangePittedEvent.register_handler(self, self.__show_stint_starting)
+        StateChangeSettingOffEvent.register_handler(self, self.__show_race_position)
+        EnterTrackEvent.register_handler(self, self.__show_race_position)
+        # show the race position as the lap is completed
+        CompleteLapEvent.register_handler(self, self.__show_race_position)
+        OBDConnectedEvent.register_handler(self, self.__obd_connected)
+        OBDDisconnectedEvent.register_handler(self, self.__obd_disconnected)
+        GPSConnectedEvent.register_handler(self, self.__gps_connected)
+        GPSDisconnectedEvent.register_handler(self, self.__gps_disconnected)
+        WifiConnectedEvent.register_handler(self, self.__wifi_connected)
+        WifiDisconnectedEvent.register_handler(self, self.__wifi_disconnected)
+        RaceFlagStatusEvent.register_handler(self, self.__show_flag)
+        DriverMessageEvent.register_handler(self, self.__show_driver_message)
+        RadioReceiveEvent.register_handler(self, self.__radio_received)
+        SetTargetTimeEvent.register_handler(self, self.__set_target_time)
+        RacePositionEvent.register_handler(self, self.__race_position)
+        RacePersuerEvent.register_handler(self, self.__update_persuer_position)
+        SectorCompleteEvent.register_handler(self, self.__update_sector)
 
     def present_main_app(self):
         # sleep up to 5 seconds
@@ -204,93 +210,71 @@ class Gui(EventHandler):
         self.msg_area.bg = "black"
         self.msg_area.value = ""
 
-    def handle_event(self, event, **kwargs):
-        if event == LeaveTrackEvent:
-            self._col_display(4)
-            return
-        if event == StateChangePittedEvent:
-            self._col_display(5)
-            return
-        if event == StateChangeSettingOffEvent or event == EnterTrackEvent:
-            self._col_display(7)
-            return
+    # each event the gui shows has a method of its own, registered in __init__
 
-        if event == RadioReceiveEvent:
-            self.radio_signal.brighten()
-            return
+    def __show_stint_ending(self, **kwargs):
+        self._col_display(4)
 
-        if event == RaceFlagStatusEvent:
-            # if it's green, make sure the background of the speed dial is black
-            flag = kwargs.get("flag")
-            self.speed_heading_widget.text_color = "white"
-            if flag == "GREEN":
-                self.speed_heading_widget.bg = "black"
-            elif flag == "YELLOW":
-                self.speed_heading_widget.bg = "yellow"
-                self.speed_heading_widget.text_color = "black"
-            elif flag == "RED":
-                self.speed_heading_widget.bg = "red"
-            elif flag == "BLACK":
-                self.speed_heading_widget.bg = "dark-blue"
-            else:
-                logger.warning("unknown flag state : {}".format(flag))
-            return
+    def __show_stint_starting(self, **kwargs):
+        self._col_display(5)
 
-        if event == RacePositionEvent:
-            self.__update_race_position(**kwargs)
-            self._col_display(7)
-            # suppress the predicted lap timer for 10s
-            self.suppress_prediction_until = time.time() + 10
-            return
+    def __show_race_position(self, **kwargs):
+        self._col_display(7)
 
-        if event == RacePersuerEvent:
-            self.__update_persuer_position(**kwargs)
-            return
+    def __radio_received(self, **kwargs):
+        self.radio_signal.brighten()
 
-        if event == DriverMessageEvent:
-            self.msg_area.text_size = Gui.TEXT_LARGE
-            self.msg_area.value = kwargs.get("text")
-            duration_secs = kwargs.get("duration_secs")
-            self.msg_area.bg = "purple"
-            # we cancel any remove message callback to ensure this message
-            # stays until it is replaced or stays for the configured time
-            self.msg_area.cancel(self.__remove_message)
-            self.msg_area.after(3000, self.__remove_message_highlight)
-            self.msg_area.after(duration_secs * 1000, self.__remove_message)
-            return
+    def __show_flag(self, flag=None):
+        # if it's green, make sure the background of the speed dial is black
+        self.speed_heading_widget.text_color = "white"
+        if flag == "GREEN":
+            self.speed_heading_widget.bg = "black"
+        elif flag == "YELLOW":
+            self.speed_heading_widget.bg = "yellow"
+            self.speed_heading_widget.text_color = "black"
+        elif flag == "RED":
+            self.speed_heading_widget.bg = "red"
+        elif flag == "BLACK":
+            self.speed_heading_widget.bg = "dark-blue"
+        else:
+            logger.warning("unknown flag state : {}".format(flag))
 
-        if event == SetTargetTimeEvent:
-            self.__update_target_time(kwargs.get("target"))
-            return
+    def __race_position(self, **kwargs):
+        self.__update_race_position(**kwargs)
+        self._col_display(7)
+        # suppress the predicted lap timer for 10s
+        self.suppress_prediction_until = time.time() + 10
 
-        # show the race position as the lap is completed
-        if event == CompleteLapEvent:
-            self._col_display(7)
-            return
+    def __show_driver_message(self, text=None, duration_secs=None, **kwargs):
+        self.msg_area.text_size = Gui.TEXT_LARGE
+        self.msg_area.value = text
+        self.msg_area.bg = "purple"
+        # we cancel any remove message callback to ensure this message
+        # stays until it is replaced or stays for the configured time
+        self.msg_area.cancel(self.__remove_message)
+        self.msg_area.after(3000, self.__remove_message_highlight)
+        self.msg_area.after(duration_secs * 1000, self.__remove_message)
 
-        if event == OBDConnectedEvent:
-            self.obd_image.on()
-            return
+    def __set_target_time(self, target=None):
+        self.__update_target_time(target)
 
-        if event == OBDDisconnectedEvent:
-            self.obd_image.off()
-            return
+    def __obd_connected(self, **kwargs):
+        self.obd_image.on()
 
-        if event == GPSConnectedEvent:
-            self.gps_image.on()
-            return
+    def __obd_disconnected(self, **kwargs):
+        self.obd_image.off()
 
-        if event == GPSDisconnectedEvent:
-            self.gps_image.off()
-            return
+    def __gps_connected(self, **kwargs):
+        self.gps_image.on()
 
-        if event == WifiConnectedEvent:
-            self.wifi_image.on()
-            return
+    def __gps_disconnected(self, **kwargs):
+        self.gps_image.off()
 
-        if event == WifiDisconnectedEvent:
-            self.wifi_image.off()
-            return
+    def __wifi_connected(self, **kwargs):
+        self.wifi_image.on()
+
+    def __wifi_disconnected(self, **kwargs):
+        self.wifi_image.off()
 
     def handle_keyboard(self, event_data):
         logger.info("Key Pressed : {}".format(event_data.key))
@@ -319,7 +303,7 @@ class Gui(EventHandler):
             self.__update_lap(randomLapTimeProvider)
             self.__update_predicted_lap(randomLapTimeProvider)
         if event_data.key == 'p':
-            self.handle_event(RadioReceiveEvent)
+            self.__radio_received()
         if event_data.key == 'b':
             ButtonPressEvent.emit(button=0)
         if event_data.key == 'a':
@@ -485,6 +469,12 @@ class Gui(EventHandler):
         # child [7]
         Text(result, "mm:ss", size=Gui.TEXT_LARGE, font=self.font, color="white")
 
+        # child [8] the last sector completed
+        Text(result, "", size=Gui.TEXT_SMALL, font=self.font, color="white")
+
+        # child [9] the theoretical best lap, from the best time in each sector
+        Text(result, "", size=Gui.TEXT_SMALL, font=self.font, color="lightgreen")
+
         return result
 
     def create_race_position_display(self, parent):
@@ -614,43 +604,78 @@ class Gui(EventHandler):
             outer_box.children[6].value = "BEST"
             self.__display_time(0, outer_box.children[7])
 
+    def __update_sector(self, sector=0, name="", time=0.0, delta=None, is_best=False, consistency=None):
+        sector_text = self.col6.children[0].children[8]
+        if delta is None:
+            sector_text.value = f"{name} {time:.1f}"
+        else:
+            sector_text.value = f"{name} {delta:+.2f}"
+        # how far the last few times for the sector have spread
+        if consistency is not None:
+            sector_text.value += f" \u00b1{consistency:.1f}"
+        if is_best:
+            sector_text.text_color = "white"
+            sector_text.bg = "purple"
+        elif delta is not None and delta < 0.5:
+            sector_text.text_color = "green"
+            sector_text.bg = "black"
+        else:
+            sector_text.text_color = "yellow"
+            sector_text.bg = "black"
+
     def __update_predicted_lap(self, provider: LapProvider):
         predicted = provider.get_predicted_lap_time()
         target_lap = self.target_time or provider.get_best_lap_time()
 
         outer_box = self.col6.children[0]
 
-        if predicted:
-            # if we're on track and getting predictions then show them
+        # the live delta compares against the same point of the reference lap, so unlike the
+        # prediction it's there from the start of the lap
+        delta = provider.get_live_delta()
+
+        if predicted or delta is not None:
+            # if we're on track and getting predictions or a delta then show them
             if StateMachine.is_on_track() and not self.col6.visible and time.time() > self.suppress_prediction_until:
                 self._col_display(6)
+
+        if predicted:
             minutes = int(predicted / 60)
             seconds = int(predicted % 60)
             outer_box.children[1].value = "{:02d}:{:02d}".format(minutes, seconds)
-
-            if target_lap:
+            if delta is None and target_lap:
                 delta = predicted - target_lap
-                outer_box.children[4].value = f"{delta:0.1f} s"
-                if delta < -1:
-                    outer_box.children[4].text_color = "white"
-                    outer_box.children[4].bg = "purple"
-                elif delta < 1:
-                    outer_box.children[4].text_color = "green"
-                    outer_box.children[4].bg = "black"
-                elif delta < 2:
-                    outer_box.children[4].text_color = "white"
-                    outer_box.children[4].bg = "black"
-                else:
-                    outer_box.children[4].text_color = "yellow"
-                    outer_box.children[4].bg = "black"
+        else:
+            # there's no prediction for the start of the lap, don't leave the last lap's showing
+            outer_box.children[1].value = "--:--"
+
+        if delta is not None:
+            outer_box.children[4].value = f"{delta:0.1f} s"
+            if delta < -1:
+                outer_box.children[4].text_color = "white"
+                outer_box.children[4].bg = "purple"
+            elif delta < 1:
+                outer_box.children[4].text_color = "green"
+                outer_box.children[4].bg = "black"
+            elif delta < 2:
+                outer_box.children[4].text_color = "white"
+                outer_box.children[4].bg = "black"
             else:
-                outer_box.children[4].value = "? s"
-                outer_box.children[4].text_color = "grey"
+                outer_box.children[4].text_color = "yellow"
                 outer_box.children[4].bg = "black"
+        elif predicted:
+            outer_box.children[4].value = "? s"
+            outer_box.children[4].text_color = "grey"
+            outer_box.children[4].bg = "black"
 
         if target_lap:
             self.__display_time(target_lap, outer_box.children[7])
 
+        theoretical_best = provider.get_theoretical_best_lap_time()
+        if theoretical_best:
+            outer_box.children[9].value = f"OPT {int(theoretical_best / 60):02d}:{theoretical_best % 60:04.1f}"
+        else:
+            outer_box.children[9].value = ""
+
     @staticmethod
     def __display_time(seconds: float, text_box: Text):
         minutes = int(seconds / 60)
@@ -696,5 +721,11 @@ class RandomLapTimeProvider(LapProvider):
     def get_best_lap_time(self) -> float:
         return 200 + random.randint(-2000, 2000) / 1000
 
+    def get_live_delta(self) -> float:
+        return random.randint(-3000, 3000) / 1000
+
+    def get_theoretical_best_lap_time(self) -> float:
+        return 195 + random.randint(-2000, 2000) / 1000
+
 
 randomLapTimeProvider = RandomLapTimeProvider()
@@ -0,0 +1,99 @@
+import logging
+from typing import Optional
+
+import numpy as np
+
+from lemon_pi.car.gate import Gates
+
+logger = logging.getLogger(__name__)
+
+# The virtual gates are only a couple of hundred feet apart, and the time the
+# car crossed one is only known to a tenth or two, so the best time between
+# two neighbouring gates is mostly the luckiest crossing. Added up over a lap
+# those come to many seconds faster than anything actually driven. Timing
+# stretches of a few gates at a time keeps the optimal lap believable
+STRETCH_GATES = 3
+
+# how many of the stretches that lost the most time are reported for each lap
+WORST_PLACES = 3
+
+# the name of the last stretch of the lap, which ends at the finish
+FINISH = "finish"
+
+
+class LapLosses:
+    # Where a lap lost the most time against the optimal lap. Kept small, so it
+    # can be announced or sent to the pit as it is.
+
+    def __init__(self, lap_time: float, optimal_lap_time: Optional[float], worst: [(str, float)]):
+        self.lap_time = lap_time
+        # None until every stretch of the lap has been timed
+        self.optimal_lap_time = optimal_lap_time
+        # the gate at the end of each stretch, and the seconds lost over it, worst first
+        self.worst = worst
+
+    def __repr__(self):
+        optimal = "?" if self.optimal_lap_time is None else f"{self.optimal_lap_time:.2f}"
+        return f"lap {self.lap_time:.2f} optimal {optimal} " + \
+            " ".join(f"{name} +{loss:.2f}" for name, loss in self.worst)
+
+
+class LapAnalysis:
+    # The theoretical optimal lap from the virtual gates: the best time seen
+    # over each stretch of the lap, all added up, and where each lap lost time
+    # against it.
+    #
+    # The lap is cut into stretches of a few gates, the last one ending at the
+    # finish. As each lap completes, the time over every stretch is worked out
+    # in one go from the times the gates recorded for the lap. A stretch that
+    # starts or ends at a missed gate, or at a gate the lap didn't reach, isn't
+    # timed. The bests start again whenever the gates change, e.g. when a
+    # previous session is loaded or the track is reversed.
+
+    def __init__(self, stretch_gates: int = STRETCH_GATES):
+        self.stretch_gates = stretch_gates
+        self.gates: Optional[Gates] = None
+        self.gate_count = 0
+        # the index of the gate at the end of each stretch, apart from the last which ends at the finish
+        self.ends = np.empty(0, dtype=int)
+        self.best = np.empty(0)
+
+    # analyse a lap that's just been recorded by the gates, where reached is how many of the gates
+    # were crossed or missed on the way round
+    def lap_completed(self, gates: Gates, lap_time: float, reached: int) -> Optional[LapLosses]:
+        if gates is not self.gates or len(gates) != self.gate_count:
+            self._start(gates)
+        times = self._stretch_times(gates, lap_time, reached)
+        timed = ~np.isnan(times)
+        if not timed.any():
+            return None
+        np.fmin(self.best, times, out=self.best)
+        losses = np.where(timed, times - self.best, 0.0)
+        worst = [i for i in np.argsort(-losses, kind="stable")[:WORST_PLACES] if losses[i] > 0]
+        result = LapLosses(lap_time, self.get_optimal_lap_time(), [(self._name(i), float(losses[i])) for i in worst])
+        logger.info(f"{result}")
+        return result
+
+    # the sum of the best time over each stretch, or None until they've all been timed
+    def get_optimal_lap_time(self) -> Optional[float]:
+        if len(self.best) == 0 or not np.all(np.isfinite(self.best)):
+            return None
+        return float(self.best.sum())
+
+    def _start(self, gates: Gates):
+        self.gates = gates
+        self.gate_count = len(gates)
+        self.ends = np.arange(self.stretch_gates - 1, len(gates), self.stretch_gates)
+        self.best = np.full(len(self.ends) + 1, np.inf)
+
+    def _stretch_times(self, gates: Gates, lap_time: float, reached: int) -> np.ndarray:
+        stats = gates.stats
+        crossed = ~stats.missed[self.ends] & (self.ends < reached)
+        ends = np.append(stats.last_time_from_start[self.ends], lap_time)
+        starts = np.insert(ends[:-1], 0, 0.0)
+        times = ends - starts
+        timed = np.append(crossed, True) & np.insert(crossed, 0, True) & (times > 0)
+        return np.where(timed, times, np.nan)
+
+    def _name(self, i: int) -> str:
+        return self.gates[int(self.ends[i])].target.name if i < len(self.ends) else FINISH
@@ -1,14 +1,197 @@
+import json
 import os
 import pickle
 import logging
+import time
+from queue import Queue
+from threading import Thread, current_thread
+from typing import Optional
+
+import numpy as np
 
 from lemon_pi.car.gate import Gates
+from lemon_pi.car.projection import LocalProjection
+from lemon_pi.car.session_consolidator import same_layout, merge_session, age_weight, TRACK_BUDGET_BYTES
+from lemon_pi.car.session_format import read_session, read_header, encode_session, write_atomically, \
+    session_filename, SessionFormatError, SESSION_SUFFIX, LEGACY_SUFFIX, TEMP_SUFFIX
+from lemon_pi.car.session_journal import SessionJournal
 from lemon_pi.car.track import TrackLocation
 
 logger = logging.getLogger(__name__)
 
+CATALOGUE_FILE = "catalogue.json"
+
+# how many gate positions, evenly spaced around the lap, describe the shape of a session's lap
+FINGERPRINT_POINTS = 8
+
+# each of those positions has to be within this distance of where the car went for the
+# session to be worth loading
+FINGERPRINT_TOLERANCE_METRES = 50.0
+
+
+class SessionInfo:
+    # What the catalogue knows about a saved session, which is enough to
+    # decide whether it's worth loading the gates
+
+    def __init__(self, file: str, distance_feet: int, timestamp: float, lap_count: int, gate_count: int,
+                 fingerprint: [[float]]):
+        self.file = file
+        self.distance_feet = distance_feet
+        self.timestamp = timestamp
+        self.lap_count = lap_count
+        self.gate_count = gate_count
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def from_gates(cls, file: str, gates: Gates, distance_feet: int = None) -> "SessionInfo":
+        if distance_feet is None:
+            distance_feet = gates.get_distance_feet()
+        step = max(len(gates) / FINGERPRINT_POINTS, 1)
+        picked = sorted({int(i * step) for i in range(FINGERPRINT_POINTS) if int(i * step) < len(gates)})
+        fingerprint = [[round(gates[i].lat, 5), round(gates[i].long, 5)] for i in picked]
+        return SessionInfo(file, distance_feet, gates.timestamp, gates.lap_count(), len(gates), fingerprint)
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "SessionInfo":
+        return SessionInfo(d["file"], d["distance_feet"], d["timestamp"], d["lap_count"], d["gate_count"],
+                           d["fingerprint"])
+
+    def to_dict(self) -> dict:
+        return {
+            "file": self.file,
+            "distance_feet": self.distance_feet,
+            "timestamp": self.timestamp,
+            "lap_count": self.lap_count,
+            "gate_count": self.gate_count,
+            "fingerprint": self.fingerprint,
+        }
+
+    # is any point of the fingerprint within the given distance of the x/y position?
+    def near(self, xy, projection: LocalProjection, metres: float) -> bool:
+        if not self.fingerprint:
+            return False
+        points = np.array([projection.to_xy(lat, long) for lat, long in self.fingerprint]).reshape(-1, 2)
+        return bool((((points - np.asarray(xy)) ** 2).sum(axis=1) <= metres ** 2).any())
+
+    # does every point of the fingerprint lie close to the given trace of x/y positions?
+    def fits(self, trace: np.ndarray, projection: LocalProjection) -> bool:
+        if len(trace) == 0:
+            return False
+        points = np.array([projection.to_xy(lat, long) for lat, long in self.fingerprint]).reshape(-1, 2)
+        dist_sq = ((points[:, None, :] - trace[None, :, :]) ** 2).sum(axis=2)
+        return bool(np.all(dist_sq.min(axis=1) <= FINGERPRINT_TOLERANCE_METRES ** 2))
+
+
+class SessionWriter:
+    # Writes session files on a thread of its own, so saving at the end of a
+    # session doesn't hold up the gps thread while the sd card catches up.
+    # Callers hand over the bytes to write, which is a snapshot of the session
+    # as it was when it was saved. Every file is written atomically. Longer
+    # jobs that read and write session files can be run here too, so they
+    # happen in order with the writes.
+    #
+    # The writer keeps a count of writes and failures and how long the writes
+    # have taken, and the number of writes still waiting is the queue depth.
+
+    def __init__(self):
+        self.queue = Queue()
+        self.thread: Optional[Thread] = None
+        self.writes = 0
+        self.failures = 0
+        self.last_write_ms = 0.0
+        self.max_write_ms = 0.0
+        self.total_write_ms = 0.0
+
+    # write each of the (path, data) files, then add to the end of each of the appends, then
+    # remove the given paths
+    def submit(self, files: [(str, bytes)], remove: [str] = (), appends: [(str, bytes)] = ()):
+        if self.thread is None:
+            self.thread = Thread(target=self._run, daemon=True)
+            self.thread.start()
+        self.queue.put((files, appends, remove))
+
+    def submit_job(self, job):
+        if self.thread is None:
+            self.thread = Thread(target=self._run, daemon=True)
+            self.thread.start()
+        self.queue.put(job)
+
+    # run fn on the writer thread, in order with everything submitted before it, and return what it returns
+    def call(self, fn):
+        if current_thread() is self.thread:
+            return fn()
+        result = []
+        self.submit_job(lambda: result.append(fn()))
+        self.wait()
+        if not result:
+            raise RuntimeError("session job failed")
+        return result[0]
+
+    def queue_depth(self) -> int:
+        return self.queue.unfinished_tasks
+
+    # block until everything submitted so far has been written. A job on the writer thread has
+    # nothing to wait for, everything before it has been written already
+    def wait(self):
+        if self.thread is not None and current_thread() is not self.thread:
+            self.queue.join()
+
+    def summary(self) -> str:
+        mean = self.total_write_ms / self.writes if self.writes else 0.0
+        return f"{self.writes} writes ({self.failures} failed), {self.queue_depth()} queued, " \
+               f"last {self.last_write_ms:.1f}ms, mean {mean:.1f}ms, max {self.max_write_ms:.1f}ms"
+
+    def _run(self):
+        while True:
+            work = self.queue.get()
+            try:
+                if callable(work):
+                    work()
+                else:
+                    self.write(*work)
+            except Exception:
+                logger.exception("session job failed")
+            finally:
+                self.queue.task_done()
+
+    # does the writing for submit, and for jobs that write files. Only called on the writer thread
+    def write(self, files: [(str, bytes)], appends: [(str, bytes)] = (), remove: [str] = ()):
+        start = time.perf_counter()
+        try:
+            for path, data in files:
+                write_atomically(path, data)
+            for path, data in appends:
+                with open(path, "ab") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+            for path in remove:
+                if os.path.exists(path):
+                    os.remove(path)
+        except OSError:
+            self.failures += 1
+            logger.exception(f"failed to write {[path for path, _ in list(files) + list(appends)]}")
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.writes += 1
+        self.last_write_ms = elapsed_ms
+        self.max_write_ms = max(self.max_write_ms, elapsed_ms)
+        self.total_write_ms += elapsed_ms
+        logger.info(f"session data written : {self.summary()}")
+
 
 class LapSessionStore:
+    # Sessions are saved one file each, with a catalogue alongside them that
+    # lists the distance, age and shape of each session. Starting up only
+    # reads the catalogue; the gates for a session are only loaded once it
+    # looks like it's the layout being driven.
+    #
+    # Saving a session takes a snapshot of it and hands it to a SessionWriter.
+    # The session in progress is journalled as it goes by a SessionJournal.
+    # Sessions of the same layout are merged into one by consolidate().
+    #
+    # The catalogue is only read, changed and written on the writer thread,
+    # so saves and consolidation can't undo one another's changes to it.
 
     __instance = None
 
@@ -17,6 +200,9 @@ class LapSessionStore:
         self.basedir = f"{dir}/{track.code}"
         if not os.path.isdir(self.basedir):
             os.makedirs(self.basedir)
+        self.catalogue: Optional[{str: SessionInfo}] = None
+        self.writer = SessionWriter()
+        self.journal: Optional[SessionJournal] = None
 
     @classmethod
     def init(cls, track: TrackLocation, dir="/var/lib/lemon-pi/track-data/"):
@@ -30,27 +216,212 @@ class LapSessionStore:
     def get_instance(cls):
         return cls.__instance
 
+    # all of the sessions in the catalogue, most recent first
+    def get_catalogue(self) -> [SessionInfo]:
+        return self.writer.call(
+            lambda: sorted(self._catalogue().values(), key=lambda a: a.timestamp, reverse=True))
+
+    def load_session(self, info: SessionInfo) -> Optional[Gates]:
+        return self._load_file(info.file)
+
     def load_sessions(self) -> [Gates]:
         # load all sessions for this track, sort them from most recent to least
         result = []
-        for file in os.listdir(self.basedir):
-            if file.endswith("-v1.dat"):
-                with open(os.path.join(self.basedir, file), "rb") as f:
-                    try:
-                        result.append(pickle.load(f))
-                    except ModuleNotFoundError:
-                        # ignore unloadable old content, this happens due to pickle failure
-                        pass
+        for info in self.get_catalogue():
+            gates = self.load_session(info)
+            if gates is not None:
+                result.append(gates)
         logger.info(f"loaded {len(result)} track configurations with previous data")
-        result.sort(key=lambda a: a.timestamp, reverse=True)
         return result
 
+    # Reads the sessions in the catalogue that pick() wants, most recent first and no more than
+    # limit of them, and hands them to done(). This all happens on the writer thread, in order
+    # with anything being written, so whoever asks never waits on the writer or the sd card
+    def load_in_background(self, pick, done, limit: int = 0):
+        def load():
+            result = []
+            for info in self.get_catalogue():
+                if limit and len(result) >= limit:
+                    break
+                if pick(info):
+                    gates = self._read_file(info.file)
+                    if gates is not None:
+                        result.append(gates)
+            logger.info(f"loaded {len(result)} previous sessions in the background")
+            done(result)
+        self.writer.submit_job(load)
+
+    # The gates are snapshotted here, as they carry on changing once the car is back out. Reading
+    # the catalogue, which can mean loading old sessions, and adding to it happen on the writer thread
     def save_session(self, gates: Gates):
-        filename = f"{gates.get_distance_feet()}-v1.dat"
+        distance_feet = gates.get_distance_feet()
+        filename = session_filename(distance_feet, gates.timestamp)
         file = os.path.join(self.basedir, filename)
         logger.info(f"saving session data in {file}")
         if gates.lap_count() > 3:
-            with open(file, "wb") as f:
-                pickle.dump(gates, f)
-                f.flush()
-            logger.info(f"data written, file created {file}")
+            data = encode_session(gates, distance_feet=distance_feet)
+            info = SessionInfo.from_gates(filename, gates, distance_feet)
+            self.writer.submit_job(lambda: self._save(info, data))
+            logger.info(f"session data queued for {file}")
+
+    # a session saved again, after more laps, replaces itself. Other sessions are left for consolidate()
+    def _save(self, info: SessionInfo, data: bytes):
+        self._catalogue()[info.file] = info
+        self.writer.write([(os.path.join(self.basedir, info.file), data),
+                           (self._catalogue_path(), self._encode_catalogue())])
+
+    # the journal that keeps this session safe until it's saved
+    def get_journal(self) -> SessionJournal:
+        if self.journal is None:
+            self.journal = SessionJournal(self.basedir, self.writer)
+        return self.journal
+
+    # wait for any saved sessions to be written
+    def flush(self):
+        self.writer.wait()
+
+    # merge the sessions for each layout into the most recent of them, and evict the oldest
+    # sessions until the rest fit in the budget. This happens on the writer thread
+    def consolidate(self):
+        self.writer.submit_job(self._consolidate)
+
+    def _consolidate(self):
+        infos = self.get_catalogue()
+        projection = self.track.projection
+        catalogue = {info.file: info for info in infos}
+        files = []
+        remove = []
+        # the newest session of each layout first, with the older ones after it
+        layouts: [[(SessionInfo, Gates)]] = []
+        for info in infos:
+            gates = self._read_file(info.file)
+            if gates is None:
+                continue
+            if projection is None:
+                projection = LocalProjection(*gates.start_finish.midpoint)
+            gates.set_projection(projection)
+            for layout in layouts:
+                if same_layout(layout[0][1], gates, projection):
+                    layout.append((info, gates))
+                    break
+            else:
+                layouts.append([(info, gates)])
+
+        for layout in layouts:
+            newest_info, newest = layout[0]
+            # a session can already have had some of these folded in, if we stopped before they were removed
+            merged = self._read_extra(newest_info.file).get("merged", [])
+            older = layout[1:]
+            if not older:
+                continue
+            for info, gates in older:
+                if gates.timestamp not in merged:
+                    merge_session(newest, gates, projection, age_weight(newest.timestamp - gates.timestamp))
+                    merged += [gates.timestamp] + self._read_extra(info.file).get("merged", [])
+                del catalogue[info.file]
+                remove.append(info.file)
+            filename = session_filename(newest.get_distance_feet(), newest.timestamp)
+            if filename != newest_info.file:
+                del catalogue[newest_info.file]
+                remove.append(newest_info.file)
+            catalogue[filename] = SessionInfo.from_gates(filename, newest)
+            files.append((filename, encode_session(newest, {"merged": merged})))
+            logger.info(f"merged {len(older)} sessions into {filename}")
+
+        written = {filename for filename, _ in files}
+        remove = [file for file in remove if file not in written]
+        sizes = {file: len(data) for file, data in files}
+        for file in catalogue.keys() - written:
+            sizes[file] = os.path.getsize(os.path.join(self.basedir, file))
+        kept = sorted(catalogue.values(), key=lambda a: a.timestamp, reverse=True)
+        while len(kept) > 1 and sum(sizes[info.file] for info in kept) > TRACK_BUDGET_BYTES:
+            evicted = kept.pop()
+            logger.info(f"evicting {evicted.file} from {evicted.timestamp:.0f}, over the budget for {self.track.code}")
+            del catalogue[evicted.file]
+            remove.append(evicted.file)
+            files = [(filename, data) for filename, data in files if filename != evicted.file]
+
+        if not files and not remove:
+            return
+        # the merged sessions go down before the ones folded into them are removed
+        for filename, data in files:
+            write_atomically(os.path.join(self.basedir, filename), data)
+        for file in remove:
+            if os.path.exists(os.path.join(self.basedir, file)):
+                os.remove(os.path.join(self.basedir, file))
+        self.catalogue = catalogue
+        self._write_catalogue()
+        logger.info(f"consolidated {len(infos)} sessions into {len(catalogue)}")
+
+    def _catalogue(self) -> {str: SessionInfo}:
+        if self.catalogue is None:
+            self.catalogue = self._read_catalogue()
+        return self.catalogue
+
+    def _read_extra(self, filename) -> dict:
+        if filename.endswith(LEGACY_SUFFIX):
+            return {}
+        try:
+            return read_header(os.path.join(self.basedir, filename)).get("extra", {})
+        except (OSError, ValueError, SessionFormatError):
+            return {}
+
+    def _load_file(self, filename) -> Optional[Gates]:
+        self.writer.wait()
+        return self._read_file(filename)
+
+    def _read_file(self, filename) -> Optional[Gates]:
+        path = os.path.join(self.basedir, filename)
+        try:
+            if filename.endswith(LEGACY_SUFFIX):
+                with open(path, "rb") as f:
+                    return pickle.load(f)
+            return read_session(path)
+        except Exception:
+            # a damaged session raises a SessionFormatError, but old pickled sessions can fail in all
+            # sorts of ways, when classes move or the file was cut short
+            logger.warning(f"unable to load session from {path}")
+            return None
+
+    def _read_catalogue(self) -> {str: SessionInfo}:
+        catalogue = {}
+        path = self._catalogue_path()
+        if os.path.isfile(path):
+            try:
+                with open(path) as f:
+                    for entry in json.load(f)["sessions"]:
+                        info = SessionInfo.from_dict(entry)
+                        catalogue[info.file] = info
+            except (ValueError, KeyError):
+                logger.warning(f"unable to read {path}, rebuilding it")
+        files = set()
+        for file in os.listdir(self.basedir):
+            if file.endswith(SESSION_SUFFIX) or file.endswith(LEGACY_SUFFIX):
+                files.add(file)
+            elif file.endswith(TEMP_SUFFIX):
+                # left behind by a write that never finished
+                os.remove(os.path.join(self.basedir, file))
+        changed = False
+        # sessions saved before there was a catalogue, or by an older version, have to be loaded once
+        for file in sorted(files - catalogue.keys()):
+            gates = self._load_file(file)
+            if gates is not None:
+                catalogue[file] = SessionInfo.from_gates(file, gates)
+                changed = True
+        for file in catalogue.keys() - files:
+            del catalogue[file]
+            changed = True
+        if changed:
+            self.catalogue = catalogue
+            self._write_catalogue()
+        logger.info(f"catalogue lists {len(catalogue)} track configurations with previous data")
+        return catalogue
+
+    def _catalogue_path(self) -> str:
+        return os.path.join(self.basedir, CATALOGUE_FILE)
+
+    def _encode_catalogue(self) -> bytes:
+        return json.dumps({"sessions": [info.to_dict() for info in self.catalogue.values()]}).encode("utf-8")
+
+    def _write_catalogue(self):
+        write_atomically(self._catalogue_path(), self._encode_catalogue())
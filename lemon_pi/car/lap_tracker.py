@@ -1,8 +1,14 @@
 import platform
+import time
 from typing import Optional
 
-from lemon_pi.car.gps_geometry import crossed_line
-from lemon_pi.car.predictor import LapTimePredictor
+import numpy as np
+
+from lemon_pi.car.crossing_detector import CrossingDetector
+from lemon_pi.car.lap_session_store import LapSessionStore
+from lemon_pi.car.live_delta import LiveDelta, ReferenceLap
+from lemon_pi.car.predictor import LapTimePredictor, PredictorState
+from lemon_pi.car.sector_timer import SectorTimer
 from lemon_pi.car.track import TrackLocation, START_FINISH
 from lemon_pi.car.updaters import PositionUpdater
 from lemon_pi.car.display_providers import LapProvider
@@ -10,28 +16,33 @@ from lemon_pi.car.event_defs import (
     LeaveTrackEvent,
     CompleteLapEvent,
     RadioSyncEvent,
-    LapInfoEvent, EnterTrackEvent, ResetFastLapEvent, ReverseTrackEvent
+    LapInfoEvent, EnterTrackEvent, ResetFastLapEvent, ReverseTrackEvent, LapLossesEvent
 )
 
-import time
 from datetime import datetime
 import logging
 from python_settings import settings
 
+from lemon_pi.shared.clock import Clock
 from lemon_pi.shared.data_provider_interface import GpsPos
 from lemon_pi.shared.events import EventHandler
+from lemon_pi.shared.trace import Trace
 
 logger = logging.getLogger(__name__)
 gps_logger = logging.getLogger("gps-logger")
 lap_logger = logging.getLogger("lap-logger")
 
+# lat, long and speed of every position the lap tracker is given
+TRACE_POSITION = Trace.point("lap tracker position")
+
 
 class LapTracker(PositionUpdater, LapProvider, EventHandler):
 
-    def __init__(self, track: TrackLocation):
+    def __init__(self, track: TrackLocation, clock: Clock = None):
         self.track = track
+        self.clock = clock or Clock.get_instance()
         self.on_track = False
-        self.lap_start_time = time.time()
+        self.lap_start_time = self.clock.time()
         self.last_gps = None
         self.lap_count = 999
         self.stint_lap_count = 0
@@ -40,12 +51,25 @@ class LapTracker(PositionUpdater, LapProvider, EventHandler):
         self.best_lap_time: Optional[float] = None
         self.last_timestamp = 0
         self.last_dist_to_line = 0
-        self.predictive_lap_timer = LapTimePredictor(track.get_start_finish_target())
+        # every crossing of the track's targets is worked out once, here
+        self.crossing_detector = CrossingDetector(track)
+        self.predictive_lap_timer = LapTimePredictor(track.get_start_finish_target(), self.crossing_detector)
+        self.live_delta = LiveDelta()
+        self.sector_timer = SectorTimer(track, self.crossing_detector)
         self.extra_handlers: [PositionUpdater] = []
+        # set when we've been restored part way round a lap, so that lap isn't timed
+        self.resuming = False
+        # the laps and gate times are journalled, so if the pi restarts mid stint we carry on
+        self.journal = None
+        if LapSessionStore.get_instance():
+            self.journal = LapSessionStore.get_instance().get_journal()
+            self.predictive_lap_timer.journal = self.journal
+            self._recover()
         LapInfoEvent.register_handler(self)
         LeaveTrackEvent.register_handler(self)
         EnterTrackEvent.register_handler(self)
         ResetFastLapEvent.register_handler(self)
+        ReverseTrackEvent.register_handler(self)
 
     def add_position_handler(self, p: PositionUpdater):
         self.extra_handlers.append(p)
@@ -63,17 +87,25 @@ class LapTracker(PositionUpdater, LapProvider, EventHandler):
     def process_position(self, lat: float, long: float, heading: float, tstamp: float, speed: int) -> None:
         this_gps = GpsPos(lat, long, heading, speed, tstamp)
         try:
-            logger.debug("updating position to {} {}".format(lat, long))
-            crossed_start_finish, cross_time, backwards = \
-                self.predictive_lap_timer.update_position(lat, long, heading, tstamp)
-            if crossed_start_finish:
+            Trace.record(TRACE_POSITION, lat, long, speed, tstamp)
+            crossings = self.crossing_detector.update(this_gps)
+            self.predictive_lap_timer.update_position(lat, long, heading, tstamp)
+            start_finish = self.crossing_detector.get_crossing(START_FINISH)
+            if start_finish:
+                cross_time, backwards = start_finish.cross_time, start_finish.backwards
                 if backwards:
                     self.track.reverse()
                     ReverseTrackEvent.emit()
 
                 # de-bounce hitting start finish line twice ... a better
                 # approach might be to ensure car travels so far away from line
-                if tstamp - self.lap_start_time > 10:
+                if tstamp - self.lap_start_time > 10 and self.resuming:
+                    # we restarted part way round the lap that's just finished, so it wasn't timed
+                    logger.info("timing the first lap since restarting")
+                    self.resuming = False
+                    self.live_delta.start_lap()
+                    self.lap_start_time = cross_time
+                elif tstamp - self.lap_start_time > 10:
                     lap_time = cross_time - self.lap_start_time
                     # something is creating weird vals in here
                     if lap_time < 0 or lap_time > 1000000:
@@ -87,32 +119,45 @@ class LapTracker(PositionUpdater, LapProvider, EventHandler):
                         self.lap_count = 0
                         self.stint_lap_count = 0
                         self.on_track = True
+                        self.live_delta.start_lap()
                     else:
                         logger.info("completed lap!")
                         self.lap_count += 1
                         self.stint_lap_count += 1
                         self.last_lap_time = lap_time
-                        if lap_time > 0 and (self.best_lap_time is None or lap_time < self.best_lap_time):
+                        is_best = lap_time > 0 and (self.best_lap_time is None or lap_time < self.best_lap_time)
+                        if is_best:
                             self.best_lap_time = lap_time
-                        lap_logger.info(f"{self.lap_count},{self.last_lap_time:.1f}")
+                        previous_best = self.live_delta.best
+                        self.live_delta.complete_lap(lap_time, is_best)
+                        self._journal_lap(self.live_delta.best is not previous_best)
+                        # the sector timer has already seen this crossing, so has finished the lap too
+                        lap_logger.info(self._lap_log_line())
+                        # the predictor has already recorded the lap against the gates
+                        losses = self.predictive_lap_timer.lap_losses
+                        if losses:
+                            LapLossesEvent.emit(optimal_lap_time=losses.optimal_lap_time, losses=losses.worst)
                     self.lap_start_time = cross_time
 
                     RadioSyncEvent.emit(ts=cross_time)
             else:
-                for target_metadata in self.track.targets.keys():
-                    target = self.track.targets[target_metadata]
-                    if target:
-                        if target_metadata != START_FINISH:
-                            crossed_target, cross_time, backwards = \
-                                crossed_line(self.last_gps, this_gps, target)
-                            if crossed_target:
-                                if backwards:
-                                    target_metadata.backwards_event.emit(ts=cross_time)
-                                    self.track.reverse()
-                                    ReverseTrackEvent.emit()
-                                else:
-                                    target_metadata.event.emit(ts=cross_time)
-                                break
+                for crossing in crossings:
+                    # sector targets have no events of their own
+                    target_metadata = crossing.key
+                    if not target_metadata.event:
+                        continue
+                    if crossing.backwards:
+                        target_metadata.backwards_event.emit(ts=crossing.cross_time)
+                        self.track.reverse()
+                        ReverseTrackEvent.emit()
+                    else:
+                        target_metadata.event.emit(ts=crossing.cross_time)
+                    break
+            self._update_live_delta(tstamp)
+            # start journalling as soon as the gates are laid down
+            if self.journal and not self.journal.is_active() and \
+                    self.predictive_lap_timer.state == PredictorState.WORKING:
+                self._checkpoint()
             # log gps
             if settings.LOG_GPS:
                 # defend against high speed logging here
@@ -140,26 +185,101 @@ class LapTracker(PositionUpdater, LapProvider, EventHandler):
                 self.lap_start_time = ts
         if event == LeaveTrackEvent:
             self.on_track = False
+            if self.journal:
+                self.journal.left_track()
+                self.journal.commit()
         if event == EnterTrackEvent:
             self.on_track = True
             if ts == 0.0:
-                self.lap_start_time = time.time()
+                self.lap_start_time = self.clock.time()
             else:
                 self.lap_start_time = ts
             if self.lap_count == 999:
                 self.lap_count = 0
             self.stint_lap_count = 0
+            self.live_delta.start_lap()
         if event == ResetFastLapEvent:
             self.best_lap_time = None
+            self.live_delta.reset_best()
+        if event == ReverseTrackEvent:
+            # the gates are laid down again the other way round, and journalling starts again after that
+            if self.journal:
+                self.journal.reset()
+
+    def _journal_lap(self, new_reference: bool):
+        if not self.journal:
+            return
+        self.journal.lap_completed(self.lap_count, self.stint_lap_count, self.last_lap_time, self.best_lap_time)
+        best = self.live_delta.best
+        if new_reference and best:
+            self.journal.best_reference(best.times, best.length, best.spacing)
+        if self.journal.needs_checkpoint():
+            self._checkpoint()
+        else:
+            self.journal.commit()
+
+    def _checkpoint(self):
+        predictor = self.predictive_lap_timer
+        centreline = predictor.centreline
+        best = self.live_delta.best
+        self.journal.checkpoint(predictor.gates, {
+            "lap_count": self.lap_count,
+            "stint_lap_count": self.stint_lap_count,
+            "last_lap_time": self.last_lap_time,
+            "best_lap_time": self.best_lap_time,
+            "on_track": self.on_track,
+            "centreline": np.column_stack([centreline.xs, centreline.ys]).tolist() if centreline else None,
+            "reference": {"times": best.times.tolist(), "length": best.length, "spacing": best.spacing}
+            if best else None,
+        })
+
+    # carry on from where we were before the pi restarted, if it was recently
+    def _recover(self):
+        start = time.perf_counter()
+        recovery = self.journal.recover()
+        if recovery is None:
+            return
+        state = recovery.lap_state()
+        self.lap_count = state["lap_count"]
+        self.stint_lap_count = state["stint_lap_count"]
+        self.last_lap_time = state["last_lap_time"]
+        self.best_lap_time = state["best_lap_time"]
+        self.on_track = state["on_track"]
+        self.predictive_lap_timer.restore(recovery.gates, recovery.state.get("centreline"), recovery.records)
+        reference = recovery.reference()
+        if reference:
+            self.live_delta.restore_best(ReferenceLap(*reference))
+        self.resuming = True
+        logger.info(f"restored lap {self.lap_count} from checkpoint and {len(recovery.records)} journal records "
+                    f"in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+    # compare where we are in this lap with the reference lap, on every fix
+    def _update_live_delta(self, tstamp: float):
+        if not self.on_track:
+            return
+        distance = self.predictive_lap_timer.get_lap_distance()
+        if distance is not None:
+            self.live_delta.update(distance, tstamp - self.lap_start_time,
+                                   self.predictive_lap_timer.centreline.length)
 
     def get_lap_count(self) -> int:
         return self.lap_count
 
+    # the lap number and time, then for tracks with sectors the theoretical best, blank until every
+    # sector has been timed, and the sector times of the lap if they were all timed
+    def _lap_log_line(self) -> str:
+        line = f"{self.lap_count},{self.last_lap_time:.1f}"
+        if not self.sector_timer.sectors:
+            return line
+        theoretical_best = self.sector_timer.get_theoretical_best_lap_time()
+        line += "," if theoretical_best is None else f",{theoretical_best:.2f}"
+        return line + "".join(f",{split:.2f}" for split in self.sector_timer.last_lap_splits or [])
+
     def get_stint_lap_count(self) -> int:
         return self.stint_lap_count
 
     def get_lap_timer(self) -> int:
-        return int(time.time() - self.lap_start_time)
+        return int(self.clock.time() - self.lap_start_time)
 
     def get_last_lap_time(self) -> float:
         return self.last_lap_time
@@ -170,22 +290,9 @@ class LapTracker(PositionUpdater, LapProvider, EventHandler):
     def get_best_lap_time(self) -> Optional[float]:
         return self.best_lap_time
 
+    def get_live_delta(self) -> Optional[float]:
+        return self.live_delta.get_delta()
+
+    def get_theoretical_best_lap_time(self) -> Optional[float]:
+        return self.sector_timer.get_theoretical_best_lap_time()
 
-if __name__ == "__main__":
-    import csv
-    from lemon_pi.car.track import read_tracks
-
-    logging.basicConfig(format='%(asctime)s %(name)s %(message)s',
-                        datefmt='%Y-%m-%d %H:%M:%S',
-                        level=logging.DEBUG)
-    tracks = read_tracks()
-
-    tracker = LapTracker(tracks[1])
-    with open("traces/trace-1608347418.csv") as csvfile:
-        points = csv.reader(csvfile, quoting=csv.QUOTE_NONNUMERIC)
-        x = 0
-        for point in points:
-            x += 1
-            if x % 1 == 0:
-                label = "hdg:{} spd:{}".format(int(point[3]), "?")
-                tracker.update_position(float(point[1]), float(point[2]), float(point[3]), float(point[0]), 30)
@@ -0,0 +1,122 @@
+import logging
+from typing import Optional
+
+import numpy as np
+
+from lemon_pi.car.event_defs import SetTargetTimeEvent, ReverseTrackEvent
+from lemon_pi.shared.events import EventHandler
+
+logger = logging.getLogger(__name__)
+
+# how far apart the samples in a reference lap are
+REFERENCE_SPACING_METRES = 5.0
+
+# a lap has to have been seen over at least this much of the centreline to be used as a reference
+MIN_LAP_COVERAGE = 0.9
+
+
+class ReferenceLap:
+    # The time taken to reach each point of a lap, sampled every few metres
+    # along the centreline. Looking up a distance is a couple of array reads.
+
+    def __init__(self, times: np.ndarray, length: float, spacing: float = REFERENCE_SPACING_METRES):
+        self.times = times
+        self.length = length
+        self.spacing = spacing
+        self.lap_time = float(times[-1])
+
+    @classmethod
+    def from_trace(cls, distances, elapsed_times, length: float, lap_time: float,
+                   spacing: float = REFERENCE_SPACING_METRES) -> "ReferenceLap":
+        distances = np.concatenate([[0.0], distances, [length]])
+        elapsed_times = np.concatenate([[0.0], elapsed_times, [lap_time]])
+        # gps noise can make the distance go backwards a little, so only the first
+        # time each distance is reached counts
+        reached = np.maximum.accumulate(distances)
+        first = np.concatenate([[True], distances[1:] > reached[:-1]])
+        distances, elapsed_times = distances[first], elapsed_times[first]
+        grid = np.append(np.arange(0.0, length, spacing), length)
+        return ReferenceLap(np.interp(grid, distances, elapsed_times).astype(np.float32), length, spacing)
+
+    # the same lap, slowed down or sped up to take the given time
+    def scaled_to(self, lap_time: float) -> "ReferenceLap":
+        return ReferenceLap((self.times * (lap_time / self.lap_time)).astype(np.float32), self.length, self.spacing)
+
+    def time_at(self, distance: float) -> float:
+        position = min(max(distance, 0.0), self.length) / self.spacing
+        index = min(int(position), len(self.times) - 2)
+        fraction = position - index
+        return float(self.times[index] + (self.times[index + 1] - self.times[index]) * fraction)
+
+
+class LiveDelta(EventHandler):
+    # Works out how far ahead or behind the car is on every gps fix, by
+    # comparing the time into the lap with the time the reference lap took to
+    # reach the same distance. The reference is the best lap, or if the pits
+    # have set a target time, the best lap scaled to take the target time.
+    #
+    # Each lap's distances and times are recorded as it is driven, and the
+    # lap becomes the reference if it turns out to be the best.
+
+    def __init__(self):
+        self.distances: [float] = []
+        self.elapsed_times: [float] = []
+        self.length: Optional[float] = None
+        self.best: Optional[ReferenceLap] = None
+        self.target_time = 0
+        self.reference: Optional[ReferenceLap] = None
+        self.delta: Optional[float] = None
+        SetTargetTimeEvent.register_handler(self)
+        ReverseTrackEvent.register_handler(self)
+
+    def handle_event(self, event, **kwargs):
+        if event == SetTargetTimeEvent:
+            self.target_time = kwargs.get("target") or 0
+            self._choose_reference()
+        if event == ReverseTrackEvent:
+            self.reset_best()
+            self.distances = []
+            self.elapsed_times = []
+
+    # called on every fix with the distance along the centreline and the time into the lap
+    def update(self, distance: float, elapsed: float, length: float) -> Optional[float]:
+        self.length = length
+        self.distances.append(distance)
+        self.elapsed_times.append(elapsed)
+        if self.reference:
+            self.delta = elapsed - self.reference.time_at(distance)
+        return self.delta
+
+    # a lap has finished. If it was the best lap it becomes the new reference
+    def complete_lap(self, lap_time: float, best: bool):
+        if best and self.length and self.distances and lap_time > 0:
+            if max(self.distances) >= self.length * MIN_LAP_COVERAGE:
+                self.best = ReferenceLap.from_trace(self.distances, self.elapsed_times, self.length, lap_time)
+                self._choose_reference()
+            else:
+                logger.info("best lap was not tracked all the way round, keeping previous reference")
+        self.start_lap()
+
+    def start_lap(self):
+        self.distances = []
+        self.elapsed_times = []
+        self.delta = None
+
+    # carry on with a best lap from before a restart
+    def restore_best(self, best: ReferenceLap):
+        self.best = best
+        self._choose_reference()
+
+    def reset_best(self):
+        self.best = None
+        self._choose_reference()
+
+    def get_delta(self) -> Optional[float]:
+        return self.delta
+
+    def _choose_reference(self):
+        self.delta = None
+        if self.best and self.target_time:
+            self.reference = self.best.scaled_to(self.target_time)
+        else:
+            self.reference = self.best
@@ -1,6 +1,11 @@
 
+import atexit
+import queue
+import sys
+import threading
 import time
 import os
+import signal
 from threading import Thread
 
 from grpc._channel import _InactiveRpcError
@@ -17,14 +22,16 @@ from lemon_pi.car.lap_tracker import LapTracker
 from lemon_pi.car.radio_interface import RadioInterface
 from lemon_pi.car.update_tracks import TrackUpdater
 from lemon_pi.car.wifi import WifiManager
+from lemon_pi.shared.clock import Clock, MonotonicClock
 from lemon_pi.shared.time_provider import LocalTimeProvider
 from lemon_pi.car.track import TrackLocation, read_tracks
 from lemon_pi.car.state_machine import StateMachine
-from lemon_pi.car.movement_listener import MovementListener
+from lemon_pi.shared.events import EventDispatcher, EventStats
+from lemon_pi.shared.trace import Trace
 from lemon_pi.shared.usb_detector import UsbDetector
 from haversine import haversine
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from datetime import datetime
 from python_settings import settings
 
@@ -59,11 +66,18 @@ handler.setFormatter(
         fmt='%(asctime)s.%(msecs)03d %(name)s %(levelname)s %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S'))
 handler.setLevel(logging.INFO)
-logging.getLogger().addHandler(handler)
+# the log is written on a thread of its own, so the thread logging doesn't wait on the SD card
+log_listener = QueueListener(queue.SimpleQueue(), handler, respect_handler_level=True)
+logging.getLogger().addHandler(QueueHandler(log_listener.queue))
 logging.getLogger().setLevel(logging.INFO)
+log_listener.start()
+atexit.register(log_listener.stop)
 
 logger.info("Lemon-Pi : starting up")
 
+# installed before anything asks for the clock, so the whole car keeps the same time
+Clock.set_instance(MonotonicClock())
+
 if "SETTINGS_MODULE" not in os.environ:
     os.environ["SETTINGS_MODULE"] = "lemon_pi.config.local_settings_car"
 
@@ -86,6 +100,31 @@ def retry_configuring_meringue(meringue_comms):
     WifiConnectedEvent.emit()
 
 
+def dump_trace():
+    try:
+        Trace.dump("logs/trace-{}.bin".format(datetime.now().strftime('%Y-%m-%d-%H%M%S')))
+    except Exception:
+        logger.exception("failed to write the trace")
+
+
+# write out the trace when anything crashes, before it's reported as usual
+def dump_trace_on_crash(hook):
+    def crashed(*args):
+        dump_trace()
+        hook(*args)
+    return crashed
+
+
+sys.excepthook = dump_trace_on_crash(sys.excepthook)
+threading.excepthook = dump_trace_on_crash(threading.excepthook)
+
+
+def log_event_stats(interval):
+    while True:
+        time.sleep(interval)
+        logger.info(EventStats.summary(reset=True))
+
+
 def configure_meringue(meringue_comms):
     try:
         if hasattr(settings, "MERINGUE_GRPC_OVERRIDE_URL"):
@@ -98,11 +137,17 @@ def configure_meringue(meringue_comms):
         logger.exception("exception configuring meringue")
 
 
+Trace.init(settings.TRACE_RECORDS)
 gui = Gui(settings.DISPLAY_WIDTH, settings.DISPLAY_HEIGHT)
 
 
 def init():
     try:
+        # run the slow event handlers off the gps thread
+        EventDispatcher.start()
+        if settings.EVENT_STATS_INTERVAL_SECS:
+            Thread(target=log_event_stats, args=[settings.EVENT_STATS_INTERVAL_SECS], daemon=True).start()
+
         # detect USB devices (should just be Lora)
         UsbDetector.init()
 
@@ -123,7 +168,6 @@ def init():
         if not settings.AUDIO_DISABLED:
             Audio().start()
         StateMachine.init()
-        MovementListener()
 
         obd = ObdReader()
         gps = GpsReader()
@@ -169,6 +213,8 @@ def init():
         # data from this track
         LapSessionStore.init(closest_track)
         lap_tracker = LapTracker(closest_track)
+        # merge the sessions saved for each layout, in the background
+        LapSessionStore.get_instance().consolidate()
 
         # DRS support allows Lemon-Pi to talk to an arduino
         # with 'up' and 'down' commands which can control
@@ -180,7 +226,7 @@ def init():
         drs_controller = DrsController()
         gui.register_drs_provider(drs_controller)
         if drs_zones:
-            lap_tracker.add_position_handler(DrsPositionTracker(drs_zones))
+            lap_tracker.add_position_handler(DrsPositionTracker(drs_zones, closest_track.projection))
             drs_controller.start()
 
         gps.register_position_listener(lap_tracker)
@@ -197,8 +243,14 @@ def init():
 
     except Exception:
         logger.exception("exception in initialization")
+        dump_trace()
         ExitApplicationEvent.emit()
 
+# kill -USR1 writes out how the events and their handlers are doing
+signal.signal(signal.SIGUSR1, lambda signum, frame: logger.warning(EventStats.summary()))
+# and kill -USR2 writes out the trace of what has been happening recently
+signal.signal(signal.SIGUSR2, lambda signum, frame: dump_trace())
+
 Thread(target=init, daemon=True).start()
 
 gui.display()
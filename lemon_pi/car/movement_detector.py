@@ -0,0 +1,97 @@
+import logging
+import math
+from typing import Optional
+
+from lemon_pi.car.event_defs import MovingEvent, NotMovingEvent, CarStoppedEvent, Movement
+from lemon_pi.car.projection import LocalProjection, FEET_PER_METRE
+
+logger = logging.getLogger(__name__)
+
+# a car that's still starts moving once it has been over this speed for MOVING_SECS
+MOVING_MPH = 5
+MOVING_SECS = 2
+
+# a car that's moving has stopped once it has been under this speed, and stayed within
+# DRIFT_FEET, for NOT_MOVING_SECS
+STOPPED_MPH = 3
+NOT_MOVING_SECS = 3
+
+# the gps wanders a few feet while the car is still, further than this and it has moved
+DRIFT_FEET = 20
+
+# still for this long and the car has come to a halt
+STOPPED_SECS = 10
+
+
+class StillBox:
+    # the box around the fixes since the car was last seen to move
+
+    def __init__(self, lat: float, long: float, since: float):
+        self.projection = LocalProjection(lat, long)
+        self.since = since
+        self.min_x = self.max_x = self.min_y = self.max_y = 0.0
+
+    # add a fix to the box, returning False if that makes the box too big for the car to have been still
+    def add(self, lat: float, long: float) -> bool:
+        x, y = self.projection.to_xy(lat, long)
+        self.min_x, self.max_x = min(self.min_x, x), max(self.max_x, x)
+        self.min_y, self.max_y = min(self.min_y, y), max(self.max_y, y)
+        return math.hypot(self.max_x - self.min_x, self.max_y - self.min_y) * FEET_PER_METRE <= DRIFT_FEET
+
+
+class MovementDetector:
+    # Works out from each gps fix whether the car is moving, and emits
+    # MovingEvent and NotMovingEvent when that changes, and CarStoppedEvent
+    # once the car has been still for a while.
+    #
+    # The speed thresholds differ for starting and stopping, and each has to
+    # hold for a few seconds, so a car crawling down the pit lane, or a single
+    # fix with a wild speed, doesn't flip between the two. The speed isn't
+    # trusted on its own for stopping either: while the car is slow a box is
+    # kept around where it has been, and the car has only stopped once it
+    # has stayed inside the box. Drifting out of the box starts a new one.
+    #
+    # The car is taken to be still when we start, as the state machine takes
+    # it to be parked in the pit.
+
+    def __init__(self):
+        self.moving = False
+        self.car_stopped = False
+        # when a still car went over MOVING_MPH
+        self.fast_since: Optional[float] = None
+        self.box: Optional[StillBox] = None
+
+    def update(self, lat: float, long: float, speed: int, tstamp: float):
+        if self.moving:
+            if speed >= STOPPED_MPH:
+                self.box = None
+                return
+            if self.box is None or not self.box.add(lat, long):
+                self.box = StillBox(lat, long, tstamp)
+            elif tstamp - self.box.since >= NOT_MOVING_SECS:
+                self.moving = False
+                NotMovingEvent.emit(Movement(speed, (lat, long)))
+            return
+
+        if speed >= MOVING_MPH:
+            if self.fast_since is None:
+                self.fast_since = tstamp
+            if tstamp - self.fast_since >= MOVING_SECS:
+                self._start_moving(lat, long, speed)
+                return
+        else:
+            self.fast_since = None
+        if self.box is None or not self.box.add(lat, long):
+            # shuffling round the paddock, still for now but not at a halt yet
+            self.box = StillBox(lat, long, tstamp)
+        elif not self.car_stopped and speed < STOPPED_MPH and tstamp - self.box.since >= STOPPED_SECS:
+            # a fix that's pulling away again doesn't say the car is at a halt, however long it sat still before
+            self.car_stopped = True
+            CarStoppedEvent.emit()
+
+    def _start_moving(self, lat: float, long: float, speed: int):
+        self.moving = True
+        self.car_stopped = False
+        self.fast_since = None
+        self.box = None
+        MovingEvent.emit(Movement(speed, (lat, long)))
@@ -0,0 +1,104 @@
+import logging
+from typing import Optional
+
+import numpy as np
+
+from lemon_pi.car.gate import Gates, GateVerifier
+from lemon_pi.car.gate_verifier_set import GateVerifierSet
+
+logger = logging.getLogger(__name__)
+
+# the out-lap has to pass this many of a session's gates in a row, up to the finish, for it to match
+MIN_OUT_LAP_GATES = 10
+
+# the car has joined a session's lap when it's this close to it
+JOIN_METRES = 15.0
+
+# and heading within this many degrees of the gate it's heading for
+JOIN_HEADING_DEGREES = 45
+
+
+class OutLapMatcher:
+    # Matches the out-lap against the sessions saved at the track, so that
+    # when the car gets to the start/finish line the gates of a previous
+    # session can be used straight away, rather than laying breadcrumbs for a
+    # lap first.
+    #
+    # The car joins the lap somewhere along the way, so for each session we
+    # first look for where it joins: the nearest point on the session's lap,
+    # drawn from the start/finish through its gates and back, heading the same
+    # way as the gate ahead. All of the sessions' laps are stacked together, so
+    # a fix is located on every one of them in one pass. From there each
+    # session is checked gate by gate in a GateVerifierSet. If a gate is
+    # missed, say the car was still in the pit lane, the session waits to be
+    # joined again.
+    #
+    # A session matches if the car passed its gates, without missing one, from
+    # where it last joined to the finish, and there were enough of them.
+
+    def __init__(self, sessions: [Gates], start_finish_xy):
+        self.sessions = [gates for gates in sessions if len(gates) >= MIN_OUT_LAP_GATES]
+        self.verifiers = [GateVerifier(gates) for gates in self.sessions]
+        for verifier in self.verifiers:
+            # nothing is looked for until the car has joined the lap
+            verifier.index = len(verifier.gates)
+        self.verifier_set = GateVerifierSet(self.verifiers)
+        self.joined = np.zeros(len(self.sessions), dtype=bool)
+        self.last_xy = None
+
+        # segment k of a session's lap runs up to its gate k, the last one on to the finish
+        starts, ends, headings, self.offsets = [], [], [], []
+        for gates in self.sessions:
+            self.offsets.append(len(starts))
+            points = [start_finish_xy] + [gate.target.mid_xy for gate in gates] + [start_finish_xy]
+            starts.extend(points[:-1])
+            ends.extend(points[1:])
+            # there's no gate to join at on the way to the finish
+            headings.extend([gate.heading for gate in gates] + [np.nan])
+        self.offsets.append(len(starts))
+        starts = np.array(starts, dtype=float).reshape(-1, 2)
+        ends = np.array(ends, dtype=float).reshape(-1, 2)
+        self.xs, self.ys = starts[:, 0], starts[:, 1]
+        self.dxs, self.dys = ends[:, 0] - self.xs, ends[:, 1] - self.ys
+        self.length_sq = self.dxs ** 2 + self.dys ** 2
+        self.headings = np.array(headings, dtype=float)
+
+    # called with each fix of the out-lap, on the gates' projection
+    def update(self, xy, heading: float):
+        if not self.sessions:
+            return
+        if self.last_xy is not None:
+            self.verifier_set.verify(self.last_xy, xy, heading)
+        self.last_xy = xy
+        verifier_set = self.verifier_set
+        waiting = ~verifier_set.active & (~self.joined | (verifier_set.index < verifier_set.gate_counts))
+        if waiting.any():
+            self._join(np.flatnonzero(waiting), xy, heading)
+
+    # the session the out-lap matched, the one that matched the most gates if there's more than one
+    def match(self) -> Optional[Gates]:
+        verifier_set = self.verifier_set
+        matched = np.flatnonzero(self.joined & (verifier_set.index == verifier_set.gate_counts) &
+                                 (verifier_set.matched >= MIN_OUT_LAP_GATES))
+        if len(matched) == 0:
+            return None
+        best = max(matched, key=lambda row: (verifier_set.matched[row], self.sessions[row].timestamp))
+        logger.info(f"out-lap matched {verifier_set.matched[best]} gates of a previous session")
+        return self.sessions[best]
+
+    def _join(self, rows: np.ndarray, xy, heading: float):
+        x, y = xy
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = ((x - self.xs) * self.dxs + (y - self.ys) * self.dys) / self.length_sq
+        t = np.clip(np.nan_to_num(t), 0.0, 1.0)
+        dist_sq = (self.xs + t * self.dxs - x) ** 2 + (self.ys + t * self.dys - y) ** 2
+        difference = np.abs(heading - self.headings) % 360
+        # the segment to the finish has no heading, so never passes
+        close = (dist_sq <= JOIN_METRES ** 2) & (np.minimum(difference, 360 - difference) <= JOIN_HEADING_DEGREES)
+        dist_sq = np.where(close, dist_sq, np.inf)
+        for row in rows.tolist():
+            start, end = self.offsets[row], self.offsets[row + 1]
+            segment = int(np.argmin(dist_sq[start:end]))
+            if np.isfinite(dist_sq[start + segment]):
+                self.joined[row] = True
+                self.verifier_set.restart(row, segment)
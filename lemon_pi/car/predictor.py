@@ -1,15 +1,23 @@
 import logging
 from typing import Optional
 
+import numpy as np
 from python_settings import settings
 from enum import Enum
 
+from lemon_pi.car.centreline import Centreline, CentrelineTracker
+from lemon_pi.car.crossing_detector import CrossingDetector
 from lemon_pi.car.event_defs import DriverMessageEvent, LeaveTrackEvent, ReverseTrackEvent
 from lemon_pi.car.gate import Gate, Gates, GateVerifier
-from lemon_pi.car.gps_geometry import crossed_line
+from lemon_pi.car.gate_placement import place_gates, gate_budget
+from lemon_pi.car.gate_verifier_set import GateVerifierSet
+from lemon_pi.car.lap_analysis import LapAnalysis, LapLosses
+from lemon_pi.car.gps_geometry import crossed_line, distance_to_target_feet
 from lemon_pi.car.lap_session_store import LapSessionStore
+from lemon_pi.car.out_lap_matcher import OutLapMatcher, MIN_OUT_LAP_GATES
+from lemon_pi.car.session_journal import SessionJournal, GATE, MISSED, FINISH
 from lemon_pi.car.target import Target
-from haversine import haversine, Unit
+from lemon_pi.car.track import TrackLocation, START_FINISH
 
 from lemon_pi.shared.data_provider_interface import GpsPos
 from lemon_pi.shared.events import EventHandler
@@ -19,6 +27,10 @@ logger = logging.getLogger(__name__)
 ONE_DAY_IN_SECONDS = 24 * 3600
 TWO_DAYS_IN_SECONDS = ONE_DAY_IN_SECONDS * 2
 
+# the out-lap is matched against the most recent of the sessions that pass this close to where the car starts
+OUT_LAP_NEAR_METRES = 1000
+OUT_LAP_SESSIONS = 8
+
 
 class PredictorState(Enum):
     # we are awaiting crossing the start finish line
@@ -33,8 +45,18 @@ class LapTimePredictor(EventHandler):
 
     last_gps: Optional[GpsPos]
 
-    def __init__(self, start_finish: Target):
+    def __init__(self, start_finish: Target, crossing_detector: CrossingDetector = None):
         self.start_finish = start_finish
+        # normally the lap tracker shares its crossing detector and feeds it each
+        # fix before we see it. On our own we need a detector for the start/finish
+        self.owns_crossing_detector = crossing_detector is None
+        if crossing_detector is None:
+            track = TrackLocation(start_finish.name, start_finish.name)
+            track.set_start_finish_target(start_finish)
+            crossing_detector = CrossingDetector(track)
+        self.crossing_detector = crossing_detector
+        # the virtual gates share the start/finish projection
+        self.projection = start_finish.get_projection()
         self.gates: Gates = Gates(start_finish)
 
         self.state = PredictorState.INIT
@@ -46,13 +68,45 @@ class LapTimePredictor(EventHandler):
 
         self.gate_index = -1
 
+        # the optimal lap from the gates, and where the last lap lost time against it
+        self.lap_analysis = LapAnalysis()
+        self.lap_losses: Optional[LapLosses] = None
+
+        # set when we've been restored from a checkpoint part way round a lap, so the
+        # first lap isn't timed
+        self.resuming = False
+        # a journal of the gate times, so they can be restored if the pi restarts
+        self.journal: Optional[SessionJournal] = None
+
+        # the positions seen on the breadcrumb lap, which become the centreline that
+        # tells us how far into the lap the car is
+        self.breadcrumb_trace = []
+        self.breadcrumb_headings = []
+        self.breadcrumb_times = []
+        # where the breadcrumb lap started, which previous sessions are matched from
+        self.breadcrumb_start = None
+        self.centreline: Optional[Centreline] = None
+        self.centreline_tracker: Optional[CentrelineTracker] = None
+        # the station of each gate on the centreline
+        self.gate_stations: [float] = []
+
         LeaveTrackEvent.register_handler(self)
         ReverseTrackEvent.register_handler(self)
 
-        # load a set of gate verifiers for our previous sessions at this track
-        self.gate_verifiers = []
-        if LapSessionStore.get_instance():
-            self.gate_verifiers = [GateVerifier(f) for f in LapSessionStore.get_instance().load_sessions()]
+        # the previous session at this track that matched the breadcrumb lap. The sessions that look
+        # like the layout being driven are read and matched on the store's writer thread at the end
+        # of the breadcrumb lap, and the gates are switched over before the next one is crossed
+        self.matched_gates: Optional[Gates] = None
+
+        # matches the out-lap against our previous sessions, so a matching one can be used from the
+        # first time we cross the start/finish. The sessions are read on the store's writer thread
+        # after the first fix, and the matcher is handed over when they're ready
+        self.out_lap: Optional[OutLapMatcher] = None
+        self.out_lap_requested = False
+        self.out_lap_ready: Optional[OutLapMatcher] = None
+        # bumped whenever work handed to the writer thread is no longer wanted, so what it
+        # comes back with is thrown away
+        self.generation = 0
 
     def handle_event(self, event, **kwargs):
         if event == LeaveTrackEvent:
@@ -62,6 +116,12 @@ class LapTimePredictor(EventHandler):
             self.state = PredictorState.INIT
             self.gates: Gates = Gates(self.start_finish)
             self.gate_index = -1
+            self.breadcrumb_trace = []
+            self.breadcrumb_headings = []
+            self.breadcrumb_times = []
+            self._set_centreline(None)
+            self._forget_out_lap()
+            self.matched_gates = None
             return
 
     def update_position(self, lat, long, heading, time):
@@ -72,46 +132,78 @@ class LapTimePredictor(EventHandler):
         this_gps = GpsPos(lat, long, heading, 0, time)
 
         try:
-            crossed, crossed_time, backwards = \
-                crossed_line(self.last_gps, this_gps, self.start_finish)
-            if crossed:
+            if self.owns_crossing_detector:
+                self.crossing_detector.update(this_gps)
+            crossing = self.crossing_detector.get_crossing(START_FINISH)
+            if crossing:
+                crossed_time = crossing.cross_time
+                reached = self.gate_index
                 self.gate_index = 0
+                self.lap_losses = None
+                if self.centreline_tracker:
+                    self.centreline_tracker.start_lap()
                 last_lap_time = crossed_time - self.lap_start_time
                 self.lap_start_time = crossed_time
                 if self.state == PredictorState.INIT:
-                    self.state = PredictorState.BREADCRUMB
-                    DriverMessageEvent.emit(text="learning track...", duration_secs=60)
+                    matched = self.out_lap.match() if self.out_lap else None
+                    self._forget_out_lap()
+                    if matched:
+                        self._use_matched_gates(matched)
+                    else:
+                        self.state = PredictorState.BREADCRUMB
+                        self.breadcrumb_start = (this_gps.xy(self.projection), heading)
+                        DriverMessageEvent.emit(text="learning track...", duration_secs=60)
                 elif self.state == PredictorState.BREADCRUMB:
+                    self._place_gates(crossed_time - last_lap_time, crossed_time)
                     self._update_gate_time_to_finish(last_lap_time)
-                    self._determine_gates(self.gates.get_distance_feet())
+                    self._verify_previous_sessions(self.gates.get_distance_feet())
+                    self._set_centreline(Centreline.from_breadcrumbs(
+                        self.start_finish.mid_xy, self.breadcrumb_trace))
+                    self.breadcrumb_trace = []
+                    self.breadcrumb_headings = []
+                    self.breadcrumb_times = []
                     self.state = PredictorState.WORKING
                 elif self.state == PredictorState.WORKING:
                     # if we load previous data and jump straight into working then the last_lap_time
                     # is from the epoch, so we ignore that
-                    if last_lap_time < ONE_DAY_IN_SECONDS:
-                        self._update_gate_time_to_finish(last_lap_time)
-                return crossed_line, crossed_time, backwards
+                    if self.resuming:
+                        self.resuming = False
+                    elif last_lap_time < ONE_DAY_IN_SECONDS:
+                        if self._update_gate_time_to_finish(last_lap_time):
+                            self.lap_losses = self.lap_analysis.lap_completed(self.gates, last_lap_time, reached)
+                return True, crossed_time, crossing.backwards
 
             # we're on an out lap
             if self.state == PredictorState.INIT:
+                xy = this_gps.xy(self.projection)
+                if not self.out_lap_requested:
+                    self._start_out_lap(xy)
+                if self.out_lap is None and self.out_lap_ready is not None:
+                    self.out_lap, self.out_lap_ready = self.out_lap_ready, None
+                if self.out_lap is not None:
+                    self.out_lap.update(xy, heading)
                 return False, 0, False
 
             # we're on our first full lap laying breadcrumbs to figure out
             # where gates should be placed
             if self.state == PredictorState.BREADCRUMB:
-                self._lay_breadcrumb(lat, long, heading)
-                # also, on this lap, try to match this lap against other sessions at
-                # this track, so we can load previous data
-                for verifier in self.gate_verifiers:
-                    verifier.verify(self.last_gps, this_gps)
+                # the trace is also matched against other sessions at this track at the
+                # end of the lap, so we can load previous data
+                self.breadcrumb_trace.append(this_gps.xy(self.projection))
+                self.breadcrumb_headings.append(heading)
+                self.breadcrumb_times.append(time)
 
             if self.state == PredictorState.WORKING:
+                if self.matched_gates is not None and self.gate_index == 0:
+                    self._use_previous_session()
+                if self.centreline_tracker:
+                    self.centreline_tracker.update(this_gps.xy(self.projection))
                 self._process_and_predict(this_gps)
 
             return False, 0, False
 
         finally:
-            self.last_gps = GpsPos(lat, long, heading, 0, time)
+            self.last_gps = this_gps
 
     # return the current predicted lap, or None if it cannot be predicted
     # The car needs to be 1/6th of the way around the track before the
@@ -124,22 +216,96 @@ class LapTimePredictor(EventHandler):
                 return self.current_predicted_time
         return None
 
-    def _lay_breadcrumb(self, lat, long, heading):
-        if abs(heading - self.last_gps.heading) > 20:
-            return
+    # carry on from a checkpoint and the journal records since it. Predictions start again on
+    # the first full lap
+    def restore(self, gates: Gates, centreline_points, records: [(int, tuple)]):
+        gates.set_projection(self.projection)
+        for record_type, values in records:
+            if record_type == GATE:
+                index, time_from_start = values
+                gates[index].missed = False
+                gates[index].record_time_from_start(time_from_start)
+            elif record_type == MISSED:
+                gates[values[0]].missed = True
+            elif record_type == FINISH:
+                gates.record_lap_time(values[0])
+        self.gates = gates
+        self._set_centreline(Centreline(centreline_points) if centreline_points else None)
+        self.state = PredictorState.WORKING
+        # wait for the start/finish line before looking for gates
+        self.gate_index = len(self.gates)
+        self.resuming = True
+
+    # how far into the lap the car is, in metres along the centreline, or None if we don't know yet
+    def get_lap_distance(self) -> Optional[float]:
+        if self.centreline_tracker:
+            return self.centreline_tracker.station
+        return None
 
-        if len(self.gates) == 0:
-            dist_from_sf = int(haversine(self.start_finish.midpoint, (lat, long), unit=Unit.FEET))
-            if dist_from_sf >= settings.VGATE_SEPARATION_FEET:
-                self.gates.append(Gate(lat, long, heading, "gate-0"))
-                logger.info(f"added first gate, dist to sf = {dist_from_sf}")
-        else:
-            last_gate = self.gates[len(self.gates) - 1]
-            dist_from_sf = int(haversine(self.start_finish.midpoint, (lat, long), unit=Unit.FEET))
-            dist_from_last_gate = int(haversine(last_gate.coords(), (lat, long), unit=Unit.FEET))
-            if dist_from_last_gate >= settings.VGATE_SEPARATION_FEET:
-                self.gates.append(Gate(lat, long, heading, f"gate-{len(self.gates)}", previous=last_gate))
-                logger.info(f"added gate {len(self.gates)} dist to sf = {dist_from_sf}")
+    def _set_centreline(self, centreline: Optional[Centreline]):
+        self.centreline = centreline
+        self.centreline_tracker = None
+        self.gate_stations = []
+        if centreline:
+            self.centreline_tracker = CentrelineTracker(centreline)
+            self.centreline_tracker.start_lap()
+            self._locate_gates()
+
+    def _locate_gates(self):
+        # gates are in order around the lap, so each one is searched for from the last
+        self.gate_stations = []
+        segment = 0
+        for gate in self.gates:
+            station, segment, _ = self.centreline.locate(gate.target.mid_xy, segment)
+            self.gate_stations.append(station)
+
+    # pick the sessions to match the out-lap against from the catalogue, and read them and set up
+    # the matcher on the store's writer thread. The out-lap is matched from the fix after it's ready
+    def _start_out_lap(self, xy):
+        self.out_lap_requested = True
+        store = LapSessionStore.get_instance()
+        if store is None:
+            return
+        generation = self.generation
+
+        def pick(info) -> bool:
+            return info.gate_count >= MIN_OUT_LAP_GATES and info.near(xy, self.projection, OUT_LAP_NEAR_METRES)
+
+        def done(sessions: [Gates]):
+            for gates in sessions:
+                gates.set_projection(self.projection)
+            matcher = OutLapMatcher(sessions, self.start_finish.mid_xy)
+            if generation == self.generation:
+                self.out_lap_ready = matcher
+
+        store.load_in_background(pick, done, limit=OUT_LAP_SESSIONS)
+
+    def _forget_out_lap(self):
+        self.generation += 1
+        self.out_lap = None
+        self.out_lap_ready = None
+        self.out_lap_requested = False
+
+    # the out-lap matched a previous session, so skip the breadcrumb lap and use its gates,
+    # with a centreline through them
+    def _use_matched_gates(self, gates: Gates):
+        self.gates = gates
+        self._set_centreline(Centreline.from_breadcrumbs(
+            self.start_finish.mid_xy, [gate.target.mid_xy for gate in gates]))
+        self.state = PredictorState.WORKING
+
+    # lay the gates down along the breadcrumb lap, closer together where it's slow and twisty
+    def _place_gates(self, start_time: float, finish_time: float):
+        start_finish_xy = self.start_finish.mid_xy
+        count = gate_budget(self.breadcrumb_trace, start_finish_xy, settings.VGATE_SEPARATION_FEET)
+        self.gates = Gates(self.start_finish)
+        previous = None
+        for x, y, heading in place_gates(start_finish_xy, self.breadcrumb_trace, self.breadcrumb_times,
+                                         start_time, finish_time, count):
+            lat, long = self.projection.to_lat_long(x, y)
+            previous = Gate(lat, long, heading, f"gate-{len(self.gates)}", previous=previous,
+                            projection=self.projection)
+            self.gates.append(previous)
 
     def _process_and_predict(self, this_gps: GpsPos):
         if self.gate_index < len(self.gates):
@@ -151,6 +317,8 @@ class LapTimePredictor(EventHandler):
                 self.gates[self.gate_index].missed = False
                 elapsed_time = cross_gate_time - self.lap_start_time
                 self.gates[self.gate_index].record_time_from_start(elapsed_time)
+                if self.journal:
+                    self.journal.gate_crossed(self.gate_index, elapsed_time)
                 # it's possible this throws an exception in the case this gate doesn't know
                 # how long it takes to get to the end of the lap (perhaps it was missed on
                 # all previous laps)
@@ -164,38 +332,86 @@ class LapTimePredictor(EventHandler):
                 self.gate_index += 1
             else:
                 # see if we're nearer the next gate, if we are then we missed a gate
-                this_pos = (this_gps.lat, this_gps.long)
-                if self.gate_index < len(self.gates) - 1:
-                    gate_dist = haversine(this_pos, self.gates[self.gate_index].target.midpoint, Unit.FEET)
-                    next_gate_dist = haversine(this_pos, self.gates[self.gate_index + 1].target.midpoint,
-                                               Unit.FEET)
-                    if gate_dist > next_gate_dist:
-                        logger.info(f"missed gate {self.gate_index}!!!")
-                        self.gates[self.gate_index].missed = True
-                        self.gate_index += 1
-
-    def _update_gate_time_to_finish(self, last_lap_time):
+                if self.gate_index < len(self.gates) - 1 and self._nearer_next_gate(this_gps):
+                    logger.info(f"missed gate {self.gate_index}!!!")
+                    self.gates[self.gate_index].missed = True
+                    if self.journal:
+                        self.journal.gate_missed(self.gate_index)
+                    self.gate_index += 1
+
+    # have we gone more than halfway from the gate we're waiting for to the one after it?
+    def _nearer_next_gate(self, this_gps: GpsPos) -> bool:
+        if self.gate_stations:
+            halfway = (self.gate_stations[self.gate_index] + self.gate_stations[self.gate_index + 1]) / 2
+            return self.centreline_tracker.station > halfway
+        gate_dist = distance_to_target_feet(this_gps, self.gates[self.gate_index].target)
+        next_gate_dist = distance_to_target_feet(this_gps, self.gates[self.gate_index + 1].target)
+        return gate_dist > next_gate_dist
+
+    # returns true if the lap was recorded
+    def _update_gate_time_to_finish(self, last_lap_time) -> bool:
         mins = int(last_lap_time / 60)
         secs = int(last_lap_time % 60)
         logger.debug(f"lap completed in {mins:02d}:{secs:02d} ... updating gates")
         if last_lap_time > len(self.gates) * 10 + 30:
             logger.warning("lap discarded as it's too slow")
+            return False
+        self.gates.record_lap_time(last_lap_time)
+        if self.journal:
+            self.journal.lap_finished(last_lap_time)
+        return True
+
+    # Read the previous sessions that are about as long as the breadcrumb lap and went the same
+    # way round, and match each against the breadcrumb trace. This happens on the store's writer
+    # thread, and the best match is left in matched_gates
+    def _verify_previous_sessions(self, target_distance):
+        store = LapSessionStore.get_instance()
+        if not store or self.breadcrumb_start is None:
             return
-        for g in self.gates:
-            g.record_lap_time(last_lap_time)
-
-    def _determine_gates(self, target_distance):
-        # after the breadcrumbing lap, see if we have a dataset already .. if we do,
-        # then switch to use that
-        matched = [g for g in self.gate_verifiers if g.is_match()]
-        if not matched:
-            return
-        close = [g for g in matched if (abs(target_distance - g.get_distance_feet()) * 100 / target_distance) < 5]
-        # sort by recent time
+        start_xy, start_heading = self.breadcrumb_start
+        trace = np.array([start_xy] + self.breadcrumb_trace)
+        headings = np.array([start_heading] + self.breadcrumb_headings, dtype=float)
+        generation = self.generation
+
+        def pick(info) -> bool:
+            return self._similar_distance(target_distance, info.distance_feet) and info.fits(trace, self.projection)
+
+        def done(sessions: [Gates]):
+            verifiers = []
+            for gates in sessions:
+                gates.set_projection(self.projection)
+                verifiers.append(GateVerifier(gates))
+            logger.info(f"matching breadcrumb lap against {len(verifiers)} previous sessions")
+            if verifiers:
+                GateVerifierSet(verifiers).verify_trace(trace, headings)
+            gates = self._choose_gates(verifiers, target_distance)
+            if gates is not None and generation == self.generation:
+                self.matched_gates = gates
+
+        store.load_in_background(pick, done)
+
+    # The 5% comes from pretending to breadcrumb 100 laps at sonoma and measuring the actual
+    # observed variance. It was never more than 3%
+    @staticmethod
+    def _similar_distance(target_distance, distance) -> bool:
+        return abs(target_distance - distance) * 100 / target_distance < 5
+
+    # after the breadcrumbing lap, see if we have a dataset already .. if we do,
+    # then that's what we use
+    @staticmethod
+    def _choose_gates(gate_verifiers: [GateVerifier], target_distance) -> Optional[Gates]:
+        matched = [g for g in gate_verifiers if g.is_match()]
+        close = [g for g in matched if LapTimePredictor._similar_distance(target_distance, g.get_distance_feet())]
+        # take the most recent of those that are less than 5% out
         close.sort(key=lambda a: a.get_timestamp(), reverse=True)
-        # take the best match if it's less than 5% error. The 5% comes from pretending to breadcrumb
-        # 100 laps at sonoma and measuring the actual observed variance. It was never more than 3%
-        if close:
-            self.gates = close[0].gates
-        # reclaim the memory
-        self.gate_verifiers = None
+        return close[0].gates if close else None
+
+    # switch to the previous session that matched the breadcrumb lap, before the first gate of a lap
+    def _use_previous_session(self):
+        self.gates, self.matched_gates = self.matched_gates, None
+        logger.info(f"using the {len(self.gates)} gates of a previous session")
+        if self.centreline:
+            self._locate_gates()
+        # the journal refers to the gates that were checkpointed, so it starts again with these
+        if self.journal and self.journal.is_active():
+            self.journal.reset()
@@ -0,0 +1,45 @@
+import math
+
+# mean radius of the earth, the same value the haversine package uses
+EARTH_RADIUS_METRES = 6371008.8
+
+FEET_PER_METRE = 3.28084
+
+
+class LocalProjection:
+    # A local tangent plane centred on a point at the track (normally the
+    # middle of the start/finish line). Positions are converted to x (metres
+    # east) and y (metres north) of that point. Over the few kilometres of a
+    # race track the error from treating the earth as flat is a few
+    # centimetres, far less than the gps error, and it means line crossing,
+    # distance and heading calculations can be done with plain float
+    # arithmetic rather than haversine and numpy on every gps fix.
+
+    def __init__(self, origin_lat: float, origin_long: float):
+        self.origin_lat = origin_lat
+        self.origin_long = origin_long
+        self.metres_per_deg_lat = math.radians(1) * EARTH_RADIUS_METRES
+        self.metres_per_deg_long = self.metres_per_deg_lat * math.cos(math.radians(origin_lat))
+
+    def to_xy(self, lat: float, long: float) -> (float, float):
+        return (long - self.origin_long) * self.metres_per_deg_long, \
+               (lat - self.origin_lat) * self.metres_per_deg_lat
+
+    def to_lat_long(self, x: float, y: float) -> (float, float):
+        return self.origin_lat + y / self.metres_per_deg_lat, \
+               self.origin_long + x / self.metres_per_deg_long
+
+
+def distance_feet(xy1, xy2) -> float:
+    return math.hypot(xy2[0] - xy1[0], xy2[1] - xy1[1]) * FEET_PER_METRE
+
+
+# the heading in degrees from north to go from one projected point to another
+def heading_between_xy(from_xy, to_xy) -> float:
+    return (math.degrees(math.atan2(to_xy[0] - from_xy[0], to_xy[1] - from_xy[1])) + 360) % 360
+
+
+# a point on the given heading, d metres away
+def point_on_heading_xy(xy, heading: float, d: float) -> (float, float):
+    radians = math.radians(heading)
+    return xy[0] + d * math.sin(radians), xy[1] + d * math.cos(radians)
@@ -15,7 +15,7 @@ from lemon_pi.car.event_defs import (
     RefuelEvent,
     ExitApplicationEvent, RacePositionEvent, SetTargetTimeEvent, RacePersuerEvent, ResetFastLapEvent, EnterTrackEvent
 )
-from lemon_pi.shared.events import EventHandler
+from lemon_pi.shared.events import EventHandler, Dispatch
 from lemon_pi.shared.meringue_comms import MeringueComms
 from lemon_pi_pb2 import (
     RaceStatus,
@@ -40,6 +40,9 @@ logger = logging.getLogger(__name__)
 
 class RadioInterface(EventHandler):
 
+    # building and queueing the messages isn't something the gps thread should wait for
+    dispatch = Dispatch.SERIAL
+
     def __init__(self,
                  comms_server: MeringueComms,
                  temp_provider:TemperatureProvider,
@@ -50,9 +53,9 @@ class RadioInterface(EventHandler):
         self.lap_provider = lap_provider
         self.gps_provider = None
         self.fuel_provider = fuel_provider
-        RadioSyncEvent.register_handler(self)
-        LeaveTrackEvent.register_handler(self)
-        EnterTrackEvent.register_handler(self)
+        RadioSyncEvent.register_handler(self, self.send_telemetry)
+        LeaveTrackEvent.register_handler(self, self.send_pitting)
+        EnterTrackEvent.register_handler(self, self.send_entering)
 
     def register_lap_provider(self, lap_provider):
         self.lap_provider = lap_provider
@@ -60,29 +63,25 @@ class RadioInterface(EventHandler):
     def register_gps_provider(self, gps):
         self.gps_provider = gps
 
-    def handle_event(self, event, **kwargs):
-        if event == RadioSyncEvent:
-            msg = ToPitMessage()
-            msg.telemetry.coolant_temp = self.temp_provider.get_temp_f()
-            msg.telemetry.last_lap_time = self.lap_provider.get_last_lap_time()
-            msg.telemetry.lap_count = self.lap_provider.get_lap_count()
-            msg.telemetry.fuel_remaining_percent = self.fuel_provider.get_fuel_percent_remaining()
-            self.comms_server.send_message_from_car(msg)
-            return
-
-        if event == LeaveTrackEvent:
-            msg = ToPitMessage()
-            # we have to set some field to let protobuf know the message type
-            msg.pitting.timestamp = 1
-            self.comms_server.send_message_from_car(msg)
-            return
-
-        if event == EnterTrackEvent:
-            msg = ToPitMessage()
-            # we have to set some field to let protobuf know the message type
-            msg.entering.timestamp = 1
-            self.comms_server.send_message_from_car(msg)
-            return
+    def send_telemetry(self, **kwargs):
+        msg = ToPitMessage()
+        msg.telemetry.coolant_temp = self.temp_provider.get_temp_f()
+        msg.telemetry.last_lap_time = self.lap_provider.get_last_lap_time()
+        msg.telemetry.lap_count = self.lap_provider.get_lap_count()
+        msg.telemetry.fuel_remaining_percent = self.fuel_provider.get_fuel_percent_remaining()
+        self.comms_server.send_message_from_car(msg)
+
+    def send_pitting(self, **kwargs):
+        msg = ToPitMessage()
+        # we have to set some field to let protobuf know the message type
+        msg.pitting.timestamp = 1
+        self.comms_server.send_message_from_car(msg)
+
+    def send_entering(self, **kwargs):
+        msg = ToPitMessage()
+        # we have to set some field to let protobuf know the message type
+        msg.entering.timestamp = 1
+        self.comms_server.send_message_from_car(msg)
 
     def process_incoming(self, msg):
         RadioReceiveEvent.emit()
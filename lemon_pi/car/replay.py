@@ -0,0 +1,326 @@
+# Replays recorded gps logs (the gps-*.csv files written by the gps-logger)
+# through the car's position pipeline without needing a car, a gps device
+# or a gui. This lets us debug lap timing, prediction and DRS repeatably,
+# either as fast as the cpu allows or at a multiple of real time.
+#
+# Time dependent logic (debouncing, lap timers, staleness checks) should see
+# the time of the recorded fix, not the wall clock, so replays install a
+# SimulatedClock as the shared clock and move it forward with each fix.
+#
+# the csv columns are those written by LapTracker when LOG_GPS is enabled
+#   time-of-day, timestamp, lap count, lat, long, speed (mph), heading
+import argparse
+import csv
+import logging
+import os
+import tempfile
+import time
+from typing import Optional
+
+from lemon_pi.car.display_providers import SpeedProvider, PositionProvider
+from lemon_pi.car.event_defs import (
+    CompleteLapEvent,
+    LeaveTrackEvent,
+    EnterTrackEvent,
+    RadioSyncEvent,
+    ReverseTrackEvent,
+    DRSApproachEvent
+)
+from lemon_pi.car.movement_detector import MovementDetector
+from lemon_pi.car.updaters import PositionUpdater
+from lemon_pi.shared.clock import SimulatedClock, Clock
+from lemon_pi.shared.data_provider_interface import GpsProvider, GpsPos
+from lemon_pi.shared.events import EventHandler
+
+logger = logging.getLogger(__name__)
+
+# csv columns
+TIME_OF_DAY = 0
+TIMESTAMP = 1
+LAP = 2
+LAT = 3
+LONG = 4
+SPEED = 5
+HEADING = 6
+
+
+class GpsReplay(SpeedProvider, PositionProvider, GpsProvider):
+    # a stand in for GpsReader that reads fixes from a recorded file rather
+    # than from gpsd. speed_multiple of 0 means run as fast as possible,
+    # 1 is real time, 10 is ten times faster than real time. If a clock is
+    # given it is set to the timestamp of each fix before the fix is processed
+
+    def __init__(self, filename, speed_multiple: float = 0.0, clock: Optional[SimulatedClock] = None):
+        self.filename = filename
+        self.speed_multiple = speed_multiple
+        self.clock = clock
+        self.fix_timestamp = 0
+        self.speed_mph = 999
+        self.heading = 0
+        self.lat = 0.0
+        self.long = 0.0
+        self.working = False
+        self.position_listener: Optional[PositionUpdater] = None
+        self.movement_detector = MovementDetector()
+        self.fix_count = 0
+
+    def read_fixes(self):
+        with open(self.filename) as csvfile:
+            for row in csv.reader(csvfile):
+                if len(row) <= HEADING or row[0].startswith('#'):
+                    continue
+                yield float(row[TIMESTAMP]), float(row[LAT]), float(row[LONG]), int(row[SPEED]), int(row[HEADING])
+
+    def first_fix(self) -> Optional[GpsPos]:
+        for tstamp, lat, long, speed, heading in self.read_fixes():
+            if (lat, long) != (0.0, 0.0):
+                return GpsPos(lat, long, heading, speed, tstamp)
+        return None
+
+    def run(self, max_fixes: int = 0) -> None:
+        replay_start = time.monotonic()
+        first_tstamp = None
+        for tstamp, lat, long, speed, heading in self.read_fixes():
+            if first_tstamp is None:
+                first_tstamp = tstamp
+            if self.speed_multiple > 0:
+                wait = (tstamp - first_tstamp) / self.speed_multiple - (time.monotonic() - replay_start)
+                if wait > 0:
+                    time.sleep(wait)
+            self.process_fix(tstamp, lat, long, speed, heading)
+            if max_fixes and self.fix_count >= max_fixes:
+                break
+
+    def process_fix(self, tstamp, lat, long, speed, heading):
+        # mirror what GpsReader does with a TPV report
+        if self.clock:
+            self.clock.set_time(tstamp)
+        self.fix_count += 1
+        self.speed_mph = speed
+        self.heading = heading
+        self.movement_detector.update(lat, long, speed, tstamp)
+        self.lat = lat
+        self.long = long
+        self.fix_timestamp = tstamp
+        if self.position_listener:
+            try:
+                self.position_listener.update_position(lat, long, heading, tstamp, speed)
+            except Exception:
+                logger.exception("issue with GPS listener.")
+        self.working = True
+
+    def get_speed(self) -> int:
+        return self.speed_mph
+
+    def get_heading(self) -> int:
+        return int(self.heading)
+
+    def get_lat_long(self) -> (float, float):
+        return self.lat, self.long
+
+    def get_gps_position(self) -> Optional[GpsPos]:
+        if not self.working:
+            return None
+        return GpsPos(self.lat, self.long, int(self.heading), self.speed_mph, self.fix_timestamp)
+
+    def is_working(self) -> bool:
+        return self.working
+
+    def register_position_listener(self, listener: PositionUpdater):
+        self.position_listener = listener
+
+
+class StageTimer:
+    # collects the time taken by one stage of the pipeline for every fix
+
+    def __init__(self, name):
+        self.name = name
+        self.samples: [float] = []
+
+    def record(self, elapsed: float):
+        self.samples.append(elapsed)
+
+    def summary(self) -> str:
+        if not self.samples:
+            return f"{self.name:<14} no samples"
+        ordered = sorted(self.samples)
+        count = len(ordered)
+        mean_us = sum(ordered) / count * 1e6
+        p50_us = ordered[count // 2] * 1e6
+        p99_us = ordered[min(count - 1, int(count * 0.99))] * 1e6
+        max_us = ordered[-1] * 1e6
+        return f"{self.name:<14} n={count:<7d} mean={mean_us:8.1f}us p50={p50_us:8.1f}us " \
+               f"p99={p99_us:8.1f}us max={max_us:8.1f}us"
+
+
+class TimedPositionUpdater(PositionUpdater):
+    # wraps a position updater so we can see how long it takes
+
+    def __init__(self, delegate: PositionUpdater, timer: StageTimer):
+        self.delegate = delegate
+        self.timer = timer
+
+    def update_position(self, lat: float, long: float, heading: float, tstamp: float, speed: int) -> None:
+        start = time.perf_counter()
+        try:
+            self.delegate.update_position(lat, long, heading, tstamp, speed)
+        finally:
+            self.timer.record(time.perf_counter() - start)
+
+
+class TimedPredictor:
+    # the LapTracker drives the predictor directly, so this sits between the two
+    # and times each call. Everything other than update_position is passed through
+
+    def __init__(self, delegate, timer: StageTimer):
+        self.delegate = delegate
+        self.timer = timer
+
+    def update_position(self, lat, long, heading, tstamp):
+        start = time.perf_counter()
+        try:
+            return self.delegate.update_position(lat, long, heading, tstamp)
+        finally:
+            self.timer.record(time.perf_counter() - start)
+
+    def __getattr__(self, item):
+        return getattr(self.delegate, item)
+
+
+class EventRecorder(EventHandler):
+    # remembers the lap and target events emitted while replaying
+
+    recorded_events = [CompleteLapEvent, LeaveTrackEvent, EnterTrackEvent, RadioSyncEvent,
+                       ReverseTrackEvent, DRSApproachEvent]
+
+    def __init__(self):
+        self.events = []
+        for e in EventRecorder.recorded_events:
+            e.register_handler(self)
+
+    def handle_event(self, event, **kwargs):
+        self.events.append((event.name, kwargs))
+
+    def count(self, event) -> int:
+        return len([e for e in self.events if e[0] == event.name])
+
+    def close(self):
+        for e in EventRecorder.recorded_events:
+            e.deregister_handler(EventRecorder)
+
+
+class ReplayResult:
+
+    def __init__(self, fixes: int, elapsed: float, stages: [StageTimer], events: [tuple]):
+        self.fixes = fixes
+        self.elapsed = elapsed
+        self.stages = stages
+        self.events = events
+
+    def fixes_per_second(self) -> float:
+        return self.fixes / self.elapsed if self.elapsed > 0 else 0.0
+
+    def lap_times(self) -> [float]:
+        return [kwargs["lap_time"] for name, kwargs in self.events if name == CompleteLapEvent.name]
+
+    def summary(self) -> str:
+        lines = [f"replayed {self.fixes} fixes in {self.elapsed:.2f}s ({self.fixes_per_second():.0f} fixes/sec)"]
+        lines.extend(s.summary() for s in self.stages)
+        for name, kwargs in self.events:
+            args = ", ".join(f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}"
+                             for k, v in kwargs.items() if k != "gate")
+            lines.append(f"  {name} {args}")
+        return "\n".join(lines)
+
+
+class ReplayPipeline:
+    # wires up the same position pipeline that main.py builds for the car,
+    # with each stage wrapped in a timer
+
+    def __init__(self, replay: GpsReplay, track, drs_gates=None):
+        # imported here to avoid pulling in the whole car pipeline when
+        # only GpsReplay is wanted
+        from lemon_pi.car.lap_tracker import LapTracker
+        from lemon_pi.car.drs_controller import DrsPositionTracker
+
+        self.replay = replay
+        self.total_timer = StageTimer("pipeline")
+        self.predictor_timer = StageTimer("predictor")
+        self.stages = [self.total_timer, self.predictor_timer]
+        self.recorder = EventRecorder()
+
+        self.lap_tracker = LapTracker(track)
+        self.lap_tracker.predictive_lap_timer = TimedPredictor(self.lap_tracker.predictive_lap_timer,
+                                                               self.predictor_timer)
+        if drs_gates:
+            drs_timer = StageTimer("drs")
+            self.stages.append(drs_timer)
+            drs_tracker = DrsPositionTracker(drs_gates, track.projection)
+            self.lap_tracker.add_position_handler(TimedPositionUpdater(drs_tracker, drs_timer))
+        replay.register_position_listener(TimedPositionUpdater(self.lap_tracker, self.total_timer))
+
+    def run(self, max_fixes: int = 0) -> ReplayResult:
+        start = time.perf_counter()
+        try:
+            self.replay.run(max_fixes)
+        finally:
+            self.recorder.close()
+        return ReplayResult(self.replay.fix_count, time.perf_counter() - start,
+                            self.stages, self.recorder.events)
+
+
+def find_closest_track(tracks, replay: GpsReplay):
+    from haversine import haversine
+    first = replay.first_fix()
+    if first is None:
+        raise Exception(f"no usable gps fixes in {replay.filename}")
+    return min(tracks, key=lambda x: haversine((first.lat, first.long), x.get_start_finish_target().midpoint))
+
+
+if __name__ == "__main__":
+
+    if "SETTINGS_MODULE" not in os.environ:
+        os.environ["SETTINGS_MODULE"] = "lemon_pi.config.local_settings_car"
+
+    arg_parser = argparse.ArgumentParser(description="replay recorded gps logs through the lap timing pipeline")
+    arg_parser.add_argument("file", help="a gps-*.csv file, e.g. resources/test/gps-2023-05-27.csv")
+    arg_parser.add_argument("--speed", type=float, default=0.0,
+                            help="multiple of real time to replay at, 0 (the default) is as fast as possible")
+    arg_parser.add_argument("--track", help="track code, defaults to the track closest to the first fix")
+    arg_parser.add_argument("--max-fixes", type=int, default=0, help="stop after this many fixes")
+    arg_parser.add_argument("--track-data", help="directory holding previous session data, "
+                                                 "defaults to an empty temporary directory")
+    arg_parser.add_argument("--no-drs", action="store_true", help="do not replay through the DRS tracker")
+    arg_parser.add_argument("--verbose", action="store_true", help="log at info level")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s.%(msecs)03d %(name)s %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S',
+                        level=logging.INFO if args.verbose else logging.WARN)
+
+    from lemon_pi.car.drs_controller import DrsDataLoader
+    from lemon_pi.car.lap_session_store import LapSessionStore
+    from lemon_pi.car.track import read_tracks
+    from lemon_pi.car.update_tracks import TrackUpdater
+
+    replay_clock = SimulatedClock()
+    Clock.set_instance(replay_clock)
+    gps_replay = GpsReplay(args.file, args.speed, replay_clock)
+    all_tracks = read_tracks()
+    if args.track:
+        replay_track = next(filter(lambda t: t.code == args.track, all_tracks))
+    else:
+        replay_track = find_closest_track(all_tracks, gps_replay)
+    print(f"replaying {args.file} at {replay_track}")
+
+    LapSessionStore.init(replay_track, dir=args.track_data or tempfile.mkdtemp(prefix="lemon-pi-replay-"))
+
+    drs_zones = None
+    if not args.no_drs:
+        drs_loader = DrsDataLoader()
+        drs_file, _ = TrackUpdater.get_drs_file()
+        drs_loader.read_file(drs_file)
+        drs_zones = drs_loader.get_drs_activation_zones(replay_track.code)
+
+    result = ReplayPipeline(gps_replay, replay_track, drs_zones).run(args.max_fixes)
+    print(result.summary())
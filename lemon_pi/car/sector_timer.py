@@ -0,0 +1,165 @@
+import logging
+import math
+from collections import deque
+from typing import Optional
+
+from lemon_pi.car.crossing_detector import CrossingDetector, CrossingListener, Crossing
+from lemon_pi.car.event_defs import SectorCompleteEvent, LeaveTrackEvent, ReverseTrackEvent, ResetFastLapEvent
+from lemon_pi.car.track import TrackLocation, Sector, START_FINISH
+from lemon_pi.shared.events import EventHandler
+
+logger = logging.getLogger(__name__)
+
+# how many of the most recent times for a sector its consistency is worked out from
+CONSISTENCY_LAPS = 5
+
+# crossing the start/finish again this soon after starting a lap is the same crossing, as in LapTracker
+MIN_LAP_SECONDS = 10
+
+
+class SectorStats:
+    # The best and most recent times for one sector, and how much the last
+    # few of them have varied. The spread is kept as a running sum and sum of
+    # squares over a fixed window, so adding a time costs the same however
+    # many laps have been driven.
+
+    def __init__(self, sector: Sector):
+        self.sector = sector
+        self.best: Optional[float] = None
+        self.last: Optional[float] = None
+        self.recent = deque(maxlen=CONSISTENCY_LAPS)
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    # returns true if this is the best time for the sector
+    def add(self, t: float) -> bool:
+        if len(self.recent) == self.recent.maxlen:
+            oldest = self.recent[0]
+            self.total -= oldest
+            self.total_sq -= oldest * oldest
+        self.recent.append(t)
+        self.total += t
+        self.total_sq += t * t
+        self.last = t
+        is_best = self.best is None or t < self.best
+        if is_best:
+            self.best = t
+        return is_best
+
+    def reset_best(self):
+        self.best = None
+
+    def reset(self):
+        self.best = None
+        self.last = None
+        self.recent.clear()
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    # the standard deviation of the recent times, or None until there are two of them
+    def consistency(self) -> Optional[float]:
+        n = len(self.recent)
+        if n < 2:
+            return None
+        mean = self.total / n
+        return math.sqrt(max(self.total_sq / n - mean * mean, 0.0) * n / (n - 1))
+
+
+class SectorTimer(CrossingListener, EventHandler):
+    # Times the sectors of the track. Each sector ends at its gate, or at the
+    # start/finish line for the last sector, which has no gate of its own.
+    #
+    # The crossing detector already works out when the car crossed each line,
+    # interpolated between fixes, so this only does anything when a line is
+    # crossed. Gates have to be crossed in order: if one is missed, or the
+    # car goes round the wrong way, the rest of the lap isn't timed and timing
+    # starts again at the start/finish line.
+    #
+    # Each sector completed is announced with a SectorCompleteEvent, along
+    # with how consistent the last few times for it have been.
+
+    def __init__(self, track: TrackLocation, crossing_detector: CrossingDetector):
+        self.track = track
+        self.sectors = [SectorStats(sector) for sector in track.sectors]
+        self.gates = {sector.target_meta_data: i for i, sector in enumerate(track.sectors)
+                      if sector.target_meta_data is not None}
+        # when the lap and the sector in progress started, None when we're waiting for the start/finish
+        self.lap_start: Optional[float] = None
+        self.sector_start: Optional[float] = None
+        self.next_sector = 0
+        self.splits: [float] = []
+        # the sector times of the last lap where every sector was timed
+        self.last_lap_splits: Optional[list] = None
+        if self.sectors:
+            crossing_detector.subscribe(self)
+        LeaveTrackEvent.register_handler(self)
+        ReverseTrackEvent.register_handler(self)
+        ResetFastLapEvent.register_handler(self)
+
+    def on_crossing(self, crossing: Crossing):
+        if crossing.backwards:
+            # the lap tracker reverses the track, until then nothing is timed
+            self._stop()
+            return
+        if crossing.key == START_FINISH:
+            self._start_finish(crossing.cross_time)
+            return
+        index = self.gates.get(crossing.key)
+        if index is None or self.sector_start is None or index < self.next_sector:
+            return
+        if index > self.next_sector:
+            logger.info(f"missed the gate at the end of {self.sectors[self.next_sector].sector.name}")
+            self._stop()
+            return
+        self._complete_sector(crossing.cross_time)
+
+    def handle_event(self, event, **kwargs):
+        if event == LeaveTrackEvent:
+            self._stop()
+        if event == ReverseTrackEvent:
+            # the sectors are different the other way round
+            self._stop()
+            for stats in self.sectors:
+                stats.reset()
+        if event == ResetFastLapEvent:
+            for stats in self.sectors:
+                stats.reset_best()
+
+    # the sum of the best time in each sector, or None until every sector has been timed
+    def get_theoretical_best_lap_time(self) -> Optional[float]:
+        if not self.sectors or any(stats.best is None for stats in self.sectors):
+            return None
+        return sum(stats.best for stats in self.sectors)
+
+    def _start_finish(self, cross_time: float):
+        if self.lap_start is not None and cross_time - self.lap_start < MIN_LAP_SECONDS:
+            return
+        if self.sector_start is not None and self.next_sector == len(self.sectors) - 1 and \
+                self.sectors[-1].sector.target_meta_data is None:
+            self._complete_sector(cross_time)
+        self.last_lap_splits = self.splits if len(self.splits) == len(self.sectors) else None
+        self.lap_start = cross_time
+        self.sector_start = cross_time
+        self.next_sector = 0
+        self.splits = []
+
+    def _complete_sector(self, cross_time: float):
+        stats = self.sectors[self.next_sector]
+        t = cross_time - self.sector_start
+        previous_best = stats.best
+        is_best = stats.add(t)
+        self.splits.append(t)
+        self.sector_start = cross_time
+        self.next_sector += 1
+        SectorCompleteEvent.emit(sector=stats.sector.number, name=stats.sector.name, time=t,
+                                 delta=None if previous_best is None else t - previous_best, is_best=is_best,
+                                 consistency=stats.consistency())
+        # a track whose last sector ends at a gate rather than the start/finish
+        if self.next_sector == len(self.sectors):
+            self.sector_start = None
+
+    def _stop(self):
+        self.lap_start = None
+        self.sector_start = None
+        self.next_sector = 0
+        self.splits = []
@@ -0,0 +1,191 @@
+# Folds the sessions saved for a track into one model per layout.
+#
+# Every stint of more than a few laps is saved as a session of its own, named
+# after its distance and when it started, so the track directory fills up
+# with near duplicates of the same layout that differ by a few feet. At start up each of them that
+# looks like the layout being driven has to be loaded and matched.
+#
+# Sessions are the same layout when their distances are close and the gates
+# of one lie on the lap described by the other's gates, heading the same way,
+# so the same track driven in the other direction is a different layout.
+# The gates of the most recent session are kept, and the timing samples of
+# the others are folded into them. The gates of two sessions are never in
+# quite the same places, so each of the older session's sketches is read at
+# a spread of quantiles, and the times at the two gates either side of the
+# newer gate are interpolated by how far along between them it is. Before
+# the first gate and after the last one the start/finish line stands in as
+# a gate. The times between gates come from the difference of the
+# interpolated times from the start. Older sessions count for less the
+# older they are.
+#
+# Once the layouts are merged, the oldest sessions are evicted until what's
+# left fits in the size budget for a track.
+#
+# LapSessionStore.consolidate() runs this on the store's writer thread. It
+# can be run over a whole track data directory with
+#
+#   python -m lemon_pi.car.session_consolidator /var/lib/lemon-pi/track-data
+import logging
+import os
+
+import numpy as np
+
+from lemon_pi.car.centreline import Centreline
+from lemon_pi.car.gate import Gates
+from lemon_pi.car.gate_stats import FROM_START, FROM_PREV, TO_FINISH
+from lemon_pi.car.projection import LocalProjection
+
+logger = logging.getLogger(__name__)
+
+# sessions whose distances are further apart than this can't be the same layout
+SIMILAR_DISTANCE_PERCENT = 5
+
+# a gate has to be this close to the other session's lap to be the same place on it
+SAME_PLACE_METRES = 30.0
+
+# and heading within this many degrees of one of the gates either side of it
+SAME_HEADING_DEGREES = 45
+
+# the share of a session's gates that have to be on the other session's lap for them to be
+# the same layout
+SAME_LAYOUT_SHARE = 0.9
+
+# where another session's sketches are read when they're folded in
+QUANTILES = np.linspace(0.025, 0.975, 20)
+
+# an older session counts for half as much for every this many days older it is
+HALF_LIFE_DAYS = 180
+
+# how much session data to keep for a track
+TRACK_BUDGET_BYTES = 1024 * 1024
+
+
+def similar_distance(distance: int, other_distance: int) -> bool:
+    return abs(distance - other_distance) * 100 / distance < SIMILAR_DISTANCE_PERCENT
+
+
+class LayoutMatch:
+    # Where the gates of one session are on the lap described by another's
+    # gates. For each gate that's on the other lap, the gate of the other
+    # session before it (-1 being the start of the lap) and how far it is
+    # towards the gate after it (len(other) being the finish)
+
+    def __init__(self, gates: Gates, other: Gates, projection: LocalProjection):
+        start_finish = projection.to_xy(*other.start_finish.midpoint)
+        other_xy = [projection.to_xy(gate.lat, gate.long) for gate in other]
+        self.matched = np.zeros(len(gates), dtype=bool)
+        self.before = np.full(len(gates), -1)
+        self.fraction = np.zeros(len(gates))
+        if len(other_xy) < 2:
+            return
+        # the lap starts and finishes at the start/finish line, the gates are the points in between
+        lap = Centreline([start_finish] + other_xy + [start_finish])
+        headings = np.array([gate.heading for gate in other], dtype=float)
+        for i, gate in enumerate(gates):
+            station, segment, distance = lap.locate(projection.to_xy(gate.lat, gate.long))
+            if distance > SAME_PLACE_METRES:
+                continue
+            # segment n runs from gate n - 1 to gate n
+            difference = np.abs(headings[max(segment - 1, 0):segment + 1] - gate.heading) % 360
+            if np.all(np.minimum(difference, 360 - difference) > SAME_HEADING_DEGREES):
+                continue
+            self.matched[i] = True
+            self.before[i] = segment - 1
+            self.fraction[i] = (station - lap.stations[segment]) / lap.lengths[segment]
+
+    def share(self) -> float:
+        return float(np.count_nonzero(self.matched)) / len(self.matched) if len(self.matched) else 0.0
+
+
+def same_layout(gates: Gates, other: Gates, projection: LocalProjection) -> bool:
+    if not similar_distance(gates.get_distance_feet(), other.get_distance_feet()):
+        return False
+    return LayoutMatch(gates, other, projection).share() >= SAME_LAYOUT_SHARE and \
+        LayoutMatch(other, gates, projection).share() >= SAME_LAYOUT_SHARE
+
+
+# fold the samples from another session of the same layout into the gates, returning how many
+# of the gates had samples added
+def merge_session(gates: Gates, other: Gates, projection: LocalProjection, weight: float = 1.0) -> int:
+    match = LayoutMatch(gates, other, projection)
+    stats = other.stats
+    usable = [all(stats.counts[column, gate.row] > 0 for column in (FROM_START, TO_FINISH)) for gate in other]
+    if not all(usable[:1] + usable[-1:]):
+        return 0
+    merged = 0
+    last_from_start = None
+    for i, gate in enumerate(gates):
+        j = int(match.before[i])
+        # the gates of the other session either side of this one, the start/finish standing in at either end
+        either_side = [k for k in (j, j + 1) if 0 <= k < len(other)]
+        if not match.matched[i] or not all(usable[k] for k in either_side):
+            last_from_start = None
+            continue
+        nearest = other[j if match.fraction[i] < 0.5 and j >= 0 else min(j + 1, len(other) - 1)]
+        samples = stats.sample_count(FROM_START, nearest.row)
+        # the share of the weight at the nearer gate that each quantile stands for
+        weights = np.full(len(QUANTILES), weight * stats.total_weight(FROM_START, nearest.row) / len(QUANTILES))
+        from_start = _interpolate(other, FROM_START, j, match.fraction[i])
+        gate.stats.merge_centroids(FROM_START, gate.row, from_start, weights, samples)
+        gate.stats.merge_centroids(TO_FINISH, gate.row, _interpolate(other, TO_FINISH, j, match.fraction[i]),
+                                   weights, samples)
+        if last_from_start is not None and gate.previous is not None:
+            from_prev = from_start - last_from_start
+            if np.all(from_prev > 0):
+                gate.stats.merge_centroids(FROM_PREV, gate.row, from_prev, weights, samples)
+        last_from_start = from_start
+        merged += 1
+    return merged
+
+
+def _interpolate(gates: Gates, column: int, before: int, fraction: float) -> np.ndarray:
+    return _times(gates, column, before) * (1 - fraction) + _times(gates, column, before + 1) * fraction
+
+
+# the times at each of the quantiles at a gate, or at the start (-1) or finish (len(gates)) of the lap
+def _times(gates: Gates, column: int, index: int) -> np.ndarray:
+    if index == -1:
+        if column == FROM_START:
+            return np.zeros(len(QUANTILES))
+        return _times(gates, FROM_START, 0) + _times(gates, TO_FINISH, 0)
+    if index == len(gates):
+        if column == TO_FINISH:
+            return np.zeros(len(QUANTILES))
+        return _times(gates, FROM_START, index - 1) + _times(gates, TO_FINISH, index - 1)
+    gate = gates[index]
+    return np.array([gate.stats.time_at(column, gate.row, q) for q in QUANTILES])
+
+
+# how much a session this many seconds older than the one it's folded into counts for
+def age_weight(age_seconds: float) -> float:
+    return 0.5 ** (max(age_seconds, 0.0) / (HALF_LIFE_DAYS * 24 * 3600))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    if "SETTINGS_MODULE" not in os.environ:
+        os.environ["SETTINGS_MODULE"] = "lemon_pi.config.local_settings_car"
+
+    from lemon_pi.car.lap_session_store import LapSessionStore
+    from lemon_pi.car.track import do_read_tracks
+
+    arg_parser = argparse.ArgumentParser(description="merge the saved sessions for each layout of each track")
+    arg_parser.add_argument("dir", nargs="?", default="/var/lib/lemon-pi/track-data",
+                            help="the track data directory, holding a directory per track")
+    arg_parser.add_argument("--tracks", default="resources/tracks.yaml", help="the track definitions")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(name)s %(message)s', level=logging.INFO)
+
+    tracks = {track.code: track for track in do_read_tracks(args.tracks)}
+    for track_dir in sorted(os.listdir(args.dir)):
+        if not os.path.isdir(os.path.join(args.dir, track_dir)):
+            continue
+        if track_dir not in tracks:
+            print(f"{track_dir}: not a known track, skipping")
+            continue
+        store = LapSessionStore(tracks[track_dir], args.dir)
+        store.consolidate()
+        store.flush()
+        print(f"{track_dir}: {len(store.get_catalogue())} sessions")
@@ -0,0 +1,245 @@
+# Reads and writes the gates and timing samples from a session at a track.
+#
+# A session file is laid out as
+#
+#   8 bytes   magic, b"LEMONSES"
+#   2 bytes   format version, little endian unsigned
+#   4 bytes   header length, little endian unsigned
+#   header    utf-8 json, describing the session and listing each array's
+#             dtype, shape and offset from the start of the array data
+#   arrays    raw little endian array data, starting on the first 64 byte
+#             boundary after the header, with each array 64 byte aligned
+#
+# The header holds the start/finish line, the gate names, when the session was
+# saved, its distance and lap count, and an "extra" object for anything else
+# the writer wants kept alongside the gates. The arrays are the same ones
+# Gates keeps when it is pickled. Nothing in the file refers to a python
+# class, so sessions can still be read after the code that wrote them has
+# moved.
+#
+# Files are memory mapped when they're read, so the header can be looked at
+# without reading the rest, and the arrays are only read in as they're copied
+# into the gates.
+#
+# Before this format, sessions were pickled Gates objects in -v1.dat files.
+# Running this module converts them:
+#
+#   python -m lemon_pi.car.session_format /var/lib/lemon-pi/track-data
+import json
+import logging
+import mmap
+import os
+import pickle
+import struct
+
+import numpy as np
+
+from lemon_pi.car.gate import Gates
+from lemon_pi.car.target import Target
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"LEMONSES"
+FORMAT_VERSION = 2
+PREAMBLE = struct.Struct("<8sHI")
+ALIGNMENT = 64
+
+SESSION_SUFFIX = f"-v{FORMAT_VERSION}.session"
+LEGACY_SUFFIX = "-v1.dat"
+TEMP_SUFFIX = ".tmp"
+
+# the arrays in a Gates state, and the ones in its stats
+GATES_ARRAYS = ["positions", "target_points", "target_headings", "has_previous"]
+STATS_ARRAYS = ["times", "weights", "counts", "samples", "last_time_from_start", "missed"]
+
+
+class SessionFormatError(Exception):
+    pass
+
+
+# sessions are named after when they started as well as their distance, as two layouts can be the same length
+def session_filename(distance_feet: int, timestamp: float) -> str:
+    return f"{distance_feet}-{int(timestamp)}{SESSION_SUFFIX}"
+
+
+def write_session(gates: Gates, path: str, extra: dict = None):
+    write_atomically(path, encode_session(gates, extra))
+
+
+# Writes to a temporary file alongside the real one and renames it into place
+# once it's safely on disk, so a power cut leaves either the old file or the
+# new one, never half of one.
+def write_atomically(path: str, data: bytes):
+    temp = path + TEMP_SUFFIX
+    with open(temp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+    # and make sure the rename itself is on disk
+    try:
+        fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+# the distance is worked out from the gates if the caller doesn't already have it
+def encode_session(gates: Gates, extra: dict = None, distance_feet: int = None) -> bytes:
+    state = gates.__getstate__()
+    start_finish: Target = state["start_finish"]
+    arrays = {name: np.ascontiguousarray(state[name]) for name in GATES_ARRAYS}
+    arrays.update({f"stats.{name}": np.ascontiguousarray(state["stats"][name]) for name in STATS_ARRAYS})
+    header = {
+        "timestamp": state["timestamp"],
+        "distance_feet": gates.get_distance_feet() if distance_feet is None else distance_feet,
+        "lap_count": gates.lap_count(),
+        "start_finish": {
+            "name": start_finish.name,
+            "lat_long1": list(start_finish.lat_long1),
+            "lat_long2": list(start_finish.lat_long2),
+            "target_heading": start_finish.target_heading,
+        },
+        "names": state["names"],
+        "elements": state["stats"]["elements"],
+        "decay": state["stats"]["decay"],
+        "extra": extra or {},
+        "arrays": {},
+    }
+    offset = 0
+    for name, array in arrays.items():
+        header["arrays"][name] = {"dtype": array.dtype.newbyteorder("<").str, "shape": list(array.shape),
+                                  "offset": offset}
+        offset = _align(offset + array.nbytes)
+    encoded_header = json.dumps(header).encode("utf-8")
+    body_start = _align(PREAMBLE.size + len(encoded_header))
+
+    data = bytearray(body_start + offset)
+    PREAMBLE.pack_into(data, 0, MAGIC, FORMAT_VERSION, len(encoded_header))
+    data[PREAMBLE.size:PREAMBLE.size + len(encoded_header)] = encoded_header
+    for name, array in arrays.items():
+        start = body_start + header["arrays"][name]["offset"]
+        data[start:start + array.nbytes] = array.astype(array.dtype.newbyteorder("<"), copy=False).tobytes()
+    return bytes(data)
+
+
+def read_header(path: str) -> dict:
+    with open(path, "rb") as f:
+        preamble = f.read(PREAMBLE.size)
+        header_length = _check_preamble(preamble, path)
+        return _decode_header(f.read(header_length), path)
+
+
+# anything wrong with the file, a short or empty one included, is raised as a SessionFormatError
+def read_session(path: str) -> Gates:
+    with open(path, "rb") as f:
+        # an empty file can't be mapped
+        if os.fstat(f.fileno()).st_size < PREAMBLE.size:
+            raise SessionFormatError(f"{path} is too short to be a session")
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    header_length = _check_preamble(data[:PREAMBLE.size], path)
+    header = _decode_header(data[PREAMBLE.size:PREAMBLE.size + header_length], path)
+    try:
+        return _decode_gates(data, header, _align(PREAMBLE.size + header_length))
+    except (KeyError, TypeError, ValueError, struct.error) as e:
+        raise SessionFormatError(f"{path} is damaged: {e}") from e
+
+
+def _decode_header(encoded: bytes, path: str) -> dict:
+    try:
+        header = json.loads(encoded.decode("utf-8"))
+    except ValueError as e:
+        # json and unicode errors are both ValueErrors
+        raise SessionFormatError(f"{path} has a damaged header: {e}") from e
+    if not isinstance(header, dict):
+        raise SessionFormatError(f"{path} has a damaged header")
+    return header
+
+
+def _decode_gates(data, header: dict, body_start: int) -> Gates:
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        arrays[name] = np.frombuffer(data, dtype=dtype, count=count,
+                                     offset=body_start + spec["offset"]).reshape(spec["shape"])
+
+    sf = header["start_finish"]
+    state = {
+        "start_finish": Target(sf["name"], tuple(sf["lat_long1"]), tuple(sf["lat_long2"]),
+                               target_heading=sf["target_heading"]),
+        "timestamp": header["timestamp"],
+        "names": header["names"],
+        "stats": {name: arrays[f"stats.{name}"] for name in STATS_ARRAYS},
+    }
+    state["stats"]["elements"] = header["elements"]
+    state["stats"]["decay"] = header["decay"]
+    state.update({name: arrays[name] for name in GATES_ARRAYS})
+    gates = Gates.__new__(Gates)
+    gates.__setstate__(state)
+    return gates
+
+
+# converts the pickled -v1.dat sessions in a track directory, returning the files written
+def migrate_directory(directory: str, keep: bool = False) -> [str]:
+    written = []
+    for file in sorted(os.listdir(directory)):
+        if not file.endswith(LEGACY_SUFFIX):
+            continue
+        legacy = os.path.join(directory, file)
+        try:
+            with open(legacy, "rb") as f:
+                gates = pickle.load(f)
+        except Exception:
+            logger.exception(f"unable to read {legacy}, leaving it where it is")
+            continue
+        path = os.path.join(directory, file[:-len(LEGACY_SUFFIX)] + SESSION_SUFFIX)
+        write_session(gates, path)
+        # make sure it reads back before getting rid of the original
+        if read_session(path).lap_count() != gates.lap_count():
+            raise SessionFormatError(f"{path} does not match {legacy}")
+        if not keep:
+            os.remove(legacy)
+        written.append(path)
+        logger.info(f"converted {legacy} to {path}")
+    return written
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _check_preamble(preamble: bytes, path: str) -> int:
+    if len(preamble) < PREAMBLE.size:
+        raise SessionFormatError(f"{path} is too short to be a session")
+    magic, version, header_length = PREAMBLE.unpack(preamble)
+    if magic != MAGIC:
+        raise SessionFormatError(f"{path} is not a session file")
+    if version > FORMAT_VERSION:
+        raise SessionFormatError(f"{path} is version {version}, newer than we can read")
+    return header_length
+
+
+if __name__ == "__main__":
+    import argparse
+
+    if "SETTINGS_MODULE" not in os.environ:
+        os.environ["SETTINGS_MODULE"] = "lemon_pi.config.local_settings_car"
+
+    arg_parser = argparse.ArgumentParser(description="convert pickled session data to the current session format")
+    arg_parser.add_argument("dir", nargs="?", default="/var/lib/lemon-pi/track-data",
+                            help="the track data directory, holding a directory per track")
+    arg_parser.add_argument("--keep", action="store_true", help="keep the -v1.dat files once they're converted")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(name)s %(message)s', level=logging.INFO)
+
+    for track_dir in sorted(os.listdir(args.dir)):
+        if os.path.isdir(os.path.join(args.dir, track_dir)):
+            converted = migrate_directory(os.path.join(args.dir, track_dir), args.keep)
+            print(f"{track_dir}: converted {len(converted)} sessions")
@@ -0,0 +1,223 @@
+import logging
+import math
+import os
+import struct
+import zlib
+from typing import Optional
+
+import numpy as np
+
+from lemon_pi.car.gate import Gates
+from lemon_pi.car.session_format import encode_session, read_session, read_header, SessionFormatError
+from lemon_pi.shared.clock import Clock
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILE = "checkpoint.session"
+JOURNAL_FILE = "journal.bin"
+
+# the journal is folded into a new checkpoint after this many laps, which keeps it short
+COMPACT_EVERY_LAPS = 10
+
+# a checkpoint older than this is from a previous day (or at least a previous session) rather than
+# from just before the pi lost power, so it isn't restored
+RESTORE_WITHIN_SECONDS = 30 * 60
+
+# record types
+HEADER = 1
+GATE = 2
+MISSED = 3
+FINISH = 4
+LAP = 5
+LEAVE = 6
+REFERENCE = 7
+
+# each record is a type and payload length, the payload, then a crc32 of the type and payload
+RECORD = struct.Struct("<BI")
+CRC = struct.Struct("<I")
+PAYLOADS = {
+    # generation, time
+    HEADER: struct.Struct("<qd"),
+    # gate index, time from the start of the lap
+    GATE: struct.Struct("<Id"),
+    # gate index
+    MISSED: struct.Struct("<I"),
+    # lap time, recorded against every gate
+    FINISH: struct.Struct("<d"),
+    # lap count, stint lap count, last lap time, best lap time (nan if none), time
+    LAP: struct.Struct("<IIddd"),
+    # time
+    LEAVE: struct.Struct("<d"),
+    # length, spacing, followed by the reference lap's times as float32s
+    REFERENCE: struct.Struct("<dd"),
+}
+
+
+class Recovery:
+    # The gates and state from a checkpoint, and the journal records written since it
+
+    def __init__(self, gates: Gates, state: dict, records: [(int, tuple)]):
+        self.gates = gates
+        self.state = state
+        self.records = records
+
+    # the lap tracker's state as of the last record
+    def lap_state(self) -> dict:
+        state = {k: self.state.get(k) for k in ("lap_count", "stint_lap_count", "last_lap_time",
+                                                 "best_lap_time", "on_track")}
+        for record_type, values in self.records:
+            if record_type == LAP:
+                lap_count, stint_lap_count, last_lap_time, best_lap_time, _ = values
+                state.update(lap_count=lap_count, stint_lap_count=stint_lap_count, last_lap_time=last_lap_time,
+                             best_lap_time=None if math.isnan(best_lap_time) else best_lap_time, on_track=True)
+            if record_type == LEAVE:
+                state["on_track"] = False
+        return state
+
+    # the times, length and spacing of the last best lap reference, or None
+    def reference(self) -> Optional[tuple]:
+        reference = self.state.get("reference")
+        if reference:
+            reference = (np.array(reference["times"], dtype=np.float32), reference["length"], reference["spacing"])
+        for record_type, values in self.records:
+            if record_type == REFERENCE:
+                reference = values
+        return reference
+
+
+class SessionJournal:
+    # Keeps what's been learnt this session safe from the pi losing power.
+    #
+    # Once the gates are laid down a checkpoint is written: the gates in the
+    # session format, with the lap tracker's state alongside them. After that
+    # every gate time, missed gate and finished lap is added to the end of a
+    # journal, a lap at a time. Every few laps a new checkpoint is taken and
+    # the journal starts again.
+    #
+    # Each checkpoint has a random generation, which the journal starts with,
+    # so a journal left over from a different checkpoint is never applied to
+    # it. Records carry a crc, so a record that was only half written when the
+    # power went is ignored, along with anything after it.
+    #
+    # All of the writing happens on the store's SessionWriter thread.
+
+    def __init__(self, basedir: str, writer, clock: Clock = None):
+        self.checkpoint_path = os.path.join(basedir, CHECKPOINT_FILE)
+        self.journal_path = os.path.join(basedir, JOURNAL_FILE)
+        self.writer = writer
+        self.clock = clock or Clock.get_instance()
+        # zero when there's no checkpoint, and nothing is being journalled
+        self.generation = 0
+        self.pending = bytearray()
+        self.laps_since_checkpoint = 0
+
+    def is_active(self) -> bool:
+        return self.generation != 0
+
+    def gate_crossed(self, index: int, time_from_start: float):
+        self._record(GATE, index, time_from_start)
+
+    def gate_missed(self, index: int):
+        self._record(MISSED, index)
+
+    def lap_finished(self, lap_time: float):
+        self._record(FINISH, lap_time)
+
+    def lap_completed(self, lap_count: int, stint_lap_count: int, last_lap_time: float, best_lap_time):
+        self._record(LAP, lap_count, stint_lap_count, last_lap_time,
+                     math.nan if best_lap_time is None else best_lap_time, self.clock.time())
+        self.laps_since_checkpoint += 1
+
+    def left_track(self):
+        self._record(LEAVE, self.clock.time())
+
+    def best_reference(self, times: np.ndarray, length: float, spacing: float):
+        self._record(REFERENCE, length, spacing, extra=np.asarray(times, dtype="<f4").tobytes())
+
+    def needs_checkpoint(self) -> bool:
+        return self.laps_since_checkpoint >= COMPACT_EVERY_LAPS
+
+    # hand everything recorded since the last commit to the writer
+    def commit(self):
+        if self.pending and self.is_active():
+            self.writer.submit([], appends=[(self.journal_path, bytes(self.pending))])
+        self.pending.clear()
+
+    # save the gates and state, and start a new journal
+    def checkpoint(self, gates: Gates, state: dict):
+        self.generation = int.from_bytes(os.urandom(8), "little") >> 1 or 1
+        now = self.clock.time()
+        state = dict(state, generation=self.generation, saved_at=now)
+        self.pending.clear()
+        self.laps_since_checkpoint = 0
+        self.writer.submit([(self.checkpoint_path, encode_session(gates, state)),
+                            (self.journal_path, self._encode(HEADER, self.generation, now))])
+
+    # forget the checkpoint and journal, e.g. when the track has been reversed
+    def reset(self):
+        self.generation = 0
+        self.pending.clear()
+        self.laps_since_checkpoint = 0
+        self.writer.submit([], remove=[self.checkpoint_path, self.journal_path])
+
+    # read back the checkpoint and journal if they were written recently, and carry on
+    # journalling after them
+    def recover(self) -> Optional[Recovery]:
+        self.writer.wait()
+        if not os.path.isfile(self.checkpoint_path) or not os.path.isfile(self.journal_path):
+            return None
+        try:
+            state = read_header(self.checkpoint_path).get("extra", {})
+            gates = read_session(self.checkpoint_path)
+            with open(self.journal_path, "rb") as f:
+                records = self._decode(f.read())
+        except (OSError, ValueError, SessionFormatError):
+            # a checkpoint that can't be read never will be, so it's thrown away with its journal
+            logger.exception("unable to read the checkpoint, discarding it")
+            self.reset()
+            return None
+        if not records or records[0][0] != HEADER or records[0][1][0] != state.get("generation"):
+            logger.info("journal doesn't belong to the checkpoint, not restoring")
+            return None
+        latest = max([state["saved_at"]] + [values[-1] for record_type, values in records
+                                             if record_type in (LAP, LEAVE)])
+        age = self.clock.time() - latest
+        if not 0 <= age <= RESTORE_WITHIN_SECONDS:
+            logger.info(f"checkpoint is {age:.0f}s old, not restoring")
+            return None
+        self.generation = state["generation"]
+        self.laps_since_checkpoint = len([r for r in records if r[0] == LAP])
+        return Recovery(gates, state, records[1:])
+
+    def _record(self, record_type: int, *values, extra: bytes = b""):
+        if self.is_active():
+            self.pending += self._encode(record_type, *values, extra=extra)
+
+    @staticmethod
+    def _encode(record_type: int, *values, extra: bytes = b"") -> bytes:
+        payload = PAYLOADS[record_type].pack(*values) + extra
+        head = RECORD.pack(record_type, len(payload))
+        return head + payload + CRC.pack(zlib.crc32(head + payload))
+
+    @staticmethod
+    def _decode(data: bytes) -> [(int, tuple)]:
+        records = []
+        offset = 0
+        while offset + RECORD.size <= len(data):
+            record_type, length = RECORD.unpack_from(data, offset)
+            end = offset + RECORD.size + length
+            if record_type not in PAYLOADS or end + CRC.size > len(data):
+                break
+            (crc,) = CRC.unpack_from(data, end)
+            if crc != zlib.crc32(data[offset:end]):
+                break
+            payload = data[offset + RECORD.size:end]
+            values = PAYLOADS[record_type].unpack_from(payload)
+            if record_type == REFERENCE:
+                values = (np.frombuffer(payload, dtype="<f4", offset=PAYLOADS[REFERENCE].size).astype(np.float32),) \
+                    + values
+            records.append((record_type, values))
+            offset = end + CRC.size
+        if offset < len(data):
+            logger.warning(f"ignoring {len(data) - offset} bytes at the end of the journal")
+        return records
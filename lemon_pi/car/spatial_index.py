@@ -0,0 +1,62 @@
+import math
+
+from lemon_pi.car.target import Target
+
+# a cell is roughly the width of a track, or a second of travel at racing speed,
+# so the segment between two fixes normally only touches one or two cells
+DEFAULT_CELL_SIZE_METRES = 50.0
+
+
+class SpatialIndex:
+    # A uniform grid over a track's projected coordinates. Each target is filed
+    # under every cell its bounding box covers. Looking up the segment between
+    # two fixes only visits the cells underneath it, so the cost per fix stays
+    # the same however many targets the track has.
+    #
+    # Items are handed back in the order they were added, so a caller that stops
+    # at the first crossing sees the same target it would have found by scanning
+    # all of them. Targets must be projected before they are added.
+
+    def __init__(self, cell_size: float = DEFAULT_CELL_SIZE_METRES):
+        self.cell_size = cell_size
+        self.cells: {(int, int): [(int, object, Target)]} = {}
+        self.entries: [(int, object, Target)] = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, item, target: Target):
+        entry = (len(self.entries), item, target)
+        self.entries.append(entry)
+        for cell in self._cells_covering(target.min_x, target.min_y, target.max_x, target.max_y):
+            self.cells.setdefault(cell, []).append(entry)
+
+    # the items whose target line could cross the segment from prev_xy to cur_xy
+    def candidates(self, prev_xy, cur_xy) -> list:
+        min_x, max_x = min(prev_xy[0], cur_xy[0]), max(prev_xy[0], cur_xy[0])
+        min_y, max_y = min(prev_xy[1], cur_xy[1]), max(prev_xy[1], cur_xy[1])
+        cells = self._cell_range(min_x, min_y, max_x, max_y)
+        # a wild jump in position (a gps glitch) can cover a huge number of cells,
+        # in which case it's cheaper to just look at everything
+        if cells[0] * cells[1] > len(self.cells):
+            possible = self.entries
+        else:
+            possible = [entry
+                        for cell in self._cells_covering(min_x, min_y, max_x, max_y)
+                        for entry in self.cells.get(cell, ())]
+        found = {}
+        for seq, item, target in possible:
+            if seq not in found and target.may_cross(prev_xy, cur_xy):
+                found[seq] = item
+        return [found[seq] for seq in sorted(found)]
+
+    def _cell_range(self, min_x, min_y, max_x, max_y) -> (int, int):
+        return (math.floor(max_x / self.cell_size) - math.floor(min_x / self.cell_size) + 1,
+                math.floor(max_y / self.cell_size) - math.floor(min_y / self.cell_size) + 1)
+
+    def _cells_covering(self, min_x, min_y, max_x, max_y):
+        first_x = math.floor(min_x / self.cell_size)
+        first_y = math.floor(min_y / self.cell_size)
+        for cell_x in range(first_x, math.floor(max_x / self.cell_size) + 1):
+            for cell_y in range(first_y, math.floor(max_y / self.cell_size) + 1):
+                yield cell_x, cell_y
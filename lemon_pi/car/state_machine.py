@@ -3,9 +3,9 @@ from enum import Enum
 
 from lemon_pi.car.event_defs import (
     CarStoppedEvent, MovingEvent, LeaveTrackEvent, CompleteLapEvent, OBDConnectedEvent,
-    StateChangeSettingOffEvent, RefuelEvent, StateChangePittedEvent
+    StateChangeSettingOffEvent, RefuelEvent, StateChangePittedEvent, Movement
 )
-from lemon_pi.shared.events import EventHandler
+from lemon_pi.shared.events import EventHandler, Dispatch
 
 
 class State(Enum):
@@ -21,12 +21,14 @@ class StateMachine(EventHandler):
 
     __instance = None
 
+    dispatch = Dispatch.POOL
+
     def __init__(self):
         # we assume we're parked in pit when we are initialized, if we're not
         # we're in big trouble anyway. If we cross the start-finish line then we
         # switch state to ON_TRACK anyway
         self.state = State.PARKED_IN_PIT
-        MovingEvent.register_handler(self)
+        MovingEvent.register_handler(self, self.on_moving)
         CarStoppedEvent.register_handler(self)
         LeaveTrackEvent.register_handler(self)
         CompleteLapEvent.register_handler(self)
@@ -40,14 +42,16 @@ class StateMachine(EventHandler):
     def is_on_track(cls):
         return StateMachine.__instance.state == State.ON_TRACK
 
-    def handle_event(self, event, **kwargs):
+    # the movement detector emits this once each time the car sets off, with the speed it was doing
+    def on_moving(self, movement: Movement = None):
         # upon power on we assume we're in the pit, so this
         # isn't a completely reliable state
         if self.state == State.PARKED_IN_PIT:
-            if event == MovingEvent:
-                self.state = State.LEAVING_PIT
-                StateChangeSettingOffEvent.emit()
-                return
+            self.state = State.LEAVING_PIT
+            StateChangeSettingOffEvent.emit()
+
+    def handle_event(self, event, **kwargs):
+        if self.state == State.PARKED_IN_PIT:
             if event == OBDConnectedEvent:
                 RefuelEvent.emit(percent_full=100)
                 return
@@ -4,10 +4,20 @@
 # of a line. And a heading that indicates a tangent to the
 # direction of travel when passing the point.
 from lemon_pi.car.geometry import calc_intersect_heading
+from lemon_pi.car.projection import LocalProjection
+
+# the bounding box around a target is widened a little, so that a fix that lands
+# exactly on the end of the line isn't rejected due to rounding
+BOUNDING_BOX_MARGIN_METRES = 1.0
 
 
 class Target:
 
+    # targets are projected onto the track's local plane when they are added
+    # to a track. Until then, and for targets unpickled from older session
+    # files, there is no projection
+    projection: LocalProjection = None
+
     def __init__(self, name, lat_long1, lat_long2, direction="", target_heading=0):
         self.name = name
         self.lat_long1 = min(lat_long1, lat_long2)
@@ -21,4 +31,49 @@ class Target:
     def _calc_midpoint_(self):
         lat1, long1 = self.lat_long1
         lat2, long2 = self.lat_long2
-        return (lat1 + lat2) / 2.0, (long1 + long2) / 2.0
\ No newline at end of file
+        return (lat1 + lat2) / 2.0, (long1 + long2) / 2.0
+
+    def set_projection(self, projection: LocalProjection):
+        # work out everything about the line that the crossing tests need up
+        # front, so they are just a few multiplications per fix
+        self.projection = projection
+        self.xy1 = projection.to_xy(*self.lat_long1)
+        self.xy2 = projection.to_xy(*self.lat_long2)
+        self.mid_xy = projection.to_xy(*self.midpoint)
+        x1, y1 = self.xy1
+        x2, y2 = self.xy2
+        # the direction along the line, and the normal to it
+        self.direction = (x2 - x1, y2 - y1)
+        self.normal = (y1 - y2, x2 - x1)
+        self.length_sq = (x2 - x1) ** 2 + (y2 - y1) ** 2
+        self.min_x = min(x1, x2) - BOUNDING_BOX_MARGIN_METRES
+        self.max_x = max(x1, x2) + BOUNDING_BOX_MARGIN_METRES
+        self.min_y = min(y1, y2) - BOUNDING_BOX_MARGIN_METRES
+        self.max_y = max(y1, y2) + BOUNDING_BOX_MARGIN_METRES
+
+    # a cheap check that rules out most fixes before doing any real work. If both
+    # the previous and current fix are off the same side of the bounding box then
+    # the car cannot have crossed the line
+    def may_cross(self, prev_xy, cur_xy) -> bool:
+        prev_x, prev_y = prev_xy
+        cur_x, cur_y = cur_xy
+        if prev_x < self.min_x and cur_x < self.min_x:
+            return False
+        if prev_x > self.max_x and cur_x > self.max_x:
+            return False
+        if prev_y < self.min_y and cur_y < self.min_y:
+            return False
+        if prev_y > self.max_y and cur_y > self.max_y:
+            return False
+        return True
+
+    # which side of the line a point is. Positive on one side, negative on the
+    # other and zero on the line (scaled by the length of the line)
+    def side_of(self, xy) -> float:
+        return (xy[0] - self.xy1[0]) * self.normal[0] + (xy[1] - self.xy1[1]) * self.normal[1]
+
+    def get_projection(self) -> LocalProjection:
+        # a target that is not part of a track gets a projection of its own
+        if self.projection is None:
+            self.set_projection(LocalProjection(*self.midpoint))
+        return self.projection
@@ -103,8 +103,11 @@ class TestAudio(unittest.TestCase):
         DriverMessageEvent.emit(text="pit in 3 laps")
         self.assertEqual(0, audio.queue.qsize())
 
-
-
-
-
-
+    def test_lap_losses(self):
+        audio = Audio()
+        audio.announce = Mock()
+        audio.announce_lap_losses(optimal_lap_time=110.2, losses=[("gate-12", 0.84), ("finish", 0.3)])
+        audio.announce.assert_called_once_with("lost 0.8 at gate 12")
+        audio.announce = Mock()
+        audio.announce_lap_losses(optimal_lap_time=110.2, losses=[("gate-12", 0.2)])
+        audio.announce.assert_not_called()
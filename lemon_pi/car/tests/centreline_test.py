@@ -0,0 +1,51 @@
+import math
+import unittest
+
+from lemon_pi.car.centreline import Centreline, CentrelineTracker
+
+
+def _circle_trace(radius=200, points=360):
+    # a lap anticlockwise round a circle, starting and finishing at (radius, 0)
+    return [(radius * math.cos(math.radians(a)), radius * math.sin(math.radians(a)))
+            for a in range(1, points)]
+
+
+class CentrelineTest(unittest.TestCase):
+
+    def test_from_breadcrumbs(self):
+        centreline = Centreline.from_breadcrumbs((200, 0), _circle_trace())
+        self.assertAlmostEqual(2 * math.pi * 200, centreline.length, delta=2)
+        # points closer than the spacing are dropped
+        self.assertTrue(centreline.segment_count() < 360)
+        self.assertIsNone(Centreline.from_breadcrumbs((0, 0), [(1, 1)]))
+
+    def test_locate(self):
+        centreline = Centreline.from_breadcrumbs((200, 0), _circle_trace())
+        station, segment, offset = centreline.locate((0, 205))
+        self.assertAlmostEqual(math.pi * 100, station, delta=2)
+        self.assertAlmostEqual(5, offset, delta=0.1)
+        # a window search around the right segment gets the same answer
+        self.assertEqual((station, segment), centreline.locate((0, 205), segment - 3)[0:2])
+
+    def test_lost_car_is_found_again(self):
+        centreline = Centreline.from_breadcrumbs((200, 0), _circle_trace())
+        # the hint is the wrong side of the track, so the window misses and we search everything
+        station, _, _ = centreline.locate((-200, 0), 2)
+        self.assertAlmostEqual(math.pi * 200, station, delta=2)
+
+    def test_tracker(self):
+        tracker = CentrelineTracker(Centreline.from_breadcrumbs((200, 0), _circle_trace()))
+        tracker.start_lap()
+        last = 0
+        for xy in _circle_trace(radius=203)[::3]:
+            station = tracker.update(xy)
+            self.assertTrue(station >= last)
+            last = station
+        self.assertTrue(last > 1200)
+        tracker.start_lap()
+        self.assertEqual(0, tracker.station)
+        self.assertTrue(tracker.update((203, 5)) < 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
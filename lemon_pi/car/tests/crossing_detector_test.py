@@ -0,0 +1,51 @@
+import unittest
+from unittest.mock import Mock
+
+from lemon_pi.car.crossing_detector import CrossingDetector
+from lemon_pi.car.target import Target
+from lemon_pi.car.track import TrackLocation, START_FINISH, PIT_ENTRY
+from lemon_pi.shared.data_provider_interface import GpsPos
+
+
+class CrossingDetectorTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.track = TrackLocation("bw", "foo")
+        self.track.set_start_finish_target(Target("start-finish", (35.489031, -119.544530),
+                                                  (35.488713, -119.544510), "E"))
+        self.track.set_pit_in_target(Target("pit-in", (35.489031, -119.546), (35.488713, -119.546), "E"))
+        self.detector = CrossingDetector(self.track)
+
+    def test_crossing_start_finish(self):
+        self.assertEqual([], self.detector.update(GpsPos(35.4888, -119.5446, 90, 50, 61)))
+        crossings = self.detector.update(GpsPos(35.4888, -119.5444, 90, 50, 62))
+        self.assertEqual(1, len(crossings))
+        crossing = self.detector.get_crossing(START_FINISH)
+        self.assertAlmostEqual(61.44, crossing.cross_time, places=2)
+        self.assertFalse(crossing.backwards)
+        self.assertIsNone(self.detector.get_crossing(PIT_ENTRY))
+
+    def test_repeated_fix_is_ignored(self):
+        self.detector.update(GpsPos(35.4888, -119.5446, 90, 50, 61))
+        self.detector.update(GpsPos(35.4888, -119.5444, 90, 50, 62))
+        self.assertEqual([], self.detector.update(GpsPos(35.4888, -119.5444, 90, 50, 63)))
+        self.assertIsNone(self.detector.get_crossing(START_FINISH))
+
+    def test_listeners(self):
+        everything = Mock()
+        pit_only = Mock()
+        self.detector.subscribe(everything)
+        self.detector.subscribe(pit_only, PIT_ENTRY)
+        # heading west, over the start/finish and then the pit entry
+        self.detector.update(GpsPos(35.4888, -119.5443, 270, 50, 60))
+        self.detector.update(GpsPos(35.4888, -119.5446, 270, 50, 61))
+        pit_only.on_crossing.assert_not_called()
+        self.detector.update(GpsPos(35.4889, -119.5458, 270, 50, 66))
+        self.detector.update(GpsPos(35.4889, -119.5462, 270, 50, 67))
+        pit_only.on_crossing.assert_called_once()
+        self.assertTrue(pit_only.on_crossing.call_args[0][0].backwards)
+        self.assertEqual(2, everything.on_crossing.call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import math
+import unittest
+
+from lemon_pi.car.gate_placement import place_gates, gate_budget
+from lemon_pi.car.projection import FEET_PER_METRE
+
+
+# a lap that runs 500m north up a straight at 50m/s, round a tight hairpin at 10m/s,
+# and 500m back south to where it started, a fix every second
+def _lap():
+    trace, times = [], []
+    t = 0
+    for y in range(50, 501, 50):
+        t += 1
+        trace.append((0.0, float(y)))
+        times.append(float(t))
+    for angle in range(10, 180, 10):
+        theta = math.radians(angle)
+        t += 1
+        trace.append((50 - 50 * math.cos(theta), 500 + 50 * math.sin(theta)))
+        times.append(float(t))
+    for y in range(500, 49, -50):
+        t += 1
+        trace.append((100.0, float(y)))
+        times.append(float(t))
+    return trace, times, float(t + 1)
+
+
+class GatePlacementTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.trace, self.times, self.finish = _lap()
+
+    def test_budget_is_as_laid_before(self):
+        trace = [(0.0, float(y)) for y in range(10, 1001, 10)]
+        self.assertEqual(10, gate_budget(trace, (0.0, 0.0), 100 * FEET_PER_METRE))
+        self.assertEqual(0, gate_budget([], (0.0, 0.0), 100 * FEET_PER_METRE))
+
+    def test_no_more_than_the_budget(self):
+        gates = place_gates((0.0, 0.0), self.trace, self.times, 0.0, self.finish, 12)
+        self.assertLessEqual(len(gates), 12)
+        self.assertGreater(len(gates), 8)
+
+    def test_more_gates_in_the_hairpin(self):
+        gates = place_gates((0.0, 0.0), self.trace, self.times, 0.0, self.finish, 12)
+        in_hairpin = [g for g in gates if g[1] > 500]
+        # the hairpin is less than a seventh of the distance round, but more than a third of the time
+        self.assertGreaterEqual(len(in_hairpin), len(gates) / 3)
+
+    def test_headings_follow_the_lap(self):
+        gates = place_gates((0.0, 0.0), self.trace, self.times, 0.0, self.finish, 12)
+        self.assertAlmostEqual(0, gates[0][2])
+        self.assertAlmostEqual(180, gates[-1][2])
+
+    def test_gates_not_too_close(self):
+        gates = place_gates((0.0, 0.0), self.trace, self.times, 0.0, self.finish, 100)
+        # no more gates than fixes to cross them between
+        self.assertLess(len(gates), len(self.trace))
+
+    def test_nothing_to_place(self):
+        self.assertEqual([], place_gates((0.0, 0.0), [], [], 0.0, 1.0, 10))
+        self.assertEqual([], place_gates((0.0, 0.0), self.trace, self.times, 0.0, self.finish, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
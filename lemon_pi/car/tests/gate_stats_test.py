@@ -0,0 +1,162 @@
+import pickle
+import random
+import unittest
+
+import numpy as np
+
+from lemon_pi.car.gate import Gate, Gates, ELEMENTS
+from lemon_pi.car.gate_stats import GateStats, TO_FINISH, FROM_START
+from lemon_pi.car.target import Target
+
+
+class GateStatsTest(unittest.TestCase):
+
+    def test_insert_keeps_sorted_and_bounded(self):
+        stats = GateStats(ELEMENTS)
+        row = stats.add_row()
+        for x in range(50, 20, -1):
+            stats.insert(FROM_START, row, x)
+        values = stats.values(FROM_START, row)
+        self.assertEqual(ELEMENTS, len(values))
+        self.assertTrue(np.all(np.diff(values) >= 0))
+        # nothing is lost from the weights
+        self.assertEqual(30, sum(stats.weights[FROM_START, row, :ELEMENTS]))
+        self.assertEqual(30, stats.sample_count(FROM_START, row))
+
+    def test_merge_centroids(self):
+        stats = GateStats(ELEMENTS)
+        row = stats.add_row()
+        for x in range(10):
+            stats.insert(FROM_START, row, 50 + x)
+        stats.merge_centroids(FROM_START, row, np.arange(30.0, 60.0), np.full(30, 0.5), 40)
+        values = stats.values(FROM_START, row)
+        self.assertEqual(ELEMENTS, len(values))
+        self.assertTrue(np.all(np.diff(values) >= 0))
+        self.assertEqual(25, stats.total_weight(FROM_START, row))
+        self.assertEqual(50, stats.sample_count(FROM_START, row))
+        self.assertTrue(30 <= values[0] < 31)
+        self.assertTrue(58 < values[-1] <= 59)
+
+    def test_quantiles(self):
+        stats = GateStats(ELEMENTS)
+        row = stats.add_row()
+        with self.assertRaises(IndexError):
+            stats.time_at(FROM_START, row, 0.5)
+        self.assertEqual(0, stats.quantile_of(FROM_START, row, 10))
+        for x in range(1, 101):
+            stats.insert(FROM_START, row, x)
+        self.assertEqual(0, stats.quantile_of(FROM_START, row, 0.5))
+        self.assertEqual(1, stats.quantile_of(FROM_START, row, 101))
+        self.assertAlmostEqual(0.5, stats.quantile_of(FROM_START, row, 50.5), delta=0.03)
+        self.assertAlmostEqual(50.5, stats.time_at(FROM_START, row, 0.5), delta=3)
+        self.assertAlmostEqual(25, stats.time_at(FROM_START, row, 0.25), delta=3)
+        # and the two agree with each other
+        for q in [0.1, 0.3, 0.6, 0.9]:
+            self.assertAlmostEqual(q, stats.quantile_of(FROM_START, row, stats.time_at(FROM_START, row, q)))
+
+    def test_decay(self):
+        stats = GateStats(ELEMENTS, decay=0.3)
+        row = stats.add_row()
+        for x in range(10):
+            stats.insert(FROM_START, row, 100)
+        stats.insert(FROM_START, row, 50)
+        # the newest sample outweighs all of the old ones put together
+        self.assertTrue(stats.time_at(FROM_START, row, 0.5) < 75)
+
+    def test_insert_rows_matches_insert(self):
+        random.seed(7)
+        one_at_a_time = GateStats(ELEMENTS, 2, 0.9)
+        all_at_once = GateStats(ELEMENTS, 2, 0.9)
+        for _ in range(40):
+            one_at_a_time.add_row()
+            all_at_once.add_row()
+        for lap in range(60):
+            values = np.array([random.choice([random.uniform(50, 60), random.uniform(60, 90), 55.0])
+                               for _ in range(40)])
+            rows = np.array([r for r in range(40) if random.random() > 0.1])
+            for r in rows:
+                one_at_a_time.insert(TO_FINISH, r, values[r])
+            all_at_once.insert_rows(TO_FINISH, rows, values[rows])
+        for r in range(40):
+            np.testing.assert_allclose(one_at_a_time.values(TO_FINISH, r), all_at_once.values(TO_FINISH, r))
+            count = one_at_a_time.counts[TO_FINISH, r]
+            np.testing.assert_allclose(one_at_a_time.weights[TO_FINISH, r, :count],
+                                       all_at_once.weights[TO_FINISH, r, :count])
+
+    def test_growing(self):
+        stats = GateStats(ELEMENTS, 1)
+        for r in range(100):
+            self.assertEqual(r, stats.add_row())
+            stats.insert(FROM_START, r, r)
+        self.assertEqual(100, len(stats))
+        self.assertEqual([99.0], list(stats.values(FROM_START, 99)))
+
+
+class GatesStorageTest(unittest.TestCase):
+
+    def _gates(self):
+        gates = Gates(Target("sf", (38.161340, -122.454911), (38.161589, -122.454658), "NW"))
+        previous = None
+        for i in range(30):
+            gate = Gate(38.16 + i * 0.0005, -122.45, 90, f"gate-{i}", previous)
+            gates.append(gate)
+            previous = gate
+        for lap in range(20):
+            for i, gate in enumerate(gates):
+                gate.record_time_from_start(i * 2 + lap * 0.1)
+            gates.record_lap_time(80 + lap * 0.1)
+        gates[3].missed = True
+        return gates
+
+    def test_gates_share_stats(self):
+        gates = self._gates()
+        self.assertTrue(all(g.stats is gates.stats for g in gates))
+        self.assertEqual(20, gates.lap_count())
+        self.assertEqual(ELEMENTS, len(gates[5].times_to_finish))
+        self.assertEqual(20, gates.stats.sample_count(TO_FINISH, gates[5].row))
+
+    def test_round_trip(self):
+        gates = self._gates()
+        loaded = pickle.loads(pickle.dumps(gates))
+        self.assertEqual(len(gates), len(loaded))
+        self.assertEqual(gates.timestamp, loaded.timestamp)
+        self.assertIsNone(loaded[0].previous)
+        self.assertIs(loaded[4], loaded[5].previous)
+        self.assertTrue(loaded[3].missed)
+        for before, after in zip(gates, loaded):
+            self.assertEqual(before.target.name, after.target.name)
+            self.assertEqual(before.target.lat_long1, after.target.lat_long1)
+            np.testing.assert_array_equal(before.times_from_start, after.times_from_start)
+            np.testing.assert_array_equal(before.times_from_prev, after.times_from_prev)
+            np.testing.assert_array_equal(before.times_to_finish, after.times_to_finish)
+        self.assertEqual(gates[10].predict_lap(20.5), loaded[10].predict_lap(20.5))
+
+    def test_loading_old_format(self):
+        # before GateStats, each gate kept its own lists
+        sf = Target("sf", (38.161340, -122.454911), (38.161589, -122.454658), "NW")
+        old_gates = []
+        for i in range(3):
+            gate = Gate.__new__(Gate)
+            gate.__setstate__({
+                "lat": 38.16 + i * 0.0005, "long": -122.45, "heading": 90,
+                "target": Target(f"gate-{i}", (38.16, -122.45), (38.161, -122.45), target_heading=90),
+                "previous": old_gates[-1] if old_gates else None,
+                "missed": False,
+                "times_from_start": [10.0 + i, 11.0 + i],
+                "times_from_prev": [1.0, 1.5] if i else [],
+                "times_to_finish": [70.0 - i, 71.0 - i],
+                "last_time_from_start": 11.0 + i,
+                "last_mini_rank": -1,
+            })
+            old_gates.append(gate)
+        gates = Gates.__new__(Gates)
+        gates.__setstate__({"start_finish": sf, "gates": old_gates, "timestamp": 1000})
+        self.assertEqual(3, len(gates))
+        self.assertEqual(2, gates.lap_count())
+        self.assertTrue(all(g.stats is gates.stats for g in gates))
+        self.assertEqual([68.0, 69.0], list(gates[2].times_to_finish))
+        self.assertIs(gates[1], gates[2].previous)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,7 @@ import unittest
 from unittest.mock import Mock, patch
 
 from lemon_pi.car.gate import Gate, ELEMENTS, Gates, GateVerifier
+from lemon_pi.car.gate_stats import FROM_START
 from lemon_pi.car.target import Target
 from lemon_pi.shared.data_provider_interface import GpsPos
 
@@ -20,34 +21,39 @@ class GateTest(unittest.TestCase):
         g.record_lap_time(30.0)
         self.assertEqual(30.0, g.predict_lap(15.0))
 
-    def test_throwing_out_extra_data(self):
+    def test_memory_is_bounded(self):
         g = Gate(55, 100, 180, "gate-0")
         for x in range(20, 50):
             g.record_time_from_start(x)
             g.record_lap_time(x + 10)
         self.assertEqual(ELEMENTS, len(g.times_from_start))
         self.assertEqual(ELEMENTS, len(g.times_to_finish))
-        # we should have the fastest and slowest times in there
-        self.assertTrue(20 in g.times_from_start)
-        self.assertTrue(49 in g.times_from_start)
+        self.assertEqual(30, g.stats.sample_count(FROM_START, g.row))
+        # the spread of times is still there
+        self.assertTrue(g.times_from_start[0] < 22)
+        self.assertEqual(49, g.times_from_start[-1])
 
-    def test_really_slow_times_discarded(self):
+    def test_really_slow_times_only_change_slow_predictions(self):
         g = Gate(55, 100, 180, "gate-0")
         for x in range(20, 50):
             g.record_time_from_start(x)
             g.record_lap_time(x + 10)
+        before = g.predict_lap(25)
         g.record_time_from_start(65)
         g.record_lap_time(75)
-        self.assertFalse(65 in g.times_from_start)
+        self.assertEqual(65, g.times_from_start[-1])
+        self.assertAlmostEqual(before, g.predict_lap(25), delta=0.5)
 
-    def test_slower_times_discarded(self):
+    def test_recent_laps_count_for_more(self):
         g = Gate(55, 100, 180, "gate-0")
-        for x in range(20, 50):
-            g.record_time_from_start(x)
-            g.record_lap_time(x + 10)
-        g.record_time_from_start(20)
-        g.record_lap_time(31)
-        self.assertFalse(49 in g.times_from_start)
+        for x in range(20):
+            g.record_time_from_start(40)
+            g.record_lap_time(100)
+        for x in range(20):
+            g.record_time_from_start(30)
+            g.record_lap_time(80)
+        # a middling time at the gate is predicted to finish like the recent laps
+        self.assertAlmostEqual(85, g.predict_lap(35), delta=1)
 
     def test_multiple_gates(self):
         g1 = Gate(55, 100, 180, "gate-0")
@@ -0,0 +1,93 @@
+import unittest
+
+import numpy as np
+
+from lemon_pi.car.gate import Gates, Gate, GateVerifier
+from lemon_pi.car.gate_verifier_set import GateVerifierSet
+from lemon_pi.car.projection import LocalProjection
+from lemon_pi.car.target import Target
+from lemon_pi.shared.data_provider_interface import GpsPos
+
+PROJECTION = LocalProjection(38.0, -122.0)
+
+
+def _gates(xs) -> Gates:
+    # gates across a track that runs north, 100m apart, at the given distances east
+    start_finish = Target("sf", PROJECTION.to_lat_long(-20, 0), PROJECTION.to_lat_long(20, 0), target_heading=0)
+    start_finish.set_projection(PROJECTION)
+    gates = Gates(start_finish)
+    previous = None
+    for i, x in enumerate(xs):
+        lat, long = PROJECTION.to_lat_long(x, (i + 1) * 100)
+        previous = Gate(lat, long, 0, f"gate-{i}", previous, projection=PROJECTION)
+        gates.append(previous)
+    return gates
+
+
+def _drive(heading=0):
+    # fixes every 10m up the track, as (last_xy, this_xy)
+    points = [(0.0, y * 10.0) for y in range(0, 60)]
+    if heading == 180:
+        points.reverse()
+    return zip(points[:-1], points[1:])
+
+
+class GateVerifierSetTest(unittest.TestCase):
+
+    def test_match(self):
+        verifiers = [GateVerifier(_gates([0, 0, 0, 0]))]
+        verifier_set = GateVerifierSet(verifiers)
+        for last_xy, this_xy in _drive():
+            verifier_set.verify(last_xy, this_xy, 0)
+        verifier_set.update_verifiers()
+        self.assertTrue(verifiers[0].is_match())
+        self.assertEqual(0, verifier_set.active_count())
+
+    def test_missed_gate_is_dropped(self):
+        verifiers = [GateVerifier(_gates([0, 0, 0, 0])), GateVerifier(_gates([0, 500, 0, 0]))]
+        verifier_set = GateVerifierSet(verifiers)
+        for last_xy, this_xy in list(_drive())[:15]:
+            verifier_set.verify(last_xy, this_xy, 0)
+        self.assertEqual([True, False], verifier_set.active.tolist())
+        verifier_set.update_verifiers()
+        self.assertEqual(1, verifiers[1].matched)
+        self.assertEqual(2, verifiers[1].index)
+
+    def test_backwards_does_not_match(self):
+        verifiers = [GateVerifier(_gates([0, 0, 0, 0]))]
+        verifier_set = GateVerifierSet(verifiers)
+        for last_xy, this_xy in _drive(heading=180):
+            verifier_set.verify(last_xy, this_xy, 180)
+        verifier_set.update_verifiers()
+        self.assertFalse(verifiers[0].is_match())
+
+    def test_same_as_verifying_one_at_a_time(self):
+        layouts = [[0, 0, 0, 0], [0, 500, 0, 0], [0, 0, 15, 0], [0, 0, 0], [10, -10, 10, -10, 10]]
+        one_at_a_time = [GateVerifier(_gates(xs)) for xs in layouts]
+        together = [GateVerifier(_gates(xs)) for xs in layouts]
+        verifier_set = GateVerifierSet(together)
+        for last_xy, this_xy in _drive():
+            last_gps = GpsPos(*PROJECTION.to_lat_long(*last_xy), 0, 0, 0)
+            this_gps = GpsPos(*PROJECTION.to_lat_long(*this_xy), 0, 0, 1)
+            for verifier in one_at_a_time:
+                verifier.verify(last_gps, this_gps)
+            verifier_set.verify(last_xy, this_xy, 0)
+        verifier_set.update_verifiers()
+        self.assertEqual([v.is_match() for v in one_at_a_time], [v.is_match() for v in together])
+        self.assertEqual([True, False, True, True, True], [v.is_match() for v in together])
+
+    def test_verify_trace(self):
+        layouts = [[0, 0, 0, 0], [0, 500, 0, 0], [0, 0, 15, 0], [0, 0, 0], [10, -10, 10, -10, 10]]
+        one_at_a_time = [GateVerifier(_gates(xs)) for xs in layouts]
+        verifier_set = GateVerifierSet(one_at_a_time)
+        for last_xy, this_xy in _drive():
+            verifier_set.verify(last_xy, this_xy, 0)
+        verifier_set.update_verifiers()
+        whole_trace = [GateVerifier(_gates(xs)) for xs in layouts]
+        trace = np.array([(0.0, y * 10.0) for y in range(0, 60)])
+        GateVerifierSet(whole_trace).verify_trace(trace, np.zeros(len(trace)))
+        self.assertEqual([(v.index, v.matched) for v in one_at_a_time], [(v.index, v.matched) for v in whole_trace])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+
+from lemon_pi.car.gate import Gates, Gate
+from lemon_pi.car.lap_analysis import LapAnalysis, FINISH
+from lemon_pi.car.target import Target
+
+
+def _gates(count: int) -> Gates:
+    gates = Gates(Target("sf", (30, -50), (31, -80), "NW"))
+    previous = None
+    for i in range(count):
+        previous = Gate(30 + i / 1000, -45, 10, f"gate-{i}", previous)
+        gates.append(previous)
+    return gates
+
+
+# record a lap against the gates the way the predictor does, from the time taken over each stretch
+def _drive(gates: Gates, stretches: [float], missed: [int] = ()) -> float:
+    t = 0.0
+    for i, gate in enumerate(gates):
+        t += stretches[i]
+        gate.missed = i in missed
+        if not gate.missed:
+            gate.record_time_from_start(t)
+    lap_time = t + stretches[-1]
+    gates.record_lap_time(lap_time)
+    return lap_time
+
+
+class LapAnalysisTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.gates = _gates(4)
+        # every gap between gates is a stretch of its own
+        self.analysis = LapAnalysis(stretch_gates=1)
+
+    def test_first_lap(self):
+        lap_time = _drive(self.gates, [10, 11, 12, 13, 14])
+        losses = self.analysis.lap_completed(self.gates, lap_time, len(self.gates))
+        self.assertEqual(60, losses.lap_time)
+        self.assertEqual(60, losses.optimal_lap_time)
+        self.assertEqual([], losses.worst)
+
+    def test_optimal_lap_and_worst_places(self):
+        lap_time = _drive(self.gates, [10, 11, 12, 13, 14])
+        self.analysis.lap_completed(self.gates, lap_time, len(self.gates))
+        lap_time = _drive(self.gates, [9, 12.5, 11, 13.25, 15])
+        losses = self.analysis.lap_completed(self.gates, lap_time, len(self.gates))
+        self.assertAlmostEqual(58, losses.optimal_lap_time)
+        self.assertEqual([("gate-1", 1.5), (FINISH, 1.0), ("gate-3", 0.25)], losses.worst)
+        self.assertAlmostEqual(58, self.analysis.get_optimal_lap_time())
+
+    def test_missed_gate_isnt_timed(self):
+        lap_time = _drive(self.gates, [10, 11, 12, 13, 14])
+        self.analysis.lap_completed(self.gates, lap_time, len(self.gates))
+        # the two stretches either side of gate-2 come to less than the best, but can't be split
+        lap_time = _drive(self.gates, [10, 11, 10, 12, 15], missed=[2])
+        losses = self.analysis.lap_completed(self.gates, lap_time, len(self.gates))
+        self.assertEqual([(FINISH, 1.0)], losses.worst)
+        self.assertEqual(60, losses.optimal_lap_time)
+
+    def test_gates_not_reached_arent_timed(self):
+        lap_time = _drive(self.gates, [10, 11, 12, 13, 14])
+        self.analysis.lap_completed(self.gates, lap_time, len(self.gates))
+        lap_time = _drive(self.gates, [10, 11, 12, 9, 14])
+        losses = self.analysis.lap_completed(self.gates, lap_time, 3)
+        self.assertEqual(60, losses.optimal_lap_time)
+
+    def test_stretches_of_gates(self):
+        analysis = LapAnalysis(stretch_gates=3)
+        gates = _gates(7)
+        lap_time = _drive(gates, [10, 11, 12, 13, 14, 15, 16, 17])
+        analysis.lap_completed(gates, lap_time, len(gates))
+        # gate-1 is missed, which is inside the first stretch so doesn't matter
+        lap_time = _drive(gates, [9, 13, 12, 12, 14, 14, 17, 17], missed=[1])
+        losses = analysis.lap_completed(gates, lap_time, len(gates))
+        self.assertEqual([33, 40, 33], analysis.best.tolist())
+        self.assertEqual([("gate-2", 1.0), (FINISH, 1.0)], losses.worst)
+        self.assertEqual(106, losses.optimal_lap_time)
+
+    def test_new_gates_start_again(self):
+        lap_time = _drive(self.gates, [10, 11, 12, 13, 14])
+        self.analysis.lap_completed(self.gates, lap_time, len(self.gates))
+        gates = _gates(2)
+        lap_time = _drive(gates, [20, 21, 22])
+        self.assertEqual(63, self.analysis.lap_completed(gates, lap_time, len(gates)).optimal_lap_time)
+
+
+if __name__ == '__main__':
+    unittest.main()
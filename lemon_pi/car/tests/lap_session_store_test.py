@@ -1,33 +1,44 @@
+import json
+import math
 import os
+import pickle
+import shutil
+import tempfile
 import unittest
+from threading import current_thread
+from unittest.mock import patch
+
+import numpy as np
 
 from lemon_pi.car.gate import Gates, Gate
-from lemon_pi.car.lap_session_store import LapSessionStore
+from lemon_pi.car.gate_stats import FROM_START
+from lemon_pi.car.lap_session_store import LapSessionStore, SessionInfo, SessionWriter, CATALOGUE_FILE
+from lemon_pi.car.projection import LocalProjection
+from lemon_pi.car.session_format import write_session, read_session
 from lemon_pi.car.target import Target
-from lemon_pi.car.track import TrackLocation
+from lemon_pi.car.track import TrackLocation, START_FINISH
 
 
 class LapSessionStoreTest(unittest.TestCase):
 
-    @classmethod
-    def tearDownClass(cls) -> None:
-        for file in os.listdir("/tmp/test-lss/code"):
-            os.remove(os.path.join("/tmp/test-lss/code", file))
-        os.rmdir("/tmp/test-lss/code")
-        os.rmdir("/tmp/test-lss")
+    def setUp(self) -> None:
+        self.dir = tempfile.mkdtemp()
+        self.code_dir = os.path.join(self.dir, 'code')
+
+    def tearDown(self) -> None:
         LapSessionStore.destroy()
+        shutil.rmtree(self.dir)
 
     def test_initialization(self):
         track = TrackLocation('name', 'code')
-        LapSessionStore.init(track, dir='/tmp/test-lss')
-        self.assertTrue(os.path.isdir('/tmp/test-lss/code'))
+        LapSessionStore.init(track, dir=self.dir)
+        self.assertTrue(os.path.isdir(self.code_dir))
         self.assertIsNotNone(LapSessionStore.get_instance())
         # test initialization with files there
-        LapSessionStore.init(track, dir='/tmp/test-lss')
+        LapSessionStore.init(track, dir=self.dir)
 
-    def test_write_gate_date(self):
-        track = TrackLocation('name', 'code')
-        LapSessionStore.init(track, dir='/tmp/test-lss')
+    @staticmethod
+    def _gates() -> Gates:
         gates = Gates(Target("goofy", (30, -50), (31, -80), "NW"))
         vgate = Gate(30, -45, 10, "gate-1")
         vgate.record_time_from_start(1.4)
@@ -35,7 +46,247 @@ class LapSessionStoreTest(unittest.TestCase):
         vgate.record_time_from_start(1.1)
         vgate.record_time_from_start(0.9)
         gates.append(vgate)
+        return gates
+
+    def test_write_gate_date(self):
+        track = TrackLocation('name', 'code')
+        LapSessionStore.init(track, dir=self.dir)
+        gates = self._gates()
         LapSessionStore.get_instance().save_session(gates)
         saved_gates = LapSessionStore.get_instance().load_sessions()
         self.assertEqual(1, len(saved_gates))
         self.assertEqual(4, saved_gates[0].lap_count())
+
+    def test_catalogue(self):
+        track = TrackLocation('name', 'code')
+        LapSessionStore.init(track, dir=self.dir)
+        gates = self._gates()
+        LapSessionStore.get_instance().save_session(gates)
+        LapSessionStore.get_instance().flush()
+        self.assertTrue(os.path.isfile(os.path.join(self.code_dir, CATALOGUE_FILE)))
+
+        # a new store reads the catalogue rather than the sessions
+        LapSessionStore.init(track, dir=self.dir)
+        catalogue = LapSessionStore.get_instance().get_catalogue()
+        self.assertEqual(1, len(catalogue))
+        info = catalogue[0]
+        self.assertEqual(gates.get_distance_feet(), info.distance_feet)
+        self.assertEqual(4, info.lap_count)
+        self.assertEqual(1, info.gate_count)
+        self.assertEqual([[30, -45]], info.fingerprint)
+        self.assertEqual(4, LapSessionStore.get_instance().load_session(info).lap_count())
+
+    def test_catalogue_is_rebuilt(self):
+        track = TrackLocation('name', 'code')
+        LapSessionStore.init(track, dir=self.dir)
+        LapSessionStore.get_instance().save_session(self._gates())
+        LapSessionStore.get_instance().flush()
+        os.remove(os.path.join(self.code_dir, CATALOGUE_FILE))
+
+        LapSessionStore.init(track, dir=self.dir)
+        self.assertEqual(1, len(LapSessionStore.get_instance().get_catalogue()))
+        self.assertTrue(os.path.isfile(os.path.join(self.code_dir, CATALOGUE_FILE)))
+
+    def test_saving_reads_the_catalogue_on_the_writer(self):
+        directory = tempfile.mkdtemp()
+        try:
+            store = LapSessionStore(TrackLocation('name', 'code'), directory)
+            gates = self._gates()
+            read_on = []
+            read_catalogue = store._read_catalogue
+
+            def record_thread():
+                read_on.append(current_thread())
+                return read_catalogue()
+            with patch.object(store, "_read_catalogue", side_effect=record_thread), \
+                    patch.object(Gates, "get_distance_feet", autospec=True,
+                                 side_effect=Gates.get_distance_feet) as distance:
+                store.save_session(gates)
+                store.flush()
+            self.assertEqual([store.writer.thread], read_on)
+            self.assertEqual(1, distance.call_count)
+            self.assertEqual(1, len(store.get_catalogue()))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_fingerprint_fits(self):
+        projection = LocalProjection(30, -45)
+        info = SessionInfo("x", 1000, 0, 4, 2, [[30, -45], [30.001, -45]])
+        trace = np.array([(0, y) for y in range(0, 150, 10)], dtype=float)
+        self.assertTrue(info.fits(trace, projection))
+        self.assertFalse(info.fits(trace + (100, 0), projection))
+        self.assertFalse(info.fits(trace[:3], projection))
+
+    def test_old_format_is_kept(self):
+        track = TrackLocation('name', 'code')
+        LapSessionStore.init(track, dir=self.dir)
+        gates = self._gates()
+        legacy = f"{gates.get_distance_feet()}-v1.dat"
+        with open(os.path.join(self.code_dir, legacy), "wb") as f:
+            pickle.dump(gates, f)
+        self.assertIn(legacy, [info.file for info in LapSessionStore.get_instance().get_catalogue()])
+
+        # it's left for consolidation to fold in, if it's the same layout
+        gates.timestamp += 60
+        LapSessionStore.get_instance().save_session(gates)
+        LapSessionStore.get_instance().flush()
+        saved = f"{gates.get_distance_feet()}-{int(gates.timestamp)}-v2.session"
+        self.assertEqual([saved, legacy], [info.file for info in LapSessionStore.get_instance().get_catalogue()])
+
+    def test_same_distance_is_not_overwritten(self):
+        track = TrackLocation('name', 'code')
+        LapSessionStore.init(track, dir=self.dir)
+        first = self._gates()
+        second = self._gates()
+        second.timestamp = first.timestamp + 3600
+        LapSessionStore.get_instance().save_session(first)
+        LapSessionStore.get_instance().save_session(second)
+        LapSessionStore.get_instance().flush()
+        LapSessionStore.init(track, dir=self.dir)
+        self.assertEqual([second.timestamp, first.timestamp],
+                         [info.timestamp for info in LapSessionStore.get_instance().get_catalogue()])
+
+    def test_damaged_files_are_skipped(self):
+        directory = tempfile.mkdtemp()
+        try:
+            track = TrackLocation('name', 'damaged')
+            os.mkdir(os.path.join(directory, 'damaged'))
+            gates = self._gates()
+            write_session(gates, os.path.join(directory, 'damaged', '1000-v2.session'))
+            with open(os.path.join(directory, 'damaged', '1000-v2.session'), "rb") as f:
+                data = f.read()
+            # an empty file, one cut short, and an old pickle cut short
+            open(os.path.join(directory, 'damaged', '2000-v2.session'), "wb").close()
+            with open(os.path.join(directory, 'damaged', '3000-v2.session'), "wb") as f:
+                f.write(data[:len(data) - 100])
+            with open(os.path.join(directory, 'damaged', '4000-v1.dat'), "wb") as f:
+                f.write(pickle.dumps(gates)[:50])
+            LapSessionStore.init(track, dir=directory)
+            self.assertEqual(["1000-v2.session"],
+                             [info.file for info in LapSessionStore.get_instance().get_catalogue()])
+            self.assertEqual(1, len(LapSessionStore.get_instance().load_sessions()))
+        finally:
+            LapSessionStore.destroy()
+            shutil.rmtree(directory)
+
+
+class SessionWriterTest(unittest.TestCase):
+
+    def test_write(self):
+        directory = tempfile.mkdtemp()
+        writer = SessionWriter()
+        writer.submit([(os.path.join(directory, "a"), b"1"), (os.path.join(directory, "b"), b"2")])
+        writer.submit([(os.path.join(directory, "a"), b"3")], remove=[os.path.join(directory, "b")])
+        writer.wait()
+        self.assertEqual(0, writer.queue_depth())
+        self.assertEqual(2, writer.writes)
+        self.assertTrue(writer.max_write_ms >= writer.last_write_ms > 0)
+        # nothing left behind but the finished file
+        self.assertEqual(["a"], os.listdir(directory))
+        with open(os.path.join(directory, "a"), "rb") as f:
+            self.assertEqual(b"3", f.read())
+        os.remove(os.path.join(directory, "a"))
+        os.rmdir(directory)
+
+    def test_failure(self):
+        writer = SessionWriter()
+        writer.submit([("/tmp/test-lss-missing/dir/a", b"1")])
+        writer.wait()
+        self.assertEqual(0, writer.writes)
+        self.assertEqual(1, writer.failures)
+
+
+def _circuit(projection: LocalProjection, timestamp: float, offset: float, lap_time: float, laps: int,
+             clockwise=True) -> Gates:
+    # a round track 600m across, starting at the top, with a gate every 10 degrees
+    radius = 300
+    direction = 1 if clockwise else -1
+    start_finish = Target("sf", projection.to_lat_long(0, radius - 20), projection.to_lat_long(0, radius + 20),
+                          target_heading=90 if clockwise else 270)
+    gates = Gates(start_finish)
+    gates.timestamp = timestamp
+    previous = None
+    angles = np.arange(offset + 10, 355, 10)
+    for i, angle in enumerate(angles):
+        theta = math.radians(angle * direction)
+        lat, long = projection.to_lat_long(radius * math.sin(theta), radius * math.cos(theta))
+        previous = Gate(lat, long, (90 + angle if clockwise else 270 - angle) % 360, f"gate-{i}", previous)
+        gates.append(previous)
+    for _ in range(laps):
+        for gate, angle in zip(gates, angles):
+            gate.record_time_from_start(lap_time * angle / 360)
+        gates.record_lap_time(lap_time)
+    return gates
+
+
+class ConsolidateTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.dir = tempfile.mkdtemp()
+        self.track = TrackLocation('name', 'code')
+        self.projection = LocalProjection(30, -45)
+        self.track.add_target(START_FINISH, Target("sf", self.projection.to_lat_long(0, 280),
+                                                   self.projection.to_lat_long(0, 320), target_heading=90))
+        self.store = LapSessionStore(self.track, self.dir)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.dir)
+
+    def _write(self, filename: str, gates: Gates):
+        write_session(gates, os.path.join(self.store.basedir, filename))
+
+    def _consolidate(self) -> [SessionInfo]:
+        self.store.consolidate()
+        self.store.flush()
+        return LapSessionStore(self.track, self.dir).get_catalogue()
+
+    def test_same_layout_is_merged(self):
+        self._write("6200-v2.session", _circuit(self.projection, 2000, 0, 60, 5))
+        self._write("6210-v2.session", _circuit(self.projection, 1000, 4, 80, 6))
+        catalogue = self._consolidate()
+        self.assertEqual(1, len(catalogue))
+        self.assertEqual(2000, catalogue[0].timestamp)
+        self.assertEqual(11, catalogue[0].lap_count)
+        self.assertEqual([catalogue[0].file, CATALOGUE_FILE], sorted(os.listdir(self.store.basedir)))
+        # the newer gates are kept, and the older session's times are added to them
+        gates = read_session(os.path.join(self.store.basedir, catalogue[0].file))
+        self.assertEqual(35, len(gates))
+        gate = gates[17]
+        self.assertAlmostEqual(30, gate.stats.time_at(FROM_START, gate.row, 0))
+        self.assertAlmostEqual(40, gate.stats.time_at(FROM_START, gate.row, 1), places=2)
+        # and running it again leaves it alone
+        self.assertEqual(11, self._consolidate()[0].lap_count)
+
+    def test_old_format_is_folded_in(self):
+        with open(os.path.join(self.store.basedir, "6210-v1.dat"), "wb") as f:
+            pickle.dump(_circuit(self.projection, 1000, 4, 80, 6), f)
+        self.store.save_session(_circuit(self.projection, 2000, 0, 60, 5))
+        catalogue = self._consolidate()
+        self.assertEqual(1, len(catalogue))
+        self.assertEqual(11, catalogue[0].lap_count)
+        self.assertEqual([catalogue[0].file, CATALOGUE_FILE], sorted(os.listdir(self.store.basedir)))
+
+    def test_saved_while_consolidating(self):
+        self._write("6200-v2.session", _circuit(self.projection, 2000, 0, 60, 5))
+        self._write("6210-v2.session", _circuit(self.projection, 1000, 4, 80, 6))
+        self.store.consolidate()
+        self.store.save_session(_circuit(self.projection, 3000, 0, 60, 5, clockwise=False))
+        self.store.flush()
+        # neither the merge nor the save is lost from the catalogue
+        with open(os.path.join(self.store.basedir, CATALOGUE_FILE)) as f:
+            sessions = json.load(f)["sessions"]
+        self.assertEqual([(3000, 5), (2000, 11)],
+                         sorted([(info["timestamp"], info["lap_count"]) for info in sessions], reverse=True))
+        self.assertEqual(3, len(os.listdir(self.store.basedir)))
+
+    def test_other_direction_is_kept(self):
+        self._write("6200-v2.session", _circuit(self.projection, 2000, 0, 60, 5))
+        self._write("6210-v2.session", _circuit(self.projection, 1000, 0, 60, 5, clockwise=False))
+        self.assertEqual(2, len(self._consolidate()))
+
+    def test_oldest_are_evicted_over_budget(self):
+        self._write("6200-v2.session", _circuit(self.projection, 3000, 0, 60, 5))
+        self._write("6210-v2.session", _circuit(self.projection, 2000, 0, 60, 5, clockwise=False))
+        with patch("lemon_pi.car.lap_session_store.TRACK_BUDGET_BYTES", 1):
+            catalogue = self._consolidate()
+        self.assertEqual(["6200-v2.session"], [info.file for info in catalogue])
@@ -3,11 +3,13 @@ import unittest
 from unittest.mock import patch
 import time
 
+from lemon_pi.car.crossing_detector import Crossing
 from lemon_pi.car.event_defs import ResetFastLapEvent
 from lemon_pi.car.lap_tracker import LapTracker
 from lemon_pi.car.geometry import angular_difference
 from lemon_pi.car.target import Target
-from lemon_pi.car.track import TrackLocation
+from lemon_pi.car.track import TrackLocation, TargetMetaData, Sector, START_FINISH
+from lemon_pi.shared.clock import SimulatedClock
 
 from python_settings import settings
 import lemon_pi.config.test_settings as my_local_settings
@@ -98,6 +100,16 @@ class TestAngularDifference(unittest.TestCase):
         lt.update_position(45.365398333,-120.744546667, 203, now + 70, 23)
         leave_track_event.assert_called_once()
 
+    @patch("lemon_pi.car.event_defs.RadioSyncEvent.emit")
+    def test_predictor_agrees_on_crossing_time(self, radio_sync_event):
+        bw = TrackLocation("bw", "zoo")
+        bw.set_start_finish_target(Target("start_finish", (35.489031, -119.544530), (35.488713, -119.544510), "E"))
+        lt = LapTracker(bw)
+        now = time.time()
+        lt.update_position(35.4888, -119.5446, 90, now + 61, 50)
+        lt.update_position(35.4888, -119.5444, 90, now + 62, 50)
+        self.assertEqual(lt.lap_start_time, lt.predictive_lap_timer.lap_start_time)
+
     def test_resetting_fastest_lap_time(self):
         bw = TrackLocation("bw", "foo")
         sf = Target("start-finish", (35.489031, -119.544530), (35.488713, -119.544510), "E")
@@ -108,6 +120,41 @@ class TestAngularDifference(unittest.TestCase):
         ResetFastLapEvent.emit()
         self.assertEqual(None, lt.best_lap_time)
 
+    def test_lap_timer_uses_clock(self):
+        bw = TrackLocation("bw", "foo")
+        sf = Target("start-finish", (35.489031, -119.544530), (35.488713, -119.544510), "E")
+        bw.set_start_finish_target(sf)
+        clock = SimulatedClock(1000.0)
+        lt = LapTracker(bw, clock=clock)
+        clock.advance(75.5)
+        self.assertEqual(75, lt.get_lap_timer())
+
+    def test_lap_log_line(self):
+        bw = TrackLocation("bw", "foo")
+        sf = Target("start-finish", (35.489031, -119.544530), (35.488713, -119.544510), "E")
+        bw.set_start_finish_target(sf)
+        lt = LapTracker(bw)
+        lt.lap_count = 3
+        lt.last_lap_time = 61.24
+        self.assertEqual("3,61.2", lt._lap_log_line())
+
+    def test_lap_log_line_with_sectors(self):
+        bw = TrackLocation("bw", "foo")
+        sf = Target("start-finish", (35.489031, -119.544530), (35.488713, -119.544510), "E")
+        bw.set_start_finish_target(sf)
+        s1 = TargetMetaData("sector_S1", "sector_S1", None, None)
+        s1_target = Target("S1", (35.49, -119.55), (35.4897, -119.55))
+        bw.add_target(s1, s1_target)
+        bw.sectors = [Sector("S1", 1, s1), Sector("S2", 2)]
+        lt = LapTracker(bw)
+        lt.lap_count = 3
+        lt.last_lap_time = 61.0
+        lt.sector_timer.on_crossing(Crossing(START_FINISH, sf, 100, False))
+        lt.sector_timer.on_crossing(Crossing(s1, s1_target, 130.5, False))
+        self.assertEqual("3,61.0,", lt._lap_log_line())
+        lt.sector_timer.on_crossing(Crossing(START_FINISH, sf, 161, False))
+        self.assertEqual("3,61.0,61.00,30.50,30.50", lt._lap_log_line())
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+
+from lemon_pi.car.event_defs import SetTargetTimeEvent
+from lemon_pi.car.live_delta import ReferenceLap, LiveDelta
+
+
+def _drive_lap(live_delta: LiveDelta, lap_time: float, length=1000.0, fixes=100):
+    # a lap at constant speed, one fix every lap_time / fixes seconds
+    for i in range(1, fixes):
+        live_delta.update(length * i / fixes, lap_time * i / fixes, length)
+
+
+class ReferenceLapTest(unittest.TestCase):
+
+    def test_time_at(self):
+        reference = ReferenceLap.from_trace([250, 500, 750], [10, 30, 40], 1000, 60)
+        self.assertEqual(60, reference.lap_time)
+        self.assertAlmostEqual(0, reference.time_at(0))
+        self.assertAlmostEqual(20, reference.time_at(375), places=4)
+        self.assertAlmostEqual(50, reference.time_at(875), places=4)
+        self.assertAlmostEqual(60, reference.time_at(1000))
+        # off either end of the lap
+        self.assertAlmostEqual(0, reference.time_at(-5))
+        self.assertAlmostEqual(60, reference.time_at(1010))
+
+    def test_distance_going_backwards_is_ignored(self):
+        reference = ReferenceLap.from_trace([250, 240, 500], [10, 11, 20], 1000, 60)
+        self.assertAlmostEqual(10, reference.time_at(250), places=4)
+
+    def test_scaled_to(self):
+        reference = ReferenceLap.from_trace([500], [30], 1000, 60).scaled_to(120)
+        self.assertEqual(120, reference.lap_time)
+        self.assertAlmostEqual(60, reference.time_at(500), places=4)
+
+
+class LiveDeltaTest(unittest.TestCase):
+
+    def test_no_delta_until_there_is_a_best_lap(self):
+        live_delta = LiveDelta()
+        _drive_lap(live_delta, 100)
+        self.assertIsNone(live_delta.get_delta())
+        live_delta.complete_lap(100, True)
+        self.assertIsNone(live_delta.get_delta())
+        # the best lap got half way round in 50s
+        self.assertAlmostEqual(5, live_delta.update(500, 55, 1000), places=3)
+        self.assertAlmostEqual(-5, live_delta.update(600, 55, 1000), places=3)
+
+    def test_only_best_laps_become_the_reference(self):
+        live_delta = LiveDelta()
+        _drive_lap(live_delta, 100)
+        live_delta.complete_lap(100, True)
+        _drive_lap(live_delta, 110)
+        live_delta.complete_lap(110, False)
+        self.assertAlmostEqual(0, live_delta.update(500, 50, 1000), places=3)
+
+    def test_partly_tracked_lap_is_not_used(self):
+        live_delta = LiveDelta()
+        _drive_lap(live_delta, 100, fixes=100)
+        live_delta.complete_lap(100, True)
+        for i in range(1, 50):
+            live_delta.update(10 * i, i, 1000)
+        live_delta.complete_lap(90, True)
+        self.assertAlmostEqual(0, live_delta.update(500, 50, 1000), places=3)
+
+    def test_target_time(self):
+        live_delta = LiveDelta()
+        _drive_lap(live_delta, 100)
+        live_delta.complete_lap(100, True)
+        live_delta.handle_event(SetTargetTimeEvent, target=120)
+        self.assertAlmostEqual(-5, live_delta.update(500, 55, 1000), places=3)
+        # clearing the target goes back to the best lap
+        live_delta.handle_event(SetTargetTimeEvent, target=0)
+        self.assertAlmostEqual(5, live_delta.update(500, 55, 1000), places=3)
+
+    def test_reset_best(self):
+        live_delta = LiveDelta()
+        _drive_lap(live_delta, 100)
+        live_delta.complete_lap(100, True)
+        live_delta.reset_best()
+        self.assertIsNone(live_delta.update(500, 55, 1000))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+from unittest.mock import Mock
+
+from lemon_pi.car.event_defs import MovingEvent, NotMovingEvent, CarStoppedEvent
+from lemon_pi.car.movement_detector import MovementDetector
+from lemon_pi.car.projection import LocalProjection, FEET_PER_METRE
+from lemon_pi.shared.clock import Clock, SimulatedClock
+
+START = 1000.0
+
+
+class MovementDetectorTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.clock = SimulatedClock(START)
+        Clock.set_instance(self.clock)
+        for event in [MovingEvent, NotMovingEvent, CarStoppedEvent]:
+            event.last_event_time = 0
+        self.moving = Mock()
+        self.not_moving = Mock()
+        self.stopped = Mock()
+        MovingEvent.register_handler(self, self.moving)
+        NotMovingEvent.register_handler(self, self.not_moving)
+        CarStoppedEvent.register_handler(self, self.stopped)
+        self.projection = LocalProjection(38.16, -122.45)
+        self.detector = MovementDetector()
+        self.t = START
+        self.y = 0.0
+
+    def tearDown(self) -> None:
+        for event in [MovingEvent, NotMovingEvent, CarStoppedEvent]:
+            event.handlers = [s for s in event.handlers if s.handler is not self]
+        Clock.reset()
+
+    # a fix a second for the given number of seconds, heading north at the given speed
+    def _drive(self, speed: int, secs: int, wander_feet: float = 0.0):
+        for i in range(secs):
+            self.t += 1
+            self.clock.set_time(self.t)
+            self.y += speed * 0.447
+            # still cars wander back and forth a little
+            x = (wander_feet / FEET_PER_METRE) * (i % 2)
+            lat, long = self.projection.to_lat_long(x, self.y)
+            self.detector.update(lat, long, speed, self.t)
+
+    def test_parked(self):
+        self._drive(0, 60, wander_feet=10)
+        self.moving.assert_not_called()
+        self.not_moving.assert_not_called()
+        self.stopped.assert_called_once()
+
+    def test_one_fast_fix_is_not_moving(self):
+        self._drive(0, 5)
+        self._drive(40, 1)
+        self._drive(0, 20)
+        self.moving.assert_not_called()
+        self.stopped.assert_called_once()
+
+    def test_setting_off(self):
+        self._drive(0, 20)
+        self._drive(30, 60)
+        self.moving.assert_called_once()
+        self.assertEqual(30, self.moving.call_args.args[0].speed)
+        self.not_moving.assert_not_called()
+
+    def test_stopping(self):
+        self._drive(30, 60)
+        self.stopped.reset_mock()
+        self._drive(0, 2)
+        self.not_moving.assert_not_called()
+        self._drive(0, 3)
+        self.not_moving.assert_called_once()
+        self.stopped.assert_not_called()
+        self._drive(0, 10)
+        self.stopped.assert_called_once()
+        # and off again
+        self._drive(30, 10)
+        self.assertEqual(2, self.moving.call_count)
+
+    def test_crawling_down_the_pit_lane(self):
+        self._drive(30, 60)
+        # as good as stopped, but it never stays in one place long enough to be at a halt
+        self._drive(2, 60)
+        self.not_moving.assert_called_once()
+        self.stopped.assert_not_called()
+
+    def test_pulling_away_after_a_gap(self):
+        self._drive(30, 60)
+        self._drive(0, 5)
+        self.not_moving.assert_called_once()
+        # no fixes for a while, then the first one is already pulling away
+        self.t += 20
+        self._drive(12, 1)
+        self.stopped.assert_not_called()
+
+    def test_fewer_events_than_fixes(self):
+        for _ in range(5):
+            self._drive(60, 100)
+            self._drive(0, 30, wander_feet=5)
+        self.assertEqual(5, self.moving.call_count)
+        self.assertEqual(5, self.not_moving.call_count)
+        self.assertEqual(5, self.stopped.call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
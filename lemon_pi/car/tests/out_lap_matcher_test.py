@@ -0,0 +1,105 @@
+import math
+import unittest
+
+from lemon_pi.car.gate import Gates, Gate
+from lemon_pi.car.out_lap_matcher import OutLapMatcher
+from lemon_pi.car.projection import LocalProjection
+from lemon_pi.car.target import Target
+
+RADIUS = 300
+
+
+def _circuit(projection: LocalProjection, clockwise=True, timestamp=0) -> Gates:
+    # a round track 600m across, starting at the top, with a gate every 10 degrees
+    direction = 1 if clockwise else -1
+    start_finish = Target("sf", projection.to_lat_long(0, RADIUS - 20), projection.to_lat_long(0, RADIUS + 20),
+                          target_heading=90 if clockwise else 270)
+    start_finish.set_projection(projection)
+    gates = Gates(start_finish)
+    gates.timestamp = timestamp
+    previous = None
+    for i, angle in enumerate(range(10, 360, 10)):
+        theta = math.radians(angle * direction)
+        lat, long = projection.to_lat_long(RADIUS * math.sin(theta), RADIUS * math.cos(theta))
+        previous = Gate(lat, long, (90 + angle if clockwise else 270 - angle) % 360, f"gate-{i}", previous,
+                        projection=projection)
+        gates.append(previous)
+    return gates
+
+
+# drive clockwise round the circuit from one angle to another, a fix every couple of degrees
+def _drive(matcher: OutLapMatcher, start: float, end: float, radius=RADIUS):
+    angle = start
+    while angle < end:
+        theta = math.radians(angle)
+        matcher.update((radius * math.sin(theta), radius * math.cos(theta)), (90 + angle) % 360)
+        angle += 2
+
+
+class OutLapMatcherTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.projection = LocalProjection(38.16, -122.45)
+        self.circuit = _circuit(self.projection)
+
+    def _matcher(self, *sessions) -> OutLapMatcher:
+        return OutLapMatcher(list(sessions), self.circuit.start_finish.mid_xy)
+
+    def test_joining_part_way_round(self):
+        matcher = self._matcher(self.circuit)
+        _drive(matcher, 125, 360)
+        self.assertIs(self.circuit, matcher.match())
+        self.assertEqual(23, matcher.verifier_set.matched[0])
+
+    def test_too_few_gates(self):
+        matcher = self._matcher(self.circuit)
+        _drive(matcher, 275, 360)
+        self.assertIsNone(matcher.match())
+
+    def test_not_to_the_finish(self):
+        matcher = self._matcher(self.circuit)
+        _drive(matcher, 45, 300)
+        self.assertIsNone(matcher.match())
+
+    def test_pit_lane_then_joining(self):
+        matcher = self._matcher(self.circuit)
+        # down a pit lane alongside the track, too far away to join
+        _drive(matcher, 45, 90, radius=RADIUS - 40)
+        self.assertFalse(matcher.joined[0])
+        _drive(matcher, 96, 360)
+        self.assertIs(self.circuit, matcher.match())
+
+    def test_missed_gate_joins_again(self):
+        matcher = self._matcher(self.circuit)
+        _drive(matcher, 45, 90)
+        # cut across to the other side of the track, missing the gates in between
+        _drive(matcher, 150, 360)
+        self.assertEqual(21, matcher.verifier_set.matched[0])
+        self.assertIs(self.circuit, matcher.match())
+
+    def test_the_other_way_round(self):
+        other_way = _circuit(self.projection, clockwise=False)
+        matcher = self._matcher(other_way, self.circuit)
+        _drive(matcher, 125, 360)
+        self.assertFalse(matcher.joined[0])
+        self.assertIs(self.circuit, matcher.match())
+
+    def test_most_gates_matched(self):
+        newer = _circuit(self.projection, timestamp=1000)
+        # gates at the same places but not so many of them
+        sparse = Gates(newer.start_finish)
+        for gate in list(newer)[::2]:
+            sparse.append(Gate(gate.lat, gate.long, gate.heading, gate.target.name, projection=self.projection))
+        sparse.timestamp = 2000
+        matcher = self._matcher(sparse, newer)
+        _drive(matcher, 45, 360)
+        self.assertIs(newer, matcher.match())
+
+    def test_no_sessions(self):
+        matcher = self._matcher()
+        _drive(matcher, 45, 360)
+        self.assertIsNone(matcher.match())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,15 +1,21 @@
 import bisect
 import logging
+import os
 import re
+import shutil
 import statistics
+import tempfile
 import unittest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 from csv import reader
 
 # csv columns
-from lemon_pi.car.gate import Gates, GateVerifier
-from lemon_pi.car.predictor import LapTimePredictor
+from lemon_pi.car.gate import Gates, Gate, GateVerifier
+from lemon_pi.car.lap_session_store import LapSessionStore
+from lemon_pi.car.predictor import LapTimePredictor, PredictorState
+from lemon_pi.car.session_format import write_session
 from lemon_pi.car.target import Target
+from lemon_pi.car.track import TrackLocation
 
 TIME = 0
 ABS_TIME = 1
@@ -35,63 +41,44 @@ if not settings.configured:
 class PredictorTest(unittest.TestCase):
 
     def test_choosing_track_layout_no_previous(self):
-        sonoma = Target("sonoma", (38.161340, -122.454911), (38.161589, -122.454658), direction="NW")
-        plt = LapTimePredictor(sonoma)
-        plt.gate_verifiers = []
-        orig_gates = Mock()
-        plt.gates = orig_gates
-        plt._determine_gates(1000)
         # no gate update
-        self.assertEqual(orig_gates, plt.gates)
+        self.assertIsNone(LapTimePredictor._choose_gates([], 1000))
 
     def test_choosing_track_too_long(self):
         sonoma = Target("sonoma", (38.161340, -122.454911), (38.161589, -122.454658), direction="NW")
-        plt = LapTimePredictor(sonoma)
         g1 = Gates(Target("foo", (0, 0), (1, 1), "N"))
         gate_array = Gates(sonoma)
         gate_array.append(g1)
         gate_array.get_distance_feet = Mock(return_value=1060)
-        plt.gate_verifiers = [GateVerifier(gate_array)]
-        plt.gate_verifiers[0].is_match = Mock(return_value=True)
-        orig_gates = Mock()
-        plt.gates = orig_gates
-        plt._determine_gates(1000)
+        verifiers = [GateVerifier(gate_array)]
+        verifiers[0].is_match = Mock(return_value=True)
         # no gate update
-        self.assertEqual(orig_gates, plt.gates)
+        self.assertIsNone(LapTimePredictor._choose_gates(verifiers, 1000))
 
     def test_choosing_track_same_length(self):
         sonoma = Target("sonoma", (38.161340, -122.454911), (38.161589, -122.454658), direction="NW")
-        plt = LapTimePredictor(sonoma)
         g1 = Gates(Target("foo", (0, 0), (1, 1), "N"))
         gate_array = Gates(sonoma)
         gate_array.append(g1)
         gate_array.get_distance_feet = Mock(return_value=1040)
-        plt.gate_verifiers = [GateVerifier(gate_array)]
-        plt.gate_verifiers[0].is_match = Mock(return_value=True)
-        orig_gates = Mock()
-        plt.gates = orig_gates
-        plt._determine_gates(1000)
+        verifiers = [GateVerifier(gate_array)]
+        verifiers[0].is_match = Mock(return_value=True)
         # this time we pick the new one
-        self.assertEqual(gate_array, plt.gates)
+        self.assertIs(gate_array, LapTimePredictor._choose_gates(verifiers, 1000))
 
     def test_choosing_track_no_match(self):
         sonoma = Target("sonoma", (38.161340, -122.454911), (38.161589, -122.454658), direction="NW")
-        plt = LapTimePredictor(sonoma)
         g1 = Gates(Target("foo", (0, 0), (1, 1), "N"))
         gate_array = Gates(sonoma)
         gate_array.append(g1)
         gate_array.get_distance_feet = Mock(return_value=1040)
-        plt.gate_verifiers = [GateVerifier(gate_array)]
-        plt.gate_verifiers[0].is_match = Mock(return_value=False)
-        orig_gates = Mock()
-        plt.gates = orig_gates
-        plt._determine_gates(1000)
+        verifiers = [GateVerifier(gate_array)]
+        verifiers[0].is_match = Mock(return_value=False)
         # no gate update
-        self.assertEqual(orig_gates, plt.gates)
+        self.assertIsNone(LapTimePredictor._choose_gates(verifiers, 1000))
 
     def test_choosing_track_most_recent(self):
         sonoma = Target("sonoma", (38.161340, -122.454911), (38.161589, -122.454658), direction="NW")
-        plt = LapTimePredictor(sonoma)
         g1 = Gates(Target("foo", (0, 0), (1, 1), "N"))
         gate_array1 = Gates(sonoma)
         gate_array1.append(g1)
@@ -101,14 +88,90 @@ class PredictorTest(unittest.TestCase):
         gate_array2.append(g1)
         gate_array2.get_distance_feet = Mock(return_value=1040)
         gate_array2.timestamp = 2000
-        plt.gate_verifiers = [GateVerifier(gate_array1), GateVerifier(gate_array2)]
-        plt.gate_verifiers[0].is_match = Mock(return_value=True)
-        plt.gate_verifiers[1].is_match = Mock(return_value=True)
-        orig_gates = Mock()
-        plt.gates = orig_gates
-        plt._determine_gates(1000)
-        # no gate update
-        self.assertEqual(gate_array2, plt.gates)
+        verifiers = [GateVerifier(gate_array1), GateVerifier(gate_array2)]
+        verifiers[0].is_match = Mock(return_value=True)
+        verifiers[1].is_match = Mock(return_value=True)
+        self.assertIs(gate_array2, LapTimePredictor._choose_gates(verifiers, 1000))
+
+    def test_previous_session_used_before_the_first_gate(self):
+        sonoma = Target("sonoma", (38.161340, -122.454911), (38.161589, -122.454658), direction="NW")
+        plt = LapTimePredictor(sonoma)
+        plt.state = PredictorState.WORKING
+        plt.gate_index = 0
+        previous = Gates(sonoma)
+        previous.append(Gate(38.1620, -122.4555, 315, "gate-0", projection=plt.projection))
+        plt.matched_gates = previous
+        plt.update_position(38.16140, -122.45470, 315, 1000)
+        self.assertIs(previous, plt.gates)
+        self.assertIsNone(plt.matched_gates)
+
+    def test_previous_session_waits_for_the_next_lap(self):
+        sonoma = Target("sonoma", (38.161340, -122.454911), (38.161589, -122.454658), direction="NW")
+        plt = LapTimePredictor(sonoma)
+        plt.state = PredictorState.WORKING
+        plt.gate_index = 1
+        current = plt.gates
+        plt.matched_gates = Gates(sonoma)
+        plt.update_position(38.16140, -122.45470, 315, 1000)
+        self.assertIs(current, plt.gates)
+
+    def test_out_lap_matched(self):
+        sonoma = Target("sonoma", (38.161340, -122.454911), (38.161589, -122.454658), direction="NW")
+        plt = LapTimePredictor(sonoma)
+        gates = Gates(sonoma)
+        previous = None
+        for i in range(4):
+            previous = Gate(38.1620 + i / 1000, -122.4555, 315, f"gate-{i}", previous, projection=plt.projection)
+            gates.append(previous)
+        plt.out_lap = Mock()
+        plt.out_lap.match = Mock(return_value=gates)
+        plt.update_position(38.16140, -122.45470, 315, 1000)
+        plt.update_position(38.16153, -122.45487, 315, 1001)
+        # straight into predicting, without a breadcrumb lap
+        self.assertEqual(PredictorState.WORKING, plt.state)
+        self.assertIs(gates, plt.gates)
+        self.assertIsNotNone(plt.centreline)
+        self.assertIsNone(plt.out_lap)
+
+    def test_out_lap_not_matched(self):
+        sonoma = Target("sonoma", (38.161340, -122.454911), (38.161589, -122.454658), direction="NW")
+        plt = LapTimePredictor(sonoma)
+        plt.out_lap = Mock()
+        plt.out_lap.match = Mock(return_value=None)
+        plt.update_position(38.16140, -122.45470, 315, 1000)
+        plt.update_position(38.16153, -122.45487, 315, 1001)
+        self.assertEqual(PredictorState.BREADCRUMB, plt.state)
+
+    def test_out_lap_sessions_read_in_the_background(self):
+        sonoma = Target("sonoma", (38.161340, -122.454911), (38.161589, -122.454658), direction="NW")
+        track = TrackLocation("sonoma", "sonoma")
+        track.set_start_finish_target(sonoma)
+        track_data = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(track_data, "sonoma"))
+            # one session at sonoma, and one somewhere else entirely
+            for name, lat in [("1000-v2.session", 38.1620), ("2000-v2.session", 40.0)]:
+                gates = Gates(sonoma)
+                previous = None
+                for i in range(12):
+                    previous = Gate(lat + i / 1000, -122.4555, 315, f"gate-{i}", previous)
+                    gates.append(previous)
+                write_session(gates, os.path.join(track_data, "sonoma", name))
+            LapSessionStore.init(track, dir=track_data)
+            store = LapSessionStore.get_instance()
+            store.get_catalogue()
+            plt = LapTimePredictor(sonoma)
+            # the gps thread never waits for the sessions
+            with patch.object(store.writer, "wait", side_effect=AssertionError("waited on the writer")):
+                plt.update_position(38.16140, -122.45470, 315, 1000)
+                store.writer.queue.join()
+                self.assertIsNone(plt.out_lap)
+                plt.update_position(38.16145, -122.45475, 315, 1001)
+            self.assertEqual(1, len(plt.out_lap.sessions))
+            self.assertAlmostEqual(38.1620, plt.out_lap.sessions[0][0].lat)
+        finally:
+            LapSessionStore.destroy()
+            shutil.rmtree(track_data)
 
 
 class PredictiveTimerTest(unittest.TestCase):
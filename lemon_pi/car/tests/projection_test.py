@@ -0,0 +1,79 @@
+import unittest
+
+from haversine import haversine, Unit
+
+from lemon_pi.car.gps_geometry import crossed_line, will_cross_line, distance_to_target_feet
+from lemon_pi.car.projection import LocalProjection, distance_feet, heading_between_xy, point_on_heading_xy
+from lemon_pi.car.target import Target
+from lemon_pi.car.track import TrackLocation, PIT_ENTRY
+from lemon_pi.shared.data_provider_interface import GpsPos
+
+
+class ProjectionTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        p = LocalProjection(38.161469, -122.454784)
+        self.assertEqual((0.0, 0.0), p.to_xy(38.161469, -122.454784))
+        lat, long = p.to_lat_long(*p.to_xy(38.1702, -122.4401))
+        self.assertAlmostEqual(38.1702, lat, places=9)
+        self.assertAlmostEqual(-122.4401, long, places=9)
+
+    def test_distances_match_haversine(self):
+        # a couple of kilometres away from the origin the error should be tiny
+        p = LocalProjection(38.161469, -122.454784)
+        for lat_long in [(38.1702, -122.4401), (38.1500, -122.4600), (38.161469, -122.43)]:
+            expected = haversine((38.161469, -122.454784), lat_long, unit=Unit.FEET)
+            actual = distance_feet((0, 0), p.to_xy(*lat_long))
+            self.assertAlmostEqual(expected, actual, delta=expected * 0.001)
+
+    def test_headings(self):
+        self.assertAlmostEqual(0, heading_between_xy((0, 0), (0, 10)))
+        self.assertAlmostEqual(90, heading_between_xy((0, 0), (10, 0)))
+        self.assertAlmostEqual(225, heading_between_xy((0, 0), (-10, -10)))
+        x, y = point_on_heading_xy((0, 0), 90, 100)
+        self.assertAlmostEqual(100, x)
+        self.assertAlmostEqual(0, y)
+
+    def test_track_targets_share_projection(self):
+        track = TrackLocation("bw", "foo")
+        pit = Target("pit-in", (35.489031, -119.546), (35.488713, -119.546), "E")
+        track.set_pit_in_target(pit)
+        track.set_start_finish_target(Target("sf", (35.489031, -119.544530), (35.488713, -119.544510), "E"))
+        self.assertIs(track.projection, track.get_start_finish_target().projection)
+        self.assertIs(track.projection, track.targets[PIT_ENTRY].projection)
+
+    def test_crossing(self):
+        t = Target("start_finish", (35.489031, -119.544530), (35.488713, -119.544510), "E")
+        crossed, cross_time, backwards = crossed_line(GpsPos(35.4888, -119.5446, 90, 50, 61),
+                                                      GpsPos(35.4888, -119.5444, 90, 50, 62), t)
+        self.assertTrue(crossed)
+        self.assertAlmostEqual(61.44, cross_time, places=2)
+        self.assertFalse(backwards)
+        crossed, cross_time, backwards = crossed_line(GpsPos(35.4888, -119.5444, 270, 50, 61),
+                                                      GpsPos(35.4888, -119.5446, 270, 50, 62), t)
+        self.assertTrue(crossed)
+        self.assertTrue(backwards)
+        # not quite there yet
+        crossed, _, _ = crossed_line(GpsPos(35.4888, -119.5448, 90, 50, 61),
+                                     GpsPos(35.4888, -119.5446, 90, 50, 62), t)
+        self.assertFalse(crossed)
+
+    def test_will_cross(self):
+        t = Target("drs", (35.489031, -119.544530), (35.488713, -119.544510), target_heading=-1)
+        crossed, cross_time, _ = will_cross_line(GpsPos(35.4888, -119.5447, 90, 60, 100), t)
+        self.assertTrue(crossed)
+        self.assertTrue(100 < cross_time < 101.8)
+        # the target heading is learnt from the car
+        self.assertEqual(90, t.target_heading)
+        crossed, _, _ = will_cross_line(GpsPos(35.4888, -119.5447, 270, 60, 100), t)
+        self.assertFalse(crossed)
+
+    def test_distance_to_target(self):
+        t = Target("start_finish", (35.489031, -119.544530), (35.488713, -119.544510), "E")
+        pos = GpsPos(35.4888, -119.5446, 90, 50, 61)
+        expected = haversine((pos.lat, pos.long), t.midpoint, unit=Unit.FEET)
+        self.assertAlmostEqual(expected, distance_to_target_feet(pos, t), delta=0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
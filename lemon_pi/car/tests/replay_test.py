@@ -0,0 +1,123 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import Mock
+
+from lemon_pi.car.drs_controller import DrsDataLoader
+from lemon_pi.car.event_defs import CompleteLapEvent, DRSApproachEvent, MovingEvent, NotMovingEvent, CarStoppedEvent
+from lemon_pi.car.lap_session_store import LapSessionStore
+from lemon_pi.car.predictor import PredictorState
+from lemon_pi.car.replay import GpsReplay, ReplayPipeline, find_closest_track
+from lemon_pi.car.track import do_read_tracks
+from lemon_pi.shared.clock import Clock, SimulatedClock
+
+from python_settings import settings
+import lemon_pi.config.test_settings as my_local_settings
+
+if not settings.configured:
+    settings.configure(my_local_settings)
+
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.clock = SimulatedClock()
+        Clock.set_instance(self.clock)
+        self.movements = {}
+        for event in [MovingEvent, NotMovingEvent, CarStoppedEvent]:
+            event.last_event_time = 0
+            self.movements[event] = Mock()
+            event.register_handler(self, self.movements[event])
+
+    def tearDown(self) -> None:
+        for event in [MovingEvent, NotMovingEvent, CarStoppedEvent]:
+            event.handlers = [s for s in event.handlers if s.handler is not self]
+        Clock.reset()
+
+    def test_replay_thunderhill(self):
+        replay = GpsReplay("resources/test/gps-2023-05-27.csv", clock=self.clock)
+        tracks = do_read_tracks("resources/tracks.yaml")
+        track = find_closest_track(tracks, replay)
+        self.assertEqual("thil", track.code)
+
+        loader = DrsDataLoader()
+        loader.read_file("resources/drs_zones.json")
+        pipeline = ReplayPipeline(replay, track, loader.get_drs_activation_zones("thil"))
+        result = pipeline.run()
+
+        self.assertEqual(17598, result.fixes)
+        self.assertTrue(result.fixes_per_second() > 0)
+        self.assertEqual(["pipeline", "predictor", "drs"], [s.name for s in result.stages])
+        self.assertEqual(17598, len(result.stages[0].samples))
+        self.assertTrue(pipeline.recorder.count(CompleteLapEvent) > 30)
+        self.assertTrue(pipeline.recorder.count(DRSApproachEvent) > 0)
+        # most laps round thunderhill are a little under 4 minutes
+        self.assertTrue(len([t for t in result.lap_times() if 210 < t < 230]) > 15)
+        # the centreline from the breadcrumb lap is about as long as the gates say the lap is
+        predictor = pipeline.lap_tracker.predictive_lap_timer
+        gates_length = predictor.gates.get_distance_feet() / 3.28084
+        self.assertAlmostEqual(gates_length, predictor.centreline.length, delta=gates_length * 0.05)
+        self.assertTrue(0 <= predictor.get_lap_distance() <= predictor.centreline.length)
+        # by the end of the day there's a best lap to compare with
+        self.assertIsNotNone(pipeline.lap_tracker.live_delta.best)
+        # the car sets off and stops a handful of times over the day, rather than once a fix
+        self.assertEqual((18, 18, 15), tuple(self.movements[event].call_count
+                                             for event in [MovingEvent, NotMovingEvent, CarStoppedEvent]))
+
+    def test_replay_is_limited(self):
+        replay = GpsReplay("resources/test/gps-2022-03-12.csv", clock=self.clock)
+        track = find_closest_track(do_read_tracks("resources/tracks.yaml"), replay)
+        result = ReplayPipeline(replay, track).run(max_fixes=100)
+        self.assertEqual(100, result.fixes)
+        self.assertEqual(["pipeline", "predictor"], [s.name for s in result.stages])
+        self.assertTrue(replay.is_working())
+        self.assertIsNotNone(replay.get_gps_position())
+        self.assertEqual(replay.get_gps_position().timestamp, self.clock.time())
+
+    def test_restart_part_way_through(self):
+        filename = "resources/test/gps-2023-05-27.csv"
+        track_data = tempfile.mkdtemp()
+        try:
+            replay = GpsReplay(filename, clock=self.clock)
+            track = find_closest_track(do_read_tracks("resources/tracks.yaml"), replay)
+            LapSessionStore.init(track, dir=track_data)
+            before = ReplayPipeline(replay, track)
+            before.run(max_fixes=6000)
+            LapSessionStore.get_instance().flush()
+            self.assertEqual(["checkpoint.session", "journal.bin"],
+                             sorted(os.listdir(os.path.join(track_data, track.code))))
+            # the pi loses power, and starts up again with the gps where it was
+            before.lap_tracker.journal = None
+            LapSessionStore.init(track, dir=track_data)
+            replay = GpsReplay(filename, clock=self.clock)
+            start = time.perf_counter()
+            after = ReplayPipeline(replay, track)
+            self.assertTrue(time.perf_counter() - start < 1)
+
+            lap_tracker = after.lap_tracker
+            self.assertEqual(before.lap_tracker.lap_count, lap_tracker.lap_count)
+            self.assertEqual(before.lap_tracker.best_lap_time, lap_tracker.best_lap_time)
+            self.assertEqual(PredictorState.WORKING, lap_tracker.predictive_lap_timer.state)
+            self.assertIsNotNone(lap_tracker.live_delta.best)
+            self.assertIsNone(lap_tracker.get_predicted_lap_time())
+
+            # the lap in progress isn't timed, the ones after it carry on the count
+            predicted = 0
+            for i, fix in enumerate(replay.read_fixes()):
+                if i >= 6000:
+                    replay.process_fix(*fix)
+                    if lap_tracker.get_predicted_lap_time() is not None:
+                        predicted += 1
+            self.assertTrue(after.recorder.count(CompleteLapEvent) > 30)
+            self.assertEqual(before.lap_tracker.lap_count + after.recorder.count(CompleteLapEvent),
+                             lap_tracker.lap_count)
+            self.assertTrue(predicted > 1000)
+        finally:
+            LapSessionStore.destroy()
+            shutil.rmtree(track_data)
+
+
+if __name__ == '__main__':
+    unittest.main()
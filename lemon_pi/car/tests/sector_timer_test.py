@@ -0,0 +1,134 @@
+import unittest
+from unittest.mock import Mock
+
+from lemon_pi.car.crossing_detector import Crossing
+from lemon_pi.car.event_defs import SectorCompleteEvent, LeaveTrackEvent, ResetFastLapEvent
+from lemon_pi.car.sector_timer import SectorTimer, SectorStats
+from lemon_pi.car.target import Target
+from lemon_pi.car.track import TrackLocation, TargetMetaData, Sector, START_FINISH
+from lemon_pi.shared.events import EventHandler
+
+S1 = TargetMetaData("sector_S1", "sector_S1", None, None)
+S2 = TargetMetaData("sector_S2", "sector_S2", None, None)
+
+
+class SectorRecorder(EventHandler):
+
+    def __init__(self):
+        self.sectors = []
+        SectorCompleteEvent.register_handler(self)
+
+    def handle_event(self, event, **kwargs):
+        self.sectors.append(kwargs)
+
+
+class SectorTimerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.track = TrackLocation("test", "test")
+        self.track.set_start_finish_target(Target("start-finish", (35.489031, -119.544530),
+                                                  (35.488713, -119.544510), "E"))
+        self.track.add_target(S1, Target("S1", (35.49, -119.55), (35.4897, -119.55)))
+        self.track.add_target(S2, Target("S2", (35.49, -119.56), (35.4897, -119.56)))
+        self.track.sectors = [Sector("S1", 1, S1), Sector("S2", 2, S2), Sector("S3", 3)]
+        self.detector = Mock()
+        self.timer = SectorTimer(self.track, self.detector)
+        self.recorder = SectorRecorder()
+
+    def _cross(self, key, t: float, backwards: bool = False):
+        self.timer.on_crossing(Crossing(key, self.track.targets[key], t, backwards))
+
+    def _lap(self, start: float, s1: float, s2: float):
+        self._cross(START_FINISH, start)
+        self._cross(S1, start + s1)
+        self._cross(S2, start + s1 + s2)
+
+    def test_subscribes_for_crossings(self):
+        self.detector.subscribe.assert_called_once_with(self.timer)
+
+    def test_no_sectors(self):
+        detector = Mock()
+        timer = SectorTimer(TrackLocation("plain", "plain"), detector)
+        detector.subscribe.assert_not_called()
+        self.assertIsNone(timer.get_theoretical_best_lap_time())
+
+    def test_sectors_are_timed(self):
+        self._lap(100, 30, 40)
+        self._cross(START_FINISH, 220)
+        self.assertEqual([30, 40, 50], self.timer.last_lap_splits)
+        self.assertEqual([1, 2, 3], [s["sector"] for s in self.recorder.sectors])
+        self.assertEqual(["S1", "S2", "S3"], [s["name"] for s in self.recorder.sectors])
+        self.assertTrue(all(s["is_best"] and s["delta"] is None for s in self.recorder.sectors))
+        self.assertEqual(120, self.timer.get_theoretical_best_lap_time())
+
+    def test_delta_and_theoretical_best(self):
+        self._lap(100, 30, 40)
+        self._lap(220, 31, 38)
+        self._cross(START_FINISH, 341)
+        second_lap = self.recorder.sectors[3:]
+        self.assertEqual([1.0, -2.0, 2.0], [s["delta"] for s in second_lap])
+        self.assertEqual([False, True, False], [s["is_best"] for s in second_lap])
+        self.assertEqual(118, self.timer.get_theoretical_best_lap_time())
+        self.assertEqual([None, None, None], [s["consistency"] for s in self.recorder.sectors[:3]])
+        self.assertAlmostEqual(0.707, second_lap[0]["consistency"], places=3)
+
+    def test_missed_gate_stops_the_lap(self):
+        self._cross(START_FINISH, 100)
+        self._cross(S2, 170)
+        self.assertEqual([], self.recorder.sectors)
+        self._cross(START_FINISH, 220)
+        self.assertIsNone(self.timer.last_lap_splits)
+        self._lap(220, 30, 40)
+        self.assertEqual(2, len(self.recorder.sectors))
+
+    def test_gate_crossed_again_is_ignored(self):
+        self._cross(START_FINISH, 100)
+        self._cross(S1, 130)
+        self._cross(S1, 131)
+        self._cross(S2, 170)
+        self.assertEqual([30, 40], [s["time"] for s in self.recorder.sectors])
+
+    def test_start_finish_bounce_is_ignored(self):
+        self._cross(START_FINISH, 100)
+        self._cross(START_FINISH, 101)
+        self._cross(S1, 130)
+        self.assertEqual(30, self.recorder.sectors[0]["time"])
+
+    def test_backwards_crossing_stops_the_lap(self):
+        self._cross(START_FINISH, 100)
+        self._cross(S1, 130)
+        # turned round and went back over the first sector's gate
+        self._cross(S1, 150, backwards=True)
+        self._cross(S2, 170)
+        self._cross(START_FINISH, 220)
+        self.assertEqual(1, len(self.recorder.sectors))
+        self.assertIsNone(self.timer.last_lap_splits)
+
+    def test_leaving_the_track(self):
+        self._cross(START_FINISH, 100)
+        self._cross(S1, 130)
+        self.timer.handle_event(LeaveTrackEvent)
+        self._cross(S2, 170)
+        self._cross(START_FINISH, 220)
+        self.assertEqual(1, len(self.recorder.sectors))
+        self.assertIsNone(self.timer.last_lap_splits)
+
+    def test_reset_fast_lap(self):
+        self._lap(100, 30, 40)
+        self._cross(START_FINISH, 220)
+        self.timer.handle_event(ResetFastLapEvent)
+        self.assertIsNone(self.timer.get_theoretical_best_lap_time())
+        self.assertEqual(30, self.timer.sectors[0].last)
+
+    def test_consistency(self):
+        stats = SectorStats(Sector("S1", 1))
+        self.assertIsNone(stats.consistency())
+        for t in [100, 10, 20, 30, 40, 50]:
+            stats.add(t)
+        # the first time has dropped out of the window
+        self.assertAlmostEqual(15.811, stats.consistency(), places=3)
+        self.assertEqual(10, stats.best)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import pickle
+import tempfile
+import unittest
+
+import numpy as np
+
+from lemon_pi.car.gate import Gates, Gate
+from lemon_pi.car.gate_stats import FROM_START, FROM_PREV
+from lemon_pi.car.session_format import write_session, read_session, read_header, migrate_directory, \
+    SessionFormatError, MAGIC
+from lemon_pi.car.target import Target
+
+
+def _gates() -> Gates:
+    gates = Gates(Target("sf", (30, -50), (31, -80), "NW"))
+    previous = None
+    for i in range(5):
+        previous = Gate(30 + i / 1000, -45, 10, f"gate-{i}", previous)
+        gates.append(previous)
+    for lap in range(6):
+        for i, gate in enumerate(gates):
+            gate.record_time_from_start(10 * (i + 1) + lap)
+        gates.record_lap_time(60 + lap)
+    return gates
+
+
+class SessionFormatTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        for file in os.listdir(self.dir):
+            os.remove(os.path.join(self.dir, file))
+        os.rmdir(self.dir)
+
+    def test_round_trip(self):
+        gates = _gates()
+        path = os.path.join(self.dir, "x.session")
+        write_session(gates, path)
+        loaded = read_session(path)
+        self.assertEqual(5, len(loaded))
+        self.assertEqual(6, loaded.lap_count())
+        self.assertEqual(gates.timestamp, loaded.timestamp)
+        self.assertEqual(gates.start_finish.lat_long1, loaded.start_finish.lat_long1)
+        self.assertEqual(["gate-0", "gate-1", "gate-2", "gate-3", "gate-4"], [g.target.name for g in loaded])
+        self.assertIsNone(loaded[0].previous)
+        self.assertIs(loaded[0], loaded[1].previous)
+        for gate, loaded_gate in zip(gates, loaded):
+            self.assertEqual((gate.lat, gate.long, gate.heading),
+                             (loaded_gate.lat, loaded_gate.long, loaded_gate.heading))
+            np.testing.assert_array_equal(gate.times_from_start, loaded_gate.times_from_start)
+            np.testing.assert_array_equal(gate.times_to_finish, loaded_gate.times_to_finish)
+        # the loaded samples can be added to
+        loaded[1].record_time_from_start(25)
+        self.assertEqual(7, loaded.stats.sample_count(FROM_START, 1))
+        self.assertEqual(7, loaded.stats.sample_count(FROM_PREV, 1))
+
+    def test_header(self):
+        path = os.path.join(self.dir, "x.session")
+        write_session(_gates(), path)
+        header = read_header(path)
+        self.assertEqual(6, header["lap_count"])
+        self.assertEqual(_gates().get_distance_feet(), header["distance_feet"])
+
+    def test_not_a_session(self):
+        path = os.path.join(self.dir, "x.session")
+        with open(path, "wb") as f:
+            pickle.dump(_gates(), f)
+        self.assertRaises(SessionFormatError, read_session, path)
+        with open(path, "wb") as f:
+            f.write(MAGIC + b"\xff\xff\x00\x00\x00\x00")
+        self.assertRaises(SessionFormatError, read_session, path)
+
+    def test_damaged(self):
+        path = os.path.join(self.dir, "x.session")
+        write_session(_gates(), path)
+        with open(path, "rb") as f:
+            data = f.read()
+        # empty, cut off in the header, and cut off in the arrays
+        for length in [0, 20, len(data) - 100]:
+            with open(path, "wb") as f:
+                f.write(data[:length])
+            self.assertRaises(SessionFormatError, read_session, path)
+        with open(path, "wb") as f:
+            f.write(data[:20])
+        self.assertRaises(SessionFormatError, read_header, path)
+
+    def test_migrate(self):
+        with open(os.path.join(self.dir, "1234-v1.dat"), "wb") as f:
+            pickle.dump(_gates(), f)
+        written = migrate_directory(self.dir)
+        self.assertEqual([os.path.join(self.dir, "1234-v2.session")], written)
+        self.assertEqual(["1234-v2.session"], os.listdir(self.dir))
+        self.assertEqual(6, read_session(written[0]).lap_count())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from lemon_pi.car.gate import Gates, Gate
+from lemon_pi.car.lap_session_store import SessionWriter
+from lemon_pi.car.session_format import PREAMBLE
+from lemon_pi.car.session_journal import SessionJournal, GATE, MISSED, FINISH, LAP, REFERENCE, JOURNAL_FILE, \
+    RESTORE_WITHIN_SECONDS, CHECKPOINT_FILE
+from lemon_pi.car.target import Target
+from lemon_pi.shared.clock import SimulatedClock
+
+
+def _gates() -> Gates:
+    gates = Gates(Target("sf", (30, -50), (31, -80), "NW"))
+    previous = None
+    for i in range(3):
+        previous = Gate(30 + i / 1000, -45, 10, f"gate-{i}", previous)
+        gates.append(previous)
+    return gates
+
+
+class SessionJournalTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.dir = tempfile.mkdtemp()
+        self.clock = SimulatedClock(1000000)
+        self.writer = SessionWriter()
+
+    def tearDown(self) -> None:
+        self.writer.wait()
+        for file in os.listdir(self.dir):
+            os.remove(os.path.join(self.dir, file))
+        os.rmdir(self.dir)
+
+    def _journal(self) -> SessionJournal:
+        return SessionJournal(self.dir, self.writer, self.clock)
+
+    def _write_lap(self, journal: SessionJournal):
+        journal.gate_crossed(0, 10.0)
+        journal.gate_missed(1)
+        journal.gate_crossed(2, 30.5)
+        journal.lap_finished(60.25)
+        journal.lap_completed(4, 2, 60.25, None)
+        journal.best_reference(np.array([1.5, 2.5, 3.5]), 1000.0, 5.0)
+        journal.commit()
+
+    def test_nothing_is_journalled_before_a_checkpoint(self):
+        journal = self._journal()
+        self._write_lap(journal)
+        self.writer.wait()
+        self.assertEqual([], os.listdir(self.dir))
+        self.assertIsNone(self._journal().recover())
+
+    def test_recover(self):
+        journal = self._journal()
+        journal.checkpoint(_gates(), {"lap_count": 3, "stint_lap_count": 1, "last_lap_time": 61.0,
+                                      "best_lap_time": 59.0, "on_track": True})
+        self._write_lap(journal)
+        self.clock.advance(5)
+        recovery = self._journal().recover()
+        self.assertIsNotNone(recovery)
+        self.assertEqual(3, len(recovery.gates))
+        self.assertEqual([GATE, MISSED, GATE, FINISH, LAP, REFERENCE], [r[0] for r in recovery.records])
+        self.assertEqual((2, 30.5), recovery.records[2][1])
+        self.assertEqual({"lap_count": 4, "stint_lap_count": 2, "last_lap_time": 60.25,
+                          "best_lap_time": None, "on_track": True}, recovery.lap_state())
+        times, length, spacing = recovery.reference()
+        np.testing.assert_array_equal(np.array([1.5, 2.5, 3.5], dtype=np.float32), times)
+        self.assertEqual((1000.0, 5.0), (length, spacing))
+
+    def test_half_written_record_is_ignored(self):
+        journal = self._journal()
+        journal.checkpoint(_gates(), {"lap_count": 3})
+        self._write_lap(journal)
+        journal.gate_crossed(0, 11.0)
+        journal.commit()
+        self.writer.wait()
+        path = os.path.join(self.dir, JOURNAL_FILE)
+        with open(path, "rb") as f:
+            data = f.read()
+        with open(path, "wb") as f:
+            f.write(data[:-3])
+        recovery = self._journal().recover()
+        self.assertEqual(6, len(recovery.records))
+        self.assertEqual(4, recovery.lap_state()["lap_count"])
+
+    def test_journal_from_another_checkpoint(self):
+        journal = self._journal()
+        journal.checkpoint(_gates(), {"lap_count": 3})
+        self.writer.wait()
+        with open(os.path.join(self.dir, JOURNAL_FILE), "rb") as f:
+            old_journal = f.read()
+        journal.checkpoint(_gates(), {"lap_count": 5})
+        self.writer.wait()
+        with open(os.path.join(self.dir, JOURNAL_FILE), "wb") as f:
+            f.write(old_journal)
+        self.assertIsNone(self._journal().recover())
+
+    def test_old_checkpoint_is_not_restored(self):
+        journal = self._journal()
+        journal.checkpoint(_gates(), {"lap_count": 3})
+        self._write_lap(journal)
+        self.clock.advance(RESTORE_WITHIN_SECONDS + 1)
+        self.assertIsNone(self._journal().recover())
+
+    def test_damaged_checkpoint_is_discarded(self):
+        journal = self._journal()
+        journal.checkpoint(_gates(), {"lap_count": 3})
+        self._write_lap(journal)
+        self.writer.wait()
+        # the header is intact, but the power went before the gates were all written
+        path = os.path.join(self.dir, CHECKPOINT_FILE)
+        with open(path, "rb") as f:
+            data = f.read()
+        _, _, header_length = PREAMBLE.unpack_from(data)
+        with open(path, "wb") as f:
+            f.write(data[:PREAMBLE.size + header_length + 16])
+        journal = self._journal()
+        self.assertIsNone(journal.recover())
+        self.assertFalse(journal.is_active())
+        self.writer.wait()
+        self.assertEqual([], os.listdir(self.dir))
+
+    def test_reset(self):
+        journal = self._journal()
+        journal.checkpoint(_gates(), {"lap_count": 3})
+        journal.reset()
+        self.assertFalse(journal.is_active())
+        self.writer.wait()
+        self.assertEqual([], os.listdir(self.dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+
+from lemon_pi.car.projection import LocalProjection
+from lemon_pi.car.spatial_index import SpatialIndex
+from lemon_pi.car.target import Target
+from lemon_pi.car.track import TrackLocation, PIT_ENTRY, PIT_OUT, START_FINISH
+
+
+def _target(name, projection, x, y):
+    # a north/south line 20 metres long centred on x, y
+    t = Target(name, projection.to_lat_long(x, y - 10), projection.to_lat_long(x, y + 10), "E")
+    t.set_projection(projection)
+    return t
+
+
+class SpatialIndexTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.projection = LocalProjection(35.488872, -119.544530)
+        self.index = SpatialIndex()
+        for i in range(20):
+            self.index.add(f"t{i}", _target(f"t{i}", self.projection, i * 100, 0))
+
+    def test_only_nearby_targets(self):
+        self.assertEqual(["t3"], self.index.candidates((290, 0), (310, 0)))
+        self.assertEqual([], self.index.candidates((320, 0), (340, 0)))
+        self.assertEqual([], self.index.candidates((290, 500), (310, 500)))
+
+    def test_insertion_order(self):
+        self.assertEqual(["t3", "t4"], self.index.candidates((420, 5), (280, 5)))
+
+    def test_big_jump(self):
+        self.assertEqual(20, len(self.index.candidates((-50, 0), (2000, 0))))
+        self.assertEqual(20, len(self.index))
+
+    def test_track_index(self):
+        track = TrackLocation("bw", "foo")
+        projection = LocalProjection(35.488872, -119.544530)
+        track.set_start_finish_target(_target("sf", projection, 0, 0))
+        track.set_pit_in_target(_target("pit-in", projection, 300, 0))
+        track.add_target(PIT_OUT, _target("pit-out", projection, 600, 0))
+        self.assertEqual([START_FINISH], track.get_target_index().candidates((-5, 0), (5, 0)))
+        self.assertEqual([PIT_ENTRY], track.get_target_index().candidates((295, 0), (305, 0)))
+        # reversing the track swaps pit in and out over
+        track.reverse()
+        self.assertEqual([PIT_OUT], track.get_target_index().candidates((295, 0), (305, 0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+
+from lemon_pi.car.projection import LocalProjection
+from lemon_pi.car.target import Target
+
+
+class TargetTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        # a line running north/south, a few metres long
+        self.target = Target("start_finish", (35.489031, -119.544530), (35.488713, -119.544530), "E")
+        self.target.set_projection(LocalProjection(35.488872, -119.544530))
+
+    def test_precomputed_geometry(self):
+        t = self.target
+        self.assertAlmostEqual(0, t.direction[0])
+        self.assertTrue(t.direction[1] > 0)
+        self.assertAlmostEqual(t.direction[0] ** 2 + t.direction[1] ** 2, t.length_sq)
+        # the normal is at right angles to the line
+        self.assertAlmostEqual(0, t.direction[0] * t.normal[0] + t.direction[1] * t.normal[1])
+        self.assertTrue(t.min_x < t.xy1[0] < t.max_x)
+        self.assertTrue(t.min_y < t.xy1[1] < t.xy2[1] < t.max_y)
+
+    def test_may_cross(self):
+        t = self.target
+        self.assertTrue(t.may_cross((-10, 0), (10, 0)))
+        # both fixes off to one side of the line
+        self.assertFalse(t.may_cross((-30, 0), (-10, 0)))
+        self.assertFalse(t.may_cross((10, 0), (30, 0)))
+        # both beyond the ends of the line
+        self.assertFalse(t.may_cross((-10, 100), (10, 100)))
+        self.assertFalse(t.may_cross((-10, -100), (10, -100)))
+        # landing exactly on the end of the line is still a candidate
+        self.assertTrue(t.may_cross((-10, t.xy1[1]), (0, t.xy1[1])))
+
+    def test_side_of(self):
+        t = self.target
+        self.assertEqual(0, t.side_of(t.mid_xy))
+        self.assertTrue(t.side_of((-10, 0)) * t.side_of((10, 0)) < 0)
+        self.assertTrue(t.side_of((-10, 0)) * t.side_of((-20, 50)) > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,6 +5,8 @@ from haversine import haversine, Unit
 
 from lemon_pi.car.update_tracks import TrackUpdater
 from lemon_pi.car.event_defs import LeaveTrackEvent, EnterTrackEvent
+from lemon_pi.car.projection import LocalProjection
+from lemon_pi.car.spatial_index import SpatialIndex
 from lemon_pi.car.target import Target
 
 import logging
@@ -46,6 +48,10 @@ class TrackLocation:
         self.sectors: [Sector] = []
         self.hidden = False
         self.reversed = False
+        # all of the targets at the track share a projection centred on the start/finish
+        self.projection: LocalProjection = None
+        # built on demand, and thrown away whenever the targets change
+        self.target_index: SpatialIndex = None
 
     def get_display_name(self):
         # name hidden tracks with an _ at the end of their name
@@ -62,7 +68,7 @@ class TrackLocation:
         return self.targets[START_FINISH]
 
     def set_start_finish_target(self, t: Target):
-        self.targets[START_FINISH] = t
+        self.add_target(START_FINISH, t)
 
     def is_pit_defined(self) -> bool:
         return self.targets.get(PIT_ENTRY) is not None
@@ -71,7 +77,7 @@ class TrackLocation:
         return self.targets[PIT_ENTRY]
 
     def set_pit_in_target(self, t: Target):
-        self.targets[PIT_ENTRY] = t
+        self.add_target(PIT_ENTRY, t)
 
     def is_pit_out_defined(self) -> bool:
         return self.targets.get(PIT_OUT) is not None
@@ -95,11 +101,31 @@ class TrackLocation:
                     result.append((sector, target))
         return result
 
+    # a spatial index of the track's targets, keyed by their TargetMetaData
+    def get_target_index(self) -> SpatialIndex:
+        if self.target_index is None:
+            index = SpatialIndex()
+            for tmd, target in self.targets.items():
+                if target:
+                    index.add(tmd, target)
+            self.target_index = index
+        return self.target_index
+
     def add_target(self, tmd: TargetMetaData, target: Target):
         self.targets[tmd] = target
+        self.target_index = None
+        if tmd == START_FINISH:
+            # the projection is centred on the start/finish, so everything is reprojected
+            self.projection = LocalProjection(*target.midpoint)
+            for t in self.targets.values():
+                if t:
+                    t.set_projection(self.projection)
+        elif target and self.projection:
+            target.set_projection(self.projection)
 
     def reverse(self):
         self.reversed = not self.reversed
+        self.target_index = None
         self.targets[START_FINISH].target_heading = swap_direction(self.targets[START_FINISH].target_heading)
 
         tmp = self.targets[PIT_ENTRY]
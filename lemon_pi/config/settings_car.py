@@ -70,6 +70,14 @@ GPSCTL_ARGS = ""
 # distance between virtual gates on the track
 VGATE_SEPARATION_FEET = 200
 
+# how often the event counts and handler latencies are written to the log, 0 to never.
+# send the process SIGUSR1 to write them out at any time
+EVENT_STATS_INTERVAL_SECS = 300
+
+# how many records the in-memory trace keeps, it's written to logs/ when the process crashes or is
+# sent SIGUSR2, and read with python -m lemon_pi.utils.trace_decoder
+TRACE_RECORDS = 65536
+
 
 # You can set these in here, but you must manually run
 #  sudo PYTHONPATH=. ./venv/bin/python3 lemon_pi/car/wifi.py
@@ -0,0 +1,106 @@
+import time
+
+# a time from the gps further ahead of the clock than this moves the clock on to it
+SYNC_TOLERANCE_SECS = 1.0
+
+
+class Clock:
+    # A source of time. Logic that depends on the passing of time (debouncing,
+    # lap timing, staleness checks, message expiry) asks a clock rather than
+    # calling time.time() directly, so that a replay can run a whole race
+    # through that logic in a few seconds and still get the same answers it
+    # would get in real time.
+    #
+    # There is one shared clock for the application. Classes take an optional
+    # clock in their constructor and fall back to the shared one.
+
+    __instance = None
+
+    # seconds since the epoch
+    def time(self) -> float:
+        pass
+
+    # seconds from an arbitrary starting point, never goes backwards
+    def monotonic(self) -> float:
+        pass
+
+    def sleep(self, secs: float) -> None:
+        pass
+
+    # told the time by something that's known to have it right, like the gps
+    def sync(self, now: float) -> None:
+        pass
+
+    @classmethod
+    def get_instance(cls) -> "Clock":
+        if Clock.__instance is None:
+            Clock.__instance = WallClock()
+        return Clock.__instance
+
+    @classmethod
+    def set_instance(cls, clock: "Clock"):
+        Clock.__instance = clock
+
+    @classmethod
+    def reset(cls):
+        Clock.__instance = None
+
+
+class WallClock(Clock):
+
+    def time(self) -> float:
+        return time.time()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def sleep(self, secs: float) -> None:
+        time.sleep(secs)
+
+
+class MonotonicClock(WallClock):
+    # Wall clock time that cannot go backwards. The Pi has no real time clock,
+    # so the system time jumps when gpsd or ntp corrects it. This clock is
+    # anchored to the wall time when it is created and then only moves forward
+    # with the monotonic clock. The time at start up is usually from when the
+    # pi was last shut down, so the clock is moved on once the gps has a fix,
+    # but never back.
+
+    def __init__(self):
+        self.offset = time.time() - time.monotonic()
+
+    def time(self) -> float:
+        return time.monotonic() + self.offset
+
+    def sync(self, now: float) -> None:
+        ahead = now - self.time()
+        if ahead > SYNC_TOLERANCE_SECS:
+            self.offset += ahead
+
+
+class SimulatedClock(Clock):
+    # A clock that only moves when told to. Replays set it from the timestamp of
+    # each gps fix, and tests move it explicitly. Sleeping advances the clock
+    # rather than waiting.
+
+    def __init__(self, start: float = 0.0):
+        self.now = start
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, secs: float) -> None:
+        self.advance(secs)
+
+    def set_time(self, now: float):
+        # recorded logs occasionally have timestamps that step backwards, we
+        # never let the clock follow them
+        if now > self.now:
+            self.now = now
+
+    def advance(self, secs: float):
+        if secs > 0:
+            self.now += secs
@@ -8,6 +8,16 @@ class GpsPos:
         self.heading: float = heading
         self.speed: int = speed
         self.timestamp: float = timestamp
+        self._projection = None
+        self._xy = None
+
+    # the position on a local projection. Each fix is checked against several
+    # targets that share the track's projection, so the result is cached
+    def xy(self, projection) -> (float, float):
+        if self._projection is not projection:
+            self._xy = projection.to_xy(self.lat, self.long)
+            self._projection = projection
+        return self._xy
 
 
 class GpsProvider:
@@ -0,0 +1,106 @@
+#
+# Measures what emitting an event costs, per emit, the way handlers used to
+# subscribe and the way they can now:
+#
+#   handle_event : every handler gets handle_event(event, **kwargs) and works
+#                  out what the event was by walking an if chain, like the gui
+#                  used to
+#   method       : every handler registers a method for the event, which is
+#                  called with a payload
+#
+# run it with
+#   python -m lemon_pi.shared.event_benchmark
+#
+import argparse
+import logging
+import time
+
+from lemon_pi.shared.clock import Clock, SimulatedClock
+from lemon_pi.shared.events import Event, EventHandler, Payload
+
+# the handlers in the car have up to this many events in their if chains
+CHAIN_LENGTH = 18
+
+
+class Fix(Payload):
+    __slots__ = ("speed", "lat_long")
+
+    def __init__(self, speed: int, lat_long: (float, float)):
+        self.speed = speed
+        self.lat_long = lat_long
+
+
+OTHER_EVENTS = [Event(f"benchmark-other-{i}") for i in range(CHAIN_LENGTH - 1)]
+ChainEvent = Event("benchmark-chain", suppress_logs=True)
+MethodEvent = Event("benchmark-method", suppress_logs=True, payload=Fix)
+
+
+class ChainHandler(EventHandler):
+
+    def __init__(self, event: Event, others: [Event]):
+        self.event = event
+        self.others = others
+        self.speed = 0
+        event.register_handler(self)
+
+    def handle_event(self, event, speed=0, lat_long=(0, 0)):
+        # the event being measured is last in the chain, as MovingEvent was in the gui's
+        for other in self.others:
+            if event == other:
+                return
+        if event == self.event:
+            self.speed = speed
+
+
+class MethodHandler(EventHandler):
+
+    def __init__(self, event: Event):
+        self.speed = 0
+        event.register_handler(self, self.on_fix)
+
+    def on_fix(self, fix: Fix):
+        self.speed = fix.speed
+
+
+# the best of a few runs, the others are slowed by whatever else the machine is doing
+def time_emits(clock: SimulatedClock, emit, count: int, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(count):
+            # move the clock on so no emit is debounced
+            clock.advance(1)
+            emit()
+        elapsed = (time.perf_counter() - start) / count
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(handlers: int, count: int, repeat: int = 5) -> [(str, float)]:
+    clock = SimulatedClock()
+    Clock.set_instance(clock)
+    ChainEvent.handlers = []
+    MethodEvent.handlers = []
+    for _ in range(handlers):
+        ChainHandler(ChainEvent, OTHER_EVENTS)
+        MethodHandler(MethodEvent)
+    try:
+        return [
+            ("handle_event", time_emits(clock, lambda: ChainEvent.emit(speed=30, lat_long=(38.16, -122.45)),
+                                        count, repeat)),
+            ("method", time_emits(clock, lambda: MethodEvent.emit(Fix(30, (38.16, -122.45))), count, repeat)),
+        ]
+    finally:
+        Clock.reset()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="time emitting an event to its handlers")
+    arg_parser.add_argument("--handlers", type=int, default=3, help="handlers subscribed to the event")
+    arg_parser.add_argument("--emits", type=int, default=100000, help="how many times to emit it in each run")
+    arg_parser.add_argument("--repeat", type=int, default=5, help="runs to take the best of")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.WARN)
+    for name, seconds in run(args.handlers, args.emits, args.repeat):
+        print(f"{name:<14} {seconds * 1e6:6.2f}us per emit to {args.handlers} handlers")
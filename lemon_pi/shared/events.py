@@ -1,15 +1,129 @@
 import logging
-import time
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from functools import partial
+from time import perf_counter
+from threading import Lock, Condition
+from typing import Optional
+
+from lemon_pi.shared.clock import Clock
+from lemon_pi.shared.trace import Trace
 
 logger = logging.getLogger(__name__)
 
+# how many events can be waiting for a handler that isn't run inline
+QUEUE_SIZE = 64
+
+# the number of threads shared by the handlers that run on the pool
+POOL_WORKERS = 2
+
+# the upper bound of each handler latency bucket in seconds, doubling from 10us to about 5s
+LATENCY_BUCKETS = [10e-6 * 2 ** i for i in range(20)]
+
+
+class Dispatch(Enum):
+    # on the thread that emitted the event, before emit returns
+    INLINE = 1
+    # on one of the threads shared between handlers, one event at a time for each handler
+    POOL = 2
+    # on a thread of the handler's own
+    SERIAL = 3
+
+
+class Overflow(Enum):
+    # an event that finds the handler's queue full is dropped
+    DROP = 1
+    # an event replaces the same event still waiting in the handler's queue, so only
+    # the latest is handled. Used for events that report how things are now
+    COALESCE = 2
+
 
 class EventHandler:
 
+    # how the handler's events are run once the EventDispatcher is started. Until then,
+    # and always for INLINE handlers, they're run on the thread that emitted them
+    dispatch = Dispatch.INLINE
+
+    # called for the events the handler registered for without a method of their own
     def handle_event(self, event, **kwargs):
         pass
 
 
+class Payload:
+    # What an event carries when it's emitted often enough that building a
+    # dict of keyword arguments for every emit matters. Subclasses list their
+    # fields in __slots__. A payload is handed to every handler, and may sit
+    # in a handler's queue, so it isn't changed once it has been emitted.
+
+    __slots__ = ()
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)}" for name in self.__slots__)
+        return f"{self.__class__.__name__}({fields})"
+
+
+class LatencyHistogram:
+    # How long calls took, counted into buckets that double in size. Recording
+    # a call is a bisect and an increment, and percentiles are read back to
+    # within a bucket, which is plenty to see which handler is slow.
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.max = 0.0
+
+    # Event.emit does the same inline, it's the hot path
+    def record(self, elapsed: float):
+        self.counts[bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+        if elapsed > self.max:
+            self.max = elapsed
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    # the upper bound of the bucket the percentile falls in, or the slowest call if that's less
+    def percentile(self, p: float) -> float:
+        count = self.count
+        if count == 0:
+            return 0.0
+        wanted = p / 100 * count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted and count > 0:
+                if bucket == len(LATENCY_BUCKETS):
+                    return self.max
+                return min(LATENCY_BUCKETS[bucket], self.max)
+        return self.max
+
+
+class Subscription:
+    # A handler registered for an event: what to call, how it's dispatched,
+    # and how often it has been called for the event, how long it took and
+    # how often it failed. An event keeps a list of these, so emitting is a
+    # call for each one.
+
+    __slots__ = ("handler", "call", "dispatch", "exceptions", "latency")
+
+    def __init__(self, handler: EventHandler, call):
+        self.handler = handler
+        self.call = call
+        dispatch = getattr(handler, "dispatch", Dispatch.INLINE)
+        self.dispatch = dispatch if dispatch in (Dispatch.POOL, Dispatch.SERIAL) else Dispatch.INLINE
+        self.reset()
+
+    def reset(self):
+        self.exceptions = 0
+        self.latency = LatencyHistogram()
+
+    # every call is timed, so the histogram counts them
+    @property
+    def calls(self) -> int:
+        return self.latency.count
+
+
 class Event:
 
     # stop the logs getting too full : suppress repeat events in info log
@@ -17,59 +131,304 @@ class Event:
     last_event_count = 0
     instances = []
 
-    def __init__(self, name="", suppress_logs=False, debounce_time=0):
+    def __init__(self, name="", suppress_logs=False, debounce_time=0, overflow=Overflow.DROP, payload: type = None):
         self.name = name
         for e in Event.instances:
             if e.name == name:
                 raise Exception(f"redefinition of event {name}")
         Event.instances.append(self)
+        # every emit is traced, whether it's debounced or not
+        self.trace_point = Trace.point(f"event {name}")
         # some events emit all the time so we suppress logging them consecutively
         self.suppress_logs: bool = suppress_logs
         # some events prevent re-issue of the same event in a short space ot time
         self.debounce_time = debounce_time
         self.last_event_time: float = 0.0
-        self.handlers = []
+        # what happens when a handler that isn't run inline falls behind
+        self.overflow = overflow
+        # the Payload subclass the event is emitted with, if it has one
+        self.payload = payload
+        self.handlers: [Subscription] = []
+        # counted as events are emitted, for EventStats. These aren't locked, an event emitted
+        # on two threads at once might be missed from the counts
+        self.emitted = 0
+        self.debounced = 0
 
-    def register_handler(self, handler: EventHandler):
-        if handler not in self.handlers:
-            self.handlers.append(handler)
-        else:
-            logger.error("{} attempted to register same handler twice {}", self.name, handler.__class__)
+    # handlers either give the method to call for this event, which is called with what the event was
+    # emitted with, or have their handle_event called with the event as well, and the payload as a
+    # keyword argument for events that have one
+    def register_handler(self, handler: EventHandler, method=None):
+        if any(subscription.handler is handler for subscription in self.handlers):
+            logger.error(f"{self.name} attempted to register same handler twice {handler.__class__}")
+            return
+        if method is None:
+            if self.payload is None:
+                method = partial(handler.handle_event, self)
+            else:
+                method = partial(Event._handle_payload, handler.handle_event, self)
+        self.handlers.append(Subscription(handler, method))
+
+    @staticmethod
+    def _handle_payload(handle_event, event, payload=None, **kwargs):
+        handle_event(event, payload=payload, **kwargs)
 
     def deregister_handler(self, handler_type: type):
-        target = None
-        for handler in self.handlers:
-            if isinstance(handler, handler_type):
+        for subscription in self.handlers:
+            if isinstance(subscription.handler, handler_type):
                 logger.info(f"removing {handler_type} event handler")
-                target = handler
+                self.handlers.remove(subscription)
                 break
-        if target:
-            self.handlers.remove(target)
 
-    def emit(self, **kwargs):
-        if self == Event.last_event and self.suppress_logs:
-            Event.last_event_count += 1
-        else:
-            if Event.last_event_count > 0:
-                logger.info(f"suppressed ({Event.last_event_count}) {Event.last_event.name}")
-            logger.info(f"emitting {self.name}")
-            Event.last_event_count = 0
+    # events with a payload are emitted with one, the rest with keyword arguments
+    def emit(self, payload: Payload = None, **kwargs):
+        # emits are traced rather than logged, logging them is only worth formatting the message for when debugging
+        if logger.isEnabledFor(logging.DEBUG):
+            if self == Event.last_event and self.suppress_logs:
+                Event.last_event_count += 1
+            else:
+                if Event.last_event_count > 0:
+                    logger.debug(f"suppressed ({Event.last_event_count}) {Event.last_event.name}")
+                logger.debug(f"emitting {self.name}")
+                Event.last_event_count = 0
+        self.emitted += 1
         # prevent repeat emitting events if they have just happened
-        now = time.time()
-        if now - self.last_event_time > self.debounce_time:
+        now = Clock.get_instance().time()
+        debounced = now - self.last_event_time <= self.debounce_time
+        Trace.record(self.trace_point, debounced, len(self.handlers), tstamp=now)
+        if not debounced:
             # safest to leave these here to prevent re-entrant code
             self.last_event_time = now
             Event.last_event = self
             # call all the registered handlers
-            for handler in self.handlers:
+            args = () if payload is None else (payload,)
+            dispatcher = EventDispatcher.get_instance()
+            for subscription in self.handlers:
+                if dispatcher is not None and subscription.dispatch is not Dispatch.INLINE:
+                    dispatcher.queue(subscription, self, args, kwargs)
+                    continue
+                # Event.call, inlined as this runs for every subscriber of every emit
+                start = perf_counter()
                 try:
-                    handler.handle_event(self, **kwargs)
+                    subscription.call(*args, **kwargs)
                 except Exception:
+                    subscription.exceptions += 1
                     logger.exception("exception handling event")
+                elapsed = perf_counter() - start
+                latency = subscription.latency
+                latency.counts[bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+                if elapsed > latency.max:
+                    latency.max = elapsed
         else:
+            self.debounced += 1
             self.last_event_time = now
             Event.last_event = self
 
+    # call the subscribed handler, whichever thread it's run on, and time it
+    @staticmethod
+    def call(subscription: Subscription, args: tuple, kwargs: dict):
+        start = perf_counter()
+        try:
+            subscription.call(*args, **kwargs)
+        except Exception:
+            subscription.exceptions += 1
+            logger.exception("exception handling event")
+        subscription.latency.record(perf_counter() - start)
+
     @classmethod
     def instance_iterator(cls):
         return Event.instances.__iter__()
+
+
+class HandlerQueue:
+    # The events waiting for one handler. Events are taken off the queue in
+    # the order they arrived and handed to the handler one at a time, so a
+    # handler never has two events at once and sees them in order, whichever
+    # thread runs it. The queue is bounded: when it is full the event is
+    # dropped, unless the event coalesces, in which case it replaces the same
+    # event if that is still waiting.
+
+    def __init__(self, handler: EventHandler, executor: ThreadPoolExecutor, size: int = QUEUE_SIZE):
+        self.handler = handler
+        self.executor = executor
+        self.size = size
+        self.pending = deque()
+        self.lock = Lock()
+        self.idle = Condition(self.lock)
+        # set while the queue is being worked through on the executor
+        self.running = False
+        self.handled = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def put(self, event: Event, subscription: Subscription, args: tuple, kwargs: dict):
+        with self.lock:
+            if event.overflow == Overflow.COALESCE:
+                for i, waiting in enumerate(self.pending):
+                    if waiting[0] is event:
+                        self.pending[i] = (event, subscription, args, kwargs)
+                        self.coalesced += 1
+                        return
+            if len(self.pending) >= self.size:
+                self.dropped += 1
+                logger.warning(f"dropped {event.name} for {self.handler.__class__.__name__}, "
+                               f"{self.dropped} dropped so far")
+                return
+            self.pending.append((event, subscription, args, kwargs))
+            if self.running:
+                return
+            self.running = True
+        self.executor.submit(self._run)
+
+    # block until everything queued so far has been handled
+    def wait(self):
+        with self.lock:
+            while self.running:
+                self.idle.wait()
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if not self.pending:
+                    self.running = False
+                    self.idle.notify_all()
+                    return
+                _, subscription, args, kwargs = self.pending.popleft()
+            Event.call(subscription, args, kwargs)
+            self.handled += 1
+
+
+class EventDispatcher:
+    # Runs event handlers off the thread that emitted the event, so a slow
+    # handler, like the radio or the audio, doesn't hold up the gps thread.
+    #
+    # Each handler says how it wants to be run with its dispatch. POOL
+    # handlers share a few threads, SERIAL handlers get a thread of their own
+    # for when they block for long, and INLINE handlers are run as before,
+    # which is what a handler that other handlers rely on being up to date
+    # needs. Every handler that isn't run inline gets a HandlerQueue of its
+    # own.
+    #
+    # Nothing is dispatched until the dispatcher is started, so tests and
+    # replays, which rely on every handler having run by the time emit
+    # returns, are unchanged.
+
+    __instance = None
+
+    def __init__(self, pool_workers: int = POOL_WORKERS, queue_size: int = QUEUE_SIZE):
+        self.pool = ThreadPoolExecutor(max_workers=pool_workers, thread_name_prefix="events")
+        self.queue_size = queue_size
+        self.queues: {int: HandlerQueue} = {}
+        self.lock = Lock()
+
+    # the event stats are counted from when the dispatcher starts, so the first summary has a window to cover
+    @classmethod
+    def start(cls, pool_workers: int = POOL_WORKERS, queue_size: int = QUEUE_SIZE) -> "EventDispatcher":
+        if EventDispatcher.__instance is None:
+            EventDispatcher.__instance = EventDispatcher(pool_workers, queue_size)
+            EventStats.reset()
+        return EventDispatcher.__instance
+
+    @classmethod
+    def get_instance(cls) -> Optional["EventDispatcher"]:
+        return EventDispatcher.__instance
+
+    # go back to running every handler inline, once the events already queued have been handled
+    @classmethod
+    def stop(cls):
+        dispatcher = EventDispatcher.__instance
+        EventDispatcher.__instance = None
+        if dispatcher is not None:
+            dispatcher.wait()
+            for queue in dispatcher.queues.values():
+                if queue.executor is not dispatcher.pool:
+                    queue.executor.shutdown()
+            dispatcher.pool.shutdown()
+
+    # queue the event for a handler that isn't run inline
+    def queue(self, subscription: Subscription, event: Event, args: tuple, kwargs: dict):
+        handler = subscription.handler
+        queue = self.queues.get(id(handler))
+        if queue is None:
+            with self.lock:
+                queue = self.queues.get(id(handler))
+                if queue is None:
+                    if subscription.dispatch == Dispatch.SERIAL:
+                        executor = ThreadPoolExecutor(max_workers=1,
+                                                      thread_name_prefix=handler.__class__.__name__)
+                    else:
+                        executor = self.pool
+                    queue = HandlerQueue(handler, executor, self.queue_size)
+                    self.queues[id(handler)] = queue
+        queue.put(event, subscription, args, kwargs)
+
+    # block until everything queued so far has been handled
+    def wait(self):
+        for queue in list(self.queues.values()):
+            queue.wait()
+
+    def summary(self) -> str:
+        return ", ".join(f"{queue.handler.__class__.__name__} {queue.handled} handled "
+                         f"{len(queue.pending)} queued {queue.dropped} dropped {queue.coalesced} coalesced"
+                         for queue in self.queues.values())
+
+
+class EventStats:
+    # The counts kept by every event and its handlers: how often each event
+    # was emitted, and dropped by its debounce, and for each handler the
+    # calls, failures and latencies. A snapshot covers the time since the
+    # last one was taken with reset, so the rates are for that window.
+
+    # when the current window started, set when the EventDispatcher is started or the stats are reset.
+    # A replay that never starts the dispatcher counts from its first snapshot
+    since = None
+
+    # the counts as plain values, so they can be logged or sent on as they are
+    @classmethod
+    def snapshot(cls, reset=False) -> dict:
+        now = Clock.get_instance().monotonic()
+        if EventStats.since is None:
+            EventStats.since = now
+        elapsed = now - EventStats.since
+        events = {}
+        for event in Event.instances:
+            if event.emitted == 0:
+                continue
+            events[event.name] = {
+                "emitted": event.emitted,
+                "per_second": event.emitted / elapsed if elapsed > 0 else 0.0,
+                "debounced": event.debounced,
+                "handlers": {s.handler.__class__.__name__: {"calls": s.calls,
+                                                            "exceptions": s.exceptions,
+                                                            "p50": s.latency.percentile(50),
+                                                            "p99": s.latency.percentile(99),
+                                                            "max": s.latency.max}
+                             for s in event.handlers if s.calls}
+            }
+        if reset:
+            EventStats.reset()
+        return {"seconds": elapsed, "events": events}
+
+    @classmethod
+    def summary(cls, reset=False) -> str:
+        snapshot = EventStats.snapshot(reset)
+        lines = [f"event stats over {snapshot['seconds']:.0f}s"]
+        for name, event in snapshot["events"].items():
+            lines.append(f"  {name} {event['emitted']} emitted ({event['per_second']:.2f}/s) "
+                         f"{event['debounced']} debounced")
+            for handler, stats in event["handlers"].items():
+                lines.append(f"    {handler} {stats['calls']} calls {stats['exceptions']} failed "
+                             f"p50={stats['p50'] * 1000:.2f}ms p99={stats['p99'] * 1000:.2f}ms "
+                             f"max={stats['max'] * 1000:.2f}ms")
+        dispatcher = EventDispatcher.get_instance()
+        if dispatcher is not None:
+            lines.append(f"  queues : {dispatcher.summary()}")
+        return "\n".join(lines)
+
+    @classmethod
+    def reset(cls):
+        EventStats.since = Clock.get_instance().monotonic()
+        for event in Event.instances:
+            event.emitted = 0
+            event.debounced = 0
+            for subscription in event.handlers:
+                subscription.reset()
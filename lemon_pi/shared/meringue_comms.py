@@ -1,6 +1,5 @@
 import base64
 import logging
-import time
 import urllib
 from queue import Queue
 from threading import Thread
@@ -11,6 +10,7 @@ import grpc
 from google.protobuf.empty_pb2 import Empty
 from grpc._channel import _InactiveRpcError
 
+from lemon_pi.shared.clock import Clock
 from lemon_pi.shared.message_postmarker import MessagePostmarker
 from lemon_pi_pb2 import ToCarMessage, ToPitMessage
 from lemon_pi_pb2_grpc import CommsServiceStub
@@ -21,7 +21,8 @@ logger = logging.getLogger(__name__)
 class MeringueComms:
 
     # initialize this with a track code
-    def __init__(self, sender:str, key:str):
+    def __init__(self, sender:str, key:str, clock: Clock = None):
+        self.clock = clock or Clock.get_instance()
         self.track_id = None
         self.sender = sender
         self.key = key
@@ -86,7 +87,7 @@ class MeringueComms:
                 msg = self.send_queue.get()
                 logger.debug("got a message to send!!")
                 # if the message is more than 60 seconds old then discard it
-                if time.time() - self.postmarker.get_timestamp(msg) > 60:
+                if self.clock.time() - self.postmarker.get_timestamp(msg) > 60:
                     logger.info("discarding out of date message")
                     continue
 
@@ -1,5 +1,4 @@
-import time
-
+from lemon_pi.shared.clock import Clock
 from lemon_pi_pb2 import ToCarMessage, ToPitMessage
 
 
@@ -29,7 +28,7 @@ class MessagePostmarker:
         self.seq += 1
         setattr(subfield_attr, "seq_num", self.seq)
         setattr(subfield_attr, "sender", self.sender)
-        setattr(subfield_attr, "timestamp", int(time.time()))
+        setattr(subfield_attr, "timestamp", int(Clock.get_instance().time()))
 
     def get_timestamp(self, msg):
         subfield = self._get_subfield(msg)
@@ -0,0 +1,64 @@
+import time
+import unittest
+from unittest.mock import Mock
+
+from lemon_pi.shared.clock import Clock, WallClock, MonotonicClock, SimulatedClock
+from lemon_pi.shared.events import Event
+
+DebouncedEvent = Event("clock-test-debounced", debounce_time=30)
+
+
+class ClockTestCase(unittest.TestCase):
+
+    def tearDown(self) -> None:
+        Clock.reset()
+
+    def test_default_is_wall_clock(self):
+        self.assertIsInstance(Clock.get_instance(), WallClock)
+        self.assertAlmostEqual(time.time(), Clock.get_instance().time(), delta=1)
+
+    def test_monotonic_clock_tracks_wall_time(self):
+        clock = MonotonicClock()
+        self.assertAlmostEqual(time.time(), clock.time(), delta=1)
+        first = clock.time()
+        self.assertTrue(clock.time() >= first)
+
+    def test_monotonic_clock_is_moved_on_by_the_gps(self):
+        clock = MonotonicClock()
+        now = clock.time()
+        clock.sync(now + 3600)
+        self.assertAlmostEqual(now + 3600, clock.time(), delta=1)
+        # but never back, and not for the gps being a little behind
+        clock.sync(now)
+        self.assertAlmostEqual(now + 3600, clock.time(), delta=1)
+
+    def test_simulated_clock(self):
+        clock = SimulatedClock(1000.0)
+        self.assertEqual(1000.0, clock.time())
+        clock.advance(5)
+        self.assertEqual(1005.0, clock.time())
+        clock.sleep(10)
+        self.assertEqual(1015.0, clock.time())
+        clock.set_time(2000.0)
+        self.assertEqual(2000.0, clock.monotonic())
+        # never goes backwards
+        clock.set_time(1500.0)
+        self.assertEqual(2000.0, clock.time())
+
+    def test_debounce_uses_shared_clock(self):
+        clock = SimulatedClock(1000.0)
+        Clock.set_instance(clock)
+        handler = Mock()
+        DebouncedEvent.register_handler(handler)
+        DebouncedEvent.emit()
+        clock.advance(10)
+        DebouncedEvent.emit()
+        self.assertEqual(1, handler.handle_event.call_count)
+        clock.advance(31)
+        DebouncedEvent.emit()
+        self.assertEqual(2, handler.handle_event.call_count)
+        DebouncedEvent.deregister_handler(Mock)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,17 @@
+import unittest
+
+from lemon_pi.shared.event_benchmark import run, ChainEvent, MethodEvent
+
+
+class EventBenchmarkTest(unittest.TestCase):
+
+    def test_run(self):
+        results = run(handlers=2, count=100, repeat=2)
+        self.assertEqual(["handle_event", "method"], [name for name, _ in results])
+        self.assertTrue(all(seconds > 0 for _, seconds in results))
+        self.assertEqual(400, sum(s.calls for s in ChainEvent.handlers))
+        self.assertEqual(400, sum(s.calls for s in MethodEvent.handlers))
+
+
+if __name__ == '__main__':
+    unittest.main()
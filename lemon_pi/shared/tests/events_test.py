@@ -1,15 +1,260 @@
+import threading
 import unittest
+from threading import Event as Signal
 from unittest.mock import Mock
 
-from lemon_pi.shared.events import Event
+from lemon_pi.shared.clock import Clock, SimulatedClock
+from lemon_pi.shared.events import Event, EventHandler, EventDispatcher, Dispatch, Overflow, EventStats, \
+    LatencyHistogram, Payload
+
+
+class Position(Payload):
+    __slots__ = ("x", "y")
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
 
 TestEvent = Event("test")
+StatusEvent = Event("test-status", overflow=Overflow.COALESCE)
+DebouncedEvent = Event("test-debounced", debounce_time=5)
+PositionEvent = Event("test-position", payload=Position)
+
+
+class RecordingHandler(EventHandler):
+
+    def __init__(self, dispatch=Dispatch.INLINE, gate: Signal = None):
+        self.dispatch = dispatch
+        self.gate = gate
+        self.started = Signal()
+        self.events = []
+        self.threads = []
+        TestEvent.register_handler(self)
+        StatusEvent.register_handler(self)
+
+    def handle_event(self, event, **kwargs):
+        self.started.set()
+        if self.gate:
+            self.gate.wait(5)
+        self.threads.append(threading.current_thread())
+        self.events.append((event.name, kwargs.get("n")))
+
+
+class PositionHandler(EventHandler):
+
+    def __init__(self):
+        self.positions = []
+
+    def handle_event(self, event, **kwargs):
+        self.positions.append((event, kwargs.get("payload")))
+
 
 class EventsTestCase(unittest.TestCase):
 
+    def setUp(self) -> None:
+        self.clock = SimulatedClock(1000)
+        Clock.set_instance(self.clock)
+        TestEvent.last_event_time = 0.0
+        StatusEvent.last_event_time = 0.0
+        DebouncedEvent.last_event_time = 0.0
+        PositionEvent.last_event_time = 0.0
+        EventStats.reset()
+
+    def tearDown(self) -> None:
+        EventDispatcher.stop()
+        Clock.reset()
+        TestEvent.handlers.clear()
+        StatusEvent.handlers.clear()
+        DebouncedEvent.handlers.clear()
+        PositionEvent.handlers.clear()
+
+    def _emit(self, event, n):
+        self.clock.advance(1)
+        event.emit(n=n)
+
+    def _failing_handler(self, dispatch, *side_effect) -> Mock:
+        handler = EventHandler()
+        handler.dispatch = dispatch
+        method = Mock(side_effect=side_effect)
+        TestEvent.register_handler(handler, method)
+        return method
+
     def test_register_deregister(self):
         mock = Mock()
         TestEvent.register_handler(mock)
         TestEvent.deregister_handler(Mock)
         TestEvent.emit()
-        mock.assert_not_called()
\ No newline at end of file
+        mock.assert_not_called()
+
+    def test_registered_twice(self):
+        handler = RecordingHandler()
+        TestEvent.register_handler(handler)
+        self._emit(TestEvent, 1)
+        self.assertEqual(1, len(handler.events))
+
+    def test_method_for_each_event(self):
+        handler = EventHandler()
+        on_test, on_status = Mock(), Mock()
+        TestEvent.register_handler(handler, on_test)
+        StatusEvent.register_handler(handler, on_status)
+        self._emit(TestEvent, 1)
+        on_test.assert_called_once_with(n=1)
+        on_status.assert_not_called()
+
+    def test_payload(self):
+        method = Mock()
+        PositionEvent.register_handler(EventHandler(), method)
+        recorder = Mock()
+        PositionEvent.register_handler(recorder)
+        position = Position(3, 4)
+        PositionEvent.emit(position)
+        method.assert_called_once_with(position)
+        # a handler without a method for the event gets the payload as a keyword argument
+        recorder.handle_event.assert_called_once_with(PositionEvent, payload=position)
+        self.assertEqual("Position(x=3, y=4)", repr(position))
+
+    def test_payload_to_handle_event(self):
+        handler = PositionHandler()
+        PositionEvent.register_handler(handler)
+        position = Position(3, 4)
+        PositionEvent.emit(position)
+        self.assertEqual([(PositionEvent, position)], handler.positions)
+        self.assertEqual(0, PositionEvent.handlers[0].exceptions)
+
+    def test_inline_until_started(self):
+        handler = RecordingHandler(Dispatch.SERIAL)
+        self._emit(TestEvent, 1)
+        self.assertEqual([("test", 1)], handler.events)
+        self.assertEqual([threading.current_thread()], handler.threads)
+
+    def test_serial_handler_does_not_hold_up_emit(self):
+        EventDispatcher.start()
+        gate = Signal()
+        slow = RecordingHandler(Dispatch.SERIAL, gate)
+        inline = RecordingHandler()
+        for n in range(5):
+            self._emit(TestEvent, n)
+        self.assertEqual(5, len(inline.events))
+        self.assertEqual([], slow.events)
+        gate.set()
+        EventDispatcher.get_instance().wait()
+        self.assertEqual([("test", n) for n in range(5)], slow.events)
+        self.assertNotIn(threading.current_thread(), slow.threads)
+
+    def test_pool_handler(self):
+        EventDispatcher.start()
+        handler = RecordingHandler(Dispatch.POOL)
+        for n in range(20):
+            self._emit(TestEvent, n)
+        EventDispatcher.get_instance().wait()
+        self.assertEqual([n for n in range(20)], [n for _, n in handler.events])
+
+    def test_full_queue_drops(self):
+        EventDispatcher.start(queue_size=3)
+        gate = Signal()
+        handler = RecordingHandler(Dispatch.SERIAL, gate)
+        self._emit(TestEvent, 0)
+        handler.started.wait(5)
+        for n in range(1, 10):
+            self._emit(TestEvent, n)
+        gate.set()
+        dispatcher = EventDispatcher.get_instance()
+        dispatcher.wait()
+        # the first is being handled while the next three wait
+        self.assertEqual([0, 1, 2, 3], [n for _, n in handler.events])
+        self.assertEqual(6, dispatcher.queues[id(handler)].dropped)
+
+    def test_status_coalesces(self):
+        EventDispatcher.start(queue_size=3)
+        gate = Signal()
+        handler = RecordingHandler(Dispatch.SERIAL, gate)
+        self._emit(StatusEvent, 0)
+        handler.started.wait(5)
+        for n in range(1, 10):
+            self._emit(StatusEvent, n)
+            self._emit(TestEvent, n)
+        gate.set()
+        dispatcher = EventDispatcher.get_instance()
+        dispatcher.wait()
+        self.assertEqual([("test-status", 0), ("test-status", 9), ("test", 1), ("test", 2)], handler.events)
+        self.assertEqual(8, dispatcher.queues[id(handler)].coalesced)
+
+    def test_exception_does_not_stop_the_queue(self):
+        EventDispatcher.start()
+        method = self._failing_handler(Dispatch.SERIAL, Exception("boom"), None)
+        self._emit(TestEvent, 1)
+        self._emit(TestEvent, 2)
+        EventDispatcher.get_instance().wait()
+        self.assertEqual(2, method.call_count)
+
+    def test_stop_goes_back_inline(self):
+        EventDispatcher.start()
+        handler = RecordingHandler(Dispatch.POOL)
+        self._emit(TestEvent, 1)
+        EventDispatcher.stop()
+        self.assertEqual(1, len(handler.events))
+        self._emit(TestEvent, 2)
+        self.assertEqual({threading.current_thread()}, {t for t in handler.threads if t.name.startswith("Main")})
+        self.assertEqual(2, len(handler.events))
+
+    def test_emit_and_debounce_counts(self):
+        for n in range(10):
+            self._emit(DebouncedEvent, n)
+        self.assertEqual(10, DebouncedEvent.emitted)
+        # each repeat comes within five seconds of the last, so only the first gets through
+        self.assertEqual(9, DebouncedEvent.debounced)
+        snapshot = EventStats.snapshot()
+        self.assertEqual(10, snapshot["seconds"])
+        self.assertEqual(1.0, snapshot["events"]["test-debounced"]["per_second"])
+        self.assertNotIn("test", snapshot["events"])
+
+    def test_counted_from_start(self):
+        EventStats.since = None
+        EventDispatcher.start()
+        for n in range(4):
+            self._emit(TestEvent, n)
+        snapshot = EventStats.snapshot()
+        self.assertEqual(4, snapshot["seconds"])
+        self.assertEqual(1.0, snapshot["events"]["test"]["per_second"])
+        self.assertIn("event stats over 4s", EventStats.summary())
+
+    def test_handler_stats(self):
+        self._failing_handler(Dispatch.INLINE, Exception("boom"), None, None)
+        for n in range(3):
+            self._emit(TestEvent, n)
+        stats = EventStats.snapshot()["events"]["test"]["handlers"]["EventHandler"]
+        self.assertEqual(3, stats["calls"])
+        self.assertEqual(1, stats["exceptions"])
+        self.assertTrue(0 < stats["p50"] <= stats["p99"] <= stats["max"])
+
+    def test_queued_handlers_are_timed(self):
+        EventDispatcher.start()
+        RecordingHandler(Dispatch.SERIAL)
+        self._emit(TestEvent, 1)
+        EventDispatcher.get_instance().wait()
+        self.assertEqual(1, TestEvent.handlers[0].calls)
+
+    def test_reset(self):
+        RecordingHandler()
+        self._emit(TestEvent, 1)
+        summary = EventStats.summary(reset=True)
+        self.assertIn("test 1 emitted", summary)
+        self.assertIn("RecordingHandler 1 calls 0 failed", summary)
+        self.assertEqual({}, EventStats.snapshot()["events"])
+
+    def test_latency_percentiles(self):
+        histogram = LatencyHistogram()
+        self.assertEqual(0, histogram.percentile(50))
+        for _ in range(98):
+            histogram.record(0.000015)
+        histogram.record(0.003)
+        histogram.record(0.2)
+        self.assertAlmostEqual(0.00002, histogram.percentile(50))
+        self.assertAlmostEqual(0.00512, histogram.percentile(99))
+        self.assertEqual(0.2, histogram.percentile(100))
+        self.assertEqual(0.2, histogram.max)
+
+
+if __name__ == '__main__':
+    unittest.main()
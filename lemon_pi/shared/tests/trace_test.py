@@ -0,0 +1,76 @@
+import os
+import tempfile
+import unittest
+
+from lemon_pi.shared.clock import Clock, SimulatedClock
+from lemon_pi.shared.events import Event
+from lemon_pi.shared.trace import Trace
+from lemon_pi.utils.trace_decoder import decode
+
+TEST_POINT = Trace.point("trace test")
+TracedEvent = Event("trace-test", debounce_time=5)
+
+
+class TraceTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.clock = SimulatedClock(1000)
+        Clock.set_instance(self.clock)
+        Trace.init(8)
+
+    def tearDown(self) -> None:
+        Trace.init()
+        Clock.reset()
+
+    def test_records_in_order(self):
+        for i in range(5):
+            self.clock.advance(1)
+            Trace.record(TEST_POINT, i, i * 2)
+        records = Trace.records()
+        self.assertEqual(5, len(records))
+        self.assertEqual((1001.0, TEST_POINT, 0.0, 0.0, 0.0), records[0])
+        self.assertEqual((1005.0, TEST_POINT, 4.0, 8.0, 0.0), records[-1])
+
+    def test_oldest_overwritten(self):
+        for i in range(20):
+            Trace.record(TEST_POINT, i)
+        self.assertEqual(list(range(12, 20)), [record[2] for record in Trace.records()])
+
+    def test_points_registered_once(self):
+        self.assertEqual(TEST_POINT, Trace.point("trace test"))
+        self.assertEqual("trace test", Trace.points[TEST_POINT])
+
+    def test_emits_traced(self):
+        TracedEvent.last_event_time = 0
+        TracedEvent.emit()
+        TracedEvent.emit()
+        records = Trace.records()
+        self.assertEqual([(TracedEvent.trace_point, 0.0), (TracedEvent.trace_point, 1.0)],
+                         [(record[1], record[2]) for record in records])
+
+    def test_dump_and_decode(self):
+        for i in range(10):
+            self.clock.advance(0.5)
+            Trace.record(TEST_POINT, 38.16, -122.45, i)
+        with tempfile.TemporaryDirectory() as dir:
+            file = os.path.join(dir, "trace.bin")
+            self.assertEqual(8, Trace.dump(file))
+            names, records = Trace.load(file)
+            self.assertEqual(Trace.points, names)
+            self.assertEqual(Trace.records(), records)
+            lines = decode(file, only="trace test", last=2)
+        self.assertEqual(2, len(lines))
+        self.assertIn("trace test", lines[0])
+        self.assertTrue(lines[-1].endswith("38.160000 -122.450000 9.000000"))
+
+    def test_not_a_trace(self):
+        with tempfile.TemporaryDirectory() as dir:
+            file = os.path.join(dir, "trace.bin")
+            with open(file, "wb") as f:
+                f.write(b"not a trace at all")
+            with self.assertRaises(ValueError):
+                Trace.load(file)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import logging
+import struct
+
+from lemon_pi.shared.clock import Clock
+
+logger = logging.getLogger(__name__)
+
+# how many records are kept before the oldest are overwritten, about 2.4MB of them
+TRACE_RECORDS = 65536
+
+# each record is the time, the trace point and three numbers
+RECORD = struct.Struct("<dI3d")
+
+# a dump starts with these, then the number of trace points and records
+MAGIC = b"LPTRACE1"
+HEADER = struct.Struct("<8sII")
+NAME_LENGTH = struct.Struct("<H")
+
+
+class Trace:
+    # A fixed size ring of binary records, for the things that happen on
+    # every gps fix and every event, which are too frequent to log. Recording
+    # is packing a few numbers into a buffer that was allocated up front, so
+    # there's no string formatting and no file I/O. The ring is written out
+    # to a file when asked, or when the car crashes, and read back with
+    #   python -m lemon_pi.utils.trace_decoder <file>
+    #
+    # A trace point is registered by name once, and records refer to it by
+    # number. What the three numbers in a record mean is up to the point.
+
+    points: [str] = []
+    size = TRACE_RECORDS
+    buffer = bytearray(TRACE_RECORDS * RECORD.size)
+    # the number of records written so far. This isn't locked, two threads
+    # recording at once can overwrite one another's record
+    written = 0
+
+    # resize the ring, dropping what has been recorded so far
+    @classmethod
+    def init(cls, size: int = TRACE_RECORDS):
+        Trace.size = size
+        Trace.buffer = bytearray(size * RECORD.size)
+        Trace.written = 0
+
+    # the number that records for the named point are made with, registering it if it's new
+    @classmethod
+    def point(cls, name: str) -> int:
+        if name not in Trace.points:
+            Trace.points.append(name)
+        return Trace.points.index(name)
+
+    # record the point now, or at the time given, which saves asking the clock when the caller already has
+    @classmethod
+    def record(cls, point: int, a: float = 0.0, b: float = 0.0, c: float = 0.0, tstamp: float = None):
+        index = Trace.written
+        Trace.written = index + 1
+        RECORD.pack_into(Trace.buffer, (index % Trace.size) * RECORD.size,
+                         Clock.get_instance().time() if tstamp is None else tstamp, point, a, b, c)
+
+    # the records in the ring, oldest first, as (time, point, a, b, c)
+    @classmethod
+    def records(cls) -> [(float, int, float, float, float)]:
+        written, size = Trace.written, Trace.size
+        data = bytes(Trace.buffer)
+        if written <= size:
+            data = data[:written * RECORD.size]
+        else:
+            start = (written % size) * RECORD.size
+            data = data[start:] + data[:start]
+        return list(RECORD.iter_unpack(data))
+
+    # write the ring out to a file, returning how many records were written
+    @classmethod
+    def dump(cls, file: str) -> int:
+        records = Trace.records()
+        with open(file, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(Trace.points), len(records)))
+            for name in Trace.points:
+                encoded = name.encode("UTF-8")
+                f.write(NAME_LENGTH.pack(len(encoded)))
+                f.write(encoded)
+            for record in records:
+                f.write(RECORD.pack(*record))
+        logger.info(f"wrote {len(records)} trace records to {file}")
+        return len(records)
+
+    # read a dump back, as the point names and the records, oldest first
+    @classmethod
+    def load(cls, file: str) -> ([str], [(float, int, float, float, float)]):
+        with open(file, "rb") as f:
+            data = f.read()
+        magic, point_count, record_count = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError(f"{file} is not a trace")
+        offset = HEADER.size
+        names = []
+        for _ in range(point_count):
+            (length,) = NAME_LENGTH.unpack_from(data, offset)
+            offset += NAME_LENGTH.size
+            names.append(data[offset:offset + length].decode("UTF-8"))
+            offset += length
+        records = list(RECORD.iter_unpack(data[offset:offset + record_count * RECORD.size]))
+        return names, records
@@ -1,7 +1,6 @@
 
 from lemon_pi.car.gps_reader import GpsReader
 import logging
-from lemon_pi.car.movement_listener import MovementListener
 
 if __name__ == "__main__":
 
@@ -9,6 +8,6 @@ if __name__ == "__main__":
                         datefmt='%Y-%m-%d %H:%M:%S',
                         level=logging.INFO)
 
-    MovementListener()
+    # the gps reader works out whether the car is moving, and logs when that changes
     tracker = GpsReader()
     tracker.start()
\ No newline at end of file
@@ -0,0 +1,32 @@
+#
+# Prints a trace written out by the car, one record a line, oldest first
+#
+#   python -m lemon_pi.utils.trace_decoder logs/trace-2023-05-27-101500.bin
+#
+import argparse
+from datetime import datetime
+
+from lemon_pi.shared.trace import Trace
+
+
+def decode(file: str, only: str = None, last: int = 0) -> [str]:
+    names, records = Trace.load(file)
+    lines = []
+    for tstamp, point, a, b, c in records:
+        name = names[point] if point < len(names) else f"point-{point}"
+        if only and only not in name:
+            continue
+        dt = datetime.fromtimestamp(tstamp)
+        lines.append(f"{dt:%Y-%m-%d %H:%M:%S}.{dt.microsecond // 1000:03d} {name:<24} {a:.6f} {b:.6f} {c:.6f}")
+    return lines[-last:] if last else lines
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="print the records in a trace")
+    arg_parser.add_argument("file", help="the trace written out by the car")
+    arg_parser.add_argument("--only", help="only the trace points with this in their name")
+    arg_parser.add_argument("--last", type=int, default=0, help="only the most recent records")
+    args = arg_parser.parse_args()
+
+    for line in decode(args.file, args.only, args.last):
+        print(line)